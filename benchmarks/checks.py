@@ -0,0 +1,69 @@
+'''
+Offline checks of the cleaning rules against known cases (no DIP API), in addition to the benchmarks.
+
+Run from the root folder of the repository:
+    python -m benchmarks.checks
+
+Every check returns a list of problems (empty if everything is fine); the exit code is 1, if there is a problem.
+'''
+import sys
+import pandas as pd
+from src.people import get_speaker_matcher
+from src.preprocessing import identify_interruptions, interruption_records
+
+
+# Presiding persons of the former clean_protocols (known_names): a main text starting with one of them has to be found
+KNOWN_NAMES = ['Präsident Dr. Wolfgang Schäuble:', 'Präsident Dr. Wolfgang Schäuble :',
+               'Präsident Dr. Norbert Lammert:', 'Präsident Dr. Norbert Lammert:', 'Präsident Prof. Dr. Norbert Lammert:', 'Präsident Dr. Norbert Lammert :', 'Präsident Dr. Norbert Lammert :',
+               'Vizepräsidentin Claudia Roth:', 'Vizepräsident Dr. Hans-Peter Friedrich', 'Vizepräsident Wolfgang Kubicki',
+               'Vizepräsident Thomas Oppermann:', 'Vizepräsidentin Petra Pau:', 'Alterspräsident Dr. Hermann Otto Solms:',
+               'Vizepräsident Johannes Singhammer:', 'Vizepräsidentin Ulla Schmidt:', 'Vizepräsident Peter Hintze:',
+               'Vizepräsidentin Edelgard Bulmahn:', 'Alterspräsident Dr. Heinz Riesenhuber:']
+
+
+def check_presiding_names():
+    '''
+    Returns the names of KNOWN_NAMES, which are not found at the start of a text by the 'presiding' patterns
+    of the speaker matcher (see people.get_neutral_persons, load_data.get_relevant_text).
+    '''
+    matcher = get_speaker_matcher()
+    return [name for name in KNOWN_NAMES if not matcher.match(name + '\nText', 'presiding')]
+
+
+# Interruption of example_text_from_api.txt with a follow-up remark ("Sie müssen mich erst fragen!" is said by Claudia Roth)
+FOLLOW_UP = ('(Beifall im ganzen Hause – Claudia Roth [Augsburg] [BÜNDNIS 90/DIE GRÜNEN]: Ja, Herr Präsident! '
+             '– Sie müssen mich erst fragen!)')
+
+
+def check_follow_up_remarks():
+    '''
+    Returns the parts of FOLLOW_UP, which interruption_records does not assign as expected (kind, speaker, party).
+    '''
+    expected = [('Beifall im ganzen Hause', 'Beifall', None, None),
+                ('Ja, Herr Präsident!', 'Zuruf', 'Claudia Roth', 'BÜNDNIS 90/DIE GRÜNEN'),
+                ('Sie müssen mich erst fragen!', 'Zuruf', 'Claudia Roth', 'BÜNDNIS 90/DIE GRÜNEN')]
+    protocols = identify_interruptions(pd.DataFrame({'id': ['1'], 'text': [f'Text\n{FOLLOW_UP}\nText\n']}))
+    records = interruption_records(protocols)
+    found = [(text, kind, speaker if pd.notna(speaker) else None, party if pd.notna(party) else None)
+             for text, kind, speaker, party in records[['text', 'kind', 'speaker', 'party']].itertuples(index = False)]
+    if len(found) != len(expected):
+        return [f'erwartet {len(expected)} Teile, gefunden {len(found)}: {found}']
+    return [f'erwartet {e}, gefunden {f}' for e, f in zip(expected, found) if e != f]
+
+
+CHECKS = [check_presiding_names, check_follow_up_remarks]
+
+
+def main():
+    failed = False
+    for check in CHECKS:
+        problems = check()
+        print(f"{check.__name__:<32} {'ok' if not problems else 'FEHLER'}")
+        for problem in problems:
+            print(f'  {problem}')
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
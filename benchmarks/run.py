@@ -0,0 +1,167 @@
+'''
+Benchmarks for every stage of the pipeline on synthetic protocols (see synthetic.py), offline (no DIP API).
+
+Run from the root folder of the repository:
+    python -m benchmarks.run                   # compare with benchmarks/baseline.json
+    python -m benchmarks.run --save-baseline   # store the results as new baseline
+    python -m benchmarks.run --sizes 10 40 160 --speeches 100 --interruption-rate 0.5
+
+For every stage and size, the best time of `repeat` runs (throughput in protocols and MB per second)
+and the peak memory allocated by the stage (tracemalloc) are recorded.
+A stage is reported as regression, if it is more than `tolerance` slower (and at least `min_seconds` slower,
+so the noise of very short stages does not count) or needs more than `memory_tolerance` more memory than in the baseline.
+
+The default tolerance (1.0, i.e. twice as slow) is above the noise of the timings: on a shared single-CPU container,
+the best of 5 runs of the same stage varied by up to 70 % between runs of this script (the median of 11 runs
+did not vary less), so a lower tolerance reports regressions without a change of the code.
+The peak memory does not depend on the machine load (less than 20 % difference), so memory_tolerance is 0.3.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import pandas as pd
+from benchmarks.synthetic import make_textdata, make_metadata, make_persons, make_speakers
+from src.registry import PersonRegistry
+from src.load_data import clean_protocols, get_metadata_table
+from src.preprocessing import (identify_interruptions, remove_president_text, clean_gov_persons,
+                               party_shares_main, party_shares_inter, add_metadata)
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def get_stages(registry, metadata):
+    '''
+    Returns the stages in pipeline order as (name, input, function): input is the stage, whose result the function gets
+    ('textdata': the synthetic protocols, 'party_shares': results of party_shares_main and party_shares_inter).
+    '''
+    return [
+        ('clean_protocols', 'textdata',
+         lambda df: clean_protocols(df)[['id', 'text_relevant']].rename(columns = {'text_relevant': 'text'})),
+        ('identify_interruptions', 'clean_protocols', identify_interruptions),
+        ('remove_president_text', 'identify_interruptions', lambda df: remove_president_text(df, registry = registry)),
+        ('clean_gov_persons', 'remove_president_text', clean_gov_persons),
+        ('party_shares_main', 'clean_gov_persons', party_shares_main),
+        ('party_shares_inter', 'clean_gov_persons', party_shares_inter),
+        ('add_metadata', 'party_shares', lambda df: add_metadata(df, metadata = metadata)),
+    ]
+
+
+def measure(func, data, repeat):
+    '''
+    Returns the result, the best time (in seconds) of `repeat` runs and the peak memory allocated by one run (in bytes).
+    '''
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(data.copy())
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(data.copy())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def run(sizes = (10, 20, 40), speeches = 200, speakers = 30, interruption_rate = 0.3, repeat = 5):
+    '''
+    Runs all stages for every size (number of protocols) and returns the results as list of dicts
+    (stage, protocols, mb, seconds, protocols_per_s, mb_per_s, peak_mb).
+    '''
+    registry = PersonRegistry.build(make_persons(make_speakers(speakers)))
+    results = []
+
+    for size in sizes:
+        textdata = make_textdata(size, n_speeches = speeches, n_speakers = speakers, interruption_rate = interruption_rate)
+        metadata = get_metadata_table(make_metadata(textdata['id']))
+        mb = textdata['text'].str.len().sum() / 2**20
+        data = {'textdata': textdata}
+
+        for name, stage_input, func in get_stages(registry, metadata):
+            if stage_input == 'party_shares':
+                data['party_shares'] = pd.concat([data['party_shares_main'], data['party_shares_inter']], ignore_index = True)
+
+            data[name], seconds, peak = measure(func, data[stage_input], repeat)
+            results.append({'stage': name, 'protocols': size, 'mb': round(mb, 3), 'seconds': round(seconds, 4),
+                            'protocols_per_s': round(size / seconds, 2), 'mb_per_s': round(mb / seconds, 3),
+                            'peak_mb': round(peak / 2**20, 2)})
+            print(f'{name:<24} {size:>5} protocols  {seconds:8.3f} s  {mb / seconds:8.2f} MB/s  {peak / 2**20:8.1f} MB peak')
+
+    return results
+
+
+def compare(results, baseline, tolerance = 1.0, min_seconds = 0.01, memory_tolerance = 0.3):
+    '''
+    Compares results with a baseline (same stage and size) and returns the regressions:
+    stages which are more than `tolerance` (e.g. 1.0 = 100 %) and min_seconds slower
+    or need more than `memory_tolerance` (e.g. 0.3 = 30 %) more memory.
+    '''
+    old = {(r['stage'], r['protocols']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        b = old.get((r['stage'], r['protocols']))
+        if b is None:
+            continue
+        time_ratio = r['seconds'] / b['seconds'] if b['seconds'] else 1
+        memory_ratio = r['peak_mb'] / b['peak_mb'] if b['peak_mb'] else 1
+        print(f"{r['stage']:<24} {r['protocols']:>5} protocols  time x{time_ratio:5.2f}  memory x{memory_ratio:5.2f}")
+        slower = time_ratio > 1 + tolerance and r['seconds'] - b['seconds'] > min_seconds
+        if slower or memory_ratio > 1 + memory_tolerance:
+            regressions.append({**r, 'time_ratio': round(time_ratio, 2), 'memory_ratio': round(memory_ratio, 2)})
+    return regressions
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmarks of the pipeline stages on synthetic protocols')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [10, 20, 40], help = 'numbers of protocols')
+    parser.add_argument('--speeches', type = int, default = 200, help = 'speeches per protocol')
+    parser.add_argument('--speakers', type = int, default = 30, help = 'different MdB')
+    parser.add_argument('--interruption-rate', type = float, default = 0.3, help = 'interruptions per paragraph')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--tolerance', type = float, default = 1.0, help = 'allowed share of additional time')
+    parser.add_argument('--min-seconds', type = float, default = 0.01)
+    parser.add_argument('--memory-tolerance', type = float, default = 0.3, help = 'allowed share of additional memory')
+    parser.add_argument('--baseline', default = BASELINE)
+    parser.add_argument('--save-baseline', action = 'store_true')
+    parser.add_argument('--output', help = 'store the results in this JSON file')
+    args = parser.parse_args(argv)
+
+    config = {'sizes': args.sizes, 'speeches': args.speeches, 'speakers': args.speakers,
+              'interruption_rate': args.interruption_rate, 'repeat': args.repeat}
+    results = run(**config)
+    report = {'machine': platform.platform(), 'python': platform.python_version(), 'config': config, 'results': results}
+
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as f:
+            json.dump(report, f, indent = 1)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding = 'utf-8') as f:
+            json.dump(report, f, indent = 1)
+        print(f'Baseline gespeichert: {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'Keine Baseline gefunden ({args.baseline}), mit --save-baseline anlegen.')
+        return 0
+
+    with open(args.baseline, encoding = 'utf-8') as f:
+        baseline = json.load(f)
+    if baseline['config'] != config:
+        print('Achtung: die Baseline wurde mit anderen Einstellungen gemessen, nur gleiche Stufen und Größen werden verglichen.')
+    if baseline['machine'] != report['machine']:
+        print(f"Achtung: die Baseline wurde auf einem anderen Rechner gemessen ({baseline['machine']}).")
+
+    regressions = compare(results, baseline, args.tolerance, args.min_seconds, args.memory_tolerance)
+    for r in regressions:
+        print(f"Regression: {r['stage']} ({r['protocols']} Protokolle) time x{r['time_ratio']}, memory x{r['memory_ratio']}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
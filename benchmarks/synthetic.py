@@ -0,0 +1,122 @@
+import random
+import pandas as pd
+from src.people import get_parties, get_neutral_persons, get_regierende
+
+
+FIRST_NAMES = ['Anna', 'Bernd', 'Claudia', 'Dieter', 'Eva', 'Frank', 'Gabriele', 'Heinz', 'Ines', 'Jürgen',
+               'Karin', 'Lars', 'Monika', 'Norbert', 'Petra', 'Ralf', 'Sabine', 'Thomas', 'Ute', 'Werner']
+LAST_NAMES = ['Müller', 'Schmidt', 'Schneider', 'Fischer', 'Weber', 'Meyer', 'Wagner', 'Becker', 'Schulz', 'Hoffmann',
+              'Koch', 'Richter', 'Klein', 'Wolf', 'Schröder', 'Neumann', 'Schwarz', 'Zimmermann', 'Braun', 'Krüger']
+WORDS = ['Bundesregierung', 'Antrag', 'Gesetz', 'Kolleginnen', 'Kollegen', 'Haushalt', 'Klimaschutz', 'Migration',
+         'Familie', 'Rente', 'Bildung', 'Digitalisierung', 'Europa', 'Sicherheit', 'Arbeit', 'Wirtschaft', 'wir', 'die',
+         'der', 'und', 'nicht', 'müssen', 'haben', 'heute', 'Menschen', 'Land', 'Zukunft', 'Verantwortung', 'wichtig', 'sehr']
+APPLAUSE = ['Beifall bei der {0}', 'Beifall bei Abgeordneten der {0}', 'Heiterkeit bei der {0}', 'Widerspruch bei der {0}',
+            'Beifall bei der {0} und der {1}', 'Lachen bei Abgeordneten der {0}']
+CALLS = ['Stimmt!', 'Das ist doch Unsinn!', 'Hört! Hört!', 'Sehr richtig!', 'Wo ist denn das Geld?', 'Nein!']
+
+
+def make_speakers(n_speakers = 20, seed = 0):
+    '''
+    Returns n_speakers synthetic MdB as [name, party] (parties of get_parties, without "parteilos").
+    '''
+    rng = random.Random(seed)
+    parties = get_parties()[:-1]
+    names = sorted({f'{f} {l}' for f in FIRST_NAMES for l in LAST_NAMES})
+    return [[name, rng.choice(parties)] for name in rng.sample(names, n_speakers)]
+
+
+def make_sentence(rng, min_words = 6, max_words = 20):
+    sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+    return sentence[0].upper() + sentence[1:] + rng.choice(['.', '.', '.', '!', '?'])
+
+
+def make_interruption(rng, speakers):
+    '''
+    Returns an interruption in the format of the protocols, e.g. "(Beifall bei der SPD – Anna Müller [SPD]: Stimmt!)".
+    '''
+    parties = get_parties()[:-1]
+    parts = []
+    for _ in range(rng.choice([1, 1, 1, 2, 3])):
+        if rng.random() < 0.5:
+            parts.append(rng.choice(APPLAUSE).format(*rng.sample(parties, 2)))
+        else:
+            name, party = rng.choice(speakers)
+            parts.append(f'{name} [{party}]: {rng.choice(CALLS)}')
+    return '(' + ' – '.join(parts) + ')'
+
+
+def make_protocol(n_speeches = 50, n_speakers = 20, interruption_rate = 0.3, paragraphs = (2, 6), seed = 0):
+    '''
+    Returns the text of a synthetic Plenarprotokoll in the format of the DIP API (see src/example_text_from_api.txt):
+    title and contents, then the sitting with speeches of presiding persons, MdB (e.g. "Anna Müller (SPD):")
+    and government persons (e.g. "Dr. Angela Merkel, Bundeskanzlerin:"), with interruptions in parentheses.
+
+    Params:
+     int: n_speeches (number of speeches, every second one is a short one of the presiding person)
+     int: n_speakers (number of different MdB)
+     float: interruption_rate (probability of an interruption after a paragraph)
+     tuple: paragraphs (min. and max. number of paragraphs per speech)
+     int: seed
+
+    Returns:
+     str: protocol text
+    '''
+    rng = random.Random(seed)
+    speakers = make_speakers(n_speakers, seed)
+    presiding = [p for p in get_neutral_persons() if p.endswith(':')]
+    government = get_regierende()
+    chair = rng.choice(presiding)
+
+    lines = ['Deutscher Bundestag', 'Stenografischer Bericht', f'{seed + 1}. Sitzung', 'Inhalt:']
+    lines += [f'Tagesordnungspunkt {i + 1}: {make_sentence(rng, 3, 8)}' for i in range(5)]
+    lines += ['\n\n\n\n\n', chair, 'Die Sitzung ist eröffnet.']
+
+    for i in range(n_speeches):
+        if i % 2 == 0:
+            lines += [chair, make_sentence(rng)]
+            continue
+        if rng.random() < 0.1:
+            lines.append(f'{rng.choice(government)}:')
+        else:
+            name, party = rng.choice(speakers)
+            lines.append(f'{name} ({party}):')
+        for _ in range(rng.randint(*paragraphs)):
+            lines.append(' '.join(make_sentence(rng) for _ in range(rng.randint(2, 6))))
+            if rng.random() < interruption_rate:
+                lines.append(make_interruption(rng, speakers))
+
+    lines += [chair, 'Die Sitzung ist geschlossen.', '(Schluss: 18.00 Uhr)']
+    return ' \n'.join(lines) + ' \n'
+
+
+def make_textdata(n_protocols = 10, first_id = 1000, **kwargs):
+    '''
+    Returns n_protocols synthetic protocols as dataframe with columns id, text (like load_data.get_textdata with pure_text=False).
+    kwargs are passed on to make_protocol.
+    '''
+    seed = kwargs.pop('seed', 0)
+    texts = [make_protocol(seed = seed + i, **kwargs) for i in range(n_protocols)]
+    return pd.DataFrame({'id': [str(first_id + i) for i in range(n_protocols)], 'text': texts})
+
+
+def make_metadata(ids):
+    '''
+    Returns synthetic metadata (like load_data.get_metadata) for the given protocol ids.
+    '''
+    return [{'id': str(protocol_id), 'wahlperiode': 18 + i % 2, 'datum': f'2017-{i % 12 + 1:02d}-{i % 28 + 1:02d}',
+             'dokumentnummer': f'{18 + i % 2}/{i + 1}', 'titel': f'Protokoll {i + 1}', 'herausgeber': 'BT',
+             'dokumentart': 'Plenarprotokoll', 'aktualisiert': '2023-01-01T00:00:00+01:00', 'pdf_hash': str(i)}
+            for i, protocol_id in enumerate(ids)]
+
+
+def make_persons(speakers):
+    '''
+    Returns DIP person records (like people.get_persons) for synthetic speakers (see make_speakers).
+    '''
+    persons = []
+    for i, (name, party) in enumerate(speakers):
+        first, last = name.split(' ', 1)
+        persons.append({'id': str(i), 'vorname': first, 'nachname': last, 'wahlperiode': 18,
+                        'person_roles': [{'funktion': 'MdB', 'fraktion': party, 'vorname': first, 'nachname': last,
+                                          'wahlperiode_nummer': [18, 19]}]})
+    return persons
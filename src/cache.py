@@ -0,0 +1,79 @@
+import os
+import json
+import gzip
+
+
+def get_version(record):
+    '''
+    Returns the version of a DIP record, which changes whenever the document is updated.
+
+    Params:
+     dict: record (metadata of a protocol or person)
+
+    Returns:
+     list: [aktualisiert, pdf_hash]
+    '''
+    return [record.get('aktualisiert'), record.get('pdf_hash')]
+
+
+class ResponseCache:
+    '''
+    Local cache for the raw JSON responses of the DIP API, stored gzip-compressed on disk:
+    <path>/<resource>/<id>.json.gz
+
+    For every entry the version (see get_version) is kept in <path>/index.json,
+    so new or changed documents can be recognized without downloading everything again.
+    Call save() after adding entries to persist the index.
+    '''
+    def __init__(self, path = 'cache'):
+        self.path = path
+        self.index_path = os.path.join(path, 'index.json')
+        os.makedirs(path, exist_ok = True)
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding = 'utf-8') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+    def _file(self, resource, key):
+        return os.path.join(self.path, resource, f'{key}.json.gz')
+
+    def get(self, resource, key):
+        '''
+        Returns the cached response for resource/key or None, if there is none.
+        '''
+        file = self._file(resource, key)
+        if not os.path.exists(file):
+            return None
+        with gzip.open(file, 'rt', encoding = 'utf-8') as f:
+            return json.load(f)
+
+    def put(self, resource, key, data, version = None):
+        '''
+        Stores a response (write to temporary file first, so a crash never leaves half-written entries).
+        '''
+        file = self._file(resource, key)
+        os.makedirs(os.path.dirname(file), exist_ok = True)
+        with gzip.open(file + '.tmp', 'wt', encoding = 'utf-8') as f:
+            json.dump(data, f, ensure_ascii = False)
+        os.replace(file + '.tmp', file)
+        self.index.setdefault(resource, {})[str(key)] = version
+
+    def is_fresh(self, resource, key, version):
+        '''
+        Returns True, if resource/key is cached in exactly this version.
+        '''
+        entries = self.index.get(resource, {})
+        return str(key) in entries and entries[str(key)] == version and os.path.exists(self._file(resource, key))
+
+    def stale_keys(self, resource, versions):
+        '''
+        Returns all keys of a dict {key: version}, which are not cached or cached in another version.
+        '''
+        return [key for key, version in versions.items() if not self.is_fresh(resource, key, version)]
+
+    def save(self):
+        with open(self.index_path + '.tmp', 'w', encoding = 'utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(self.index_path + '.tmp', self.index_path)
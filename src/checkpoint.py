@@ -0,0 +1,165 @@
+import os
+import json
+import hashlib
+from contextlib import nullcontext
+import numpy as np
+import pandas as pd
+from src.people import get_parties, get_neutral_persons, get_regierende
+from src.cache import get_version
+from src.load_data import get_metadata, get_metadata_table
+from src.preprocessing import clean_and_split_text, party_shares, add_metadata, to_categories
+from src.registry import get_registry
+
+
+def hash_content(*parts):
+    '''
+    Returns a sha1 hash over all given parts (converted to str).
+    '''
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\x1f') # separator, so ('ab', 'c') and ('a', 'bc') get different hashes
+    return h.hexdigest()
+
+
+def get_rules_version():
+    '''
+    Returns a hash over the rule tables used by the cleaning stages (parties, neutral persons, government persons).
+    Whenever one of these lists is changed in people.py, the hash changes and all protocols are processed again.
+
+    Returns:
+     str: version hash
+    '''
+    return hash_content(get_parties(), get_neutral_persons(), get_regierende(include_party = True))
+
+
+class StageCheckpoint:
+    '''
+    Persistent result of one pipeline stage, stored in <path>/<stage>.pkl (result) and <path>/<stage>.json (hashes).
+
+    For every protocol id the hash of the stage input is stored. update() recomputes only protocols whose hash changed
+    (or which are new), and merges them into the stored result. Protocols that are no longer in the input are dropped.
+    '''
+    def __init__(self, path, stage):
+        self.result_path = os.path.join(path, f'{stage}.pkl')
+        self.hash_path = os.path.join(path, f'{stage}.json')
+        os.makedirs(path, exist_ok = True)
+
+        if os.path.exists(self.result_path) and os.path.exists(self.hash_path):
+            self.result = pd.read_pickle(self.result_path)
+            with open(self.hash_path, encoding = 'utf-8') as f:
+                self.hashes = json.load(f)
+        else:
+            self.result = pd.DataFrame(columns = ['id'])
+            self.hashes = {}
+
+    def update(self, hashes, compute, group = None):
+        '''
+        Params:
+         dict: hashes (protocol id -> hash of the current input, in the order of the input)
+         function: compute (gets a list of protocol ids, returns the stage result for them with column 'id')
+         str: group (optional column, which comes before the id in the order of the result, e.g. text_type)
+
+        Returns:
+         pd.DataFrame: merged result for all protocols in hashes
+         list: ids, which were recomputed
+        '''
+        hashes = {str(protocol_id): h for protocol_id, h in hashes.items()}
+        changed = [protocol_id for protocol_id, h in hashes.items() if self.hashes.get(protocol_id) != h]
+
+        old_ids = self.result['id'].astype(str)
+        kept = self.result[old_ids.isin(hashes) & ~old_ids.isin(changed)]
+        new = compute(changed) if changed else kept.iloc[0:0]
+
+        # Restore the order of the input (rows of one protocol keep their order)
+        result = pd.concat([kept, new], ignore_index = True)
+        position = {protocol_id: i for i, protocol_id in enumerate(hashes)}
+        keys = [result['id'].astype(str).map(position).to_numpy()]
+        if group is not None:
+            keys.append(pd.factorize(result[group])[0])
+        result = result.iloc[np.lexsort(keys)].reset_index(drop = True) # lexsort is stable, last key sorts first
+
+        self.result, self.hashes = result, hashes
+        result.to_pickle(self.result_path)
+        with open(self.hash_path, 'w', encoding = 'utf-8') as f:
+            json.dump(hashes, f)
+
+        return result, changed
+
+
+def run_incremental(textdata, path = 'checkpoints', metadata = None, cache = None, workers = 1, chunksize = 10,
+                    low_memory = False, report = None, stats = None):
+    '''
+    Runs clean_and_split_text -> party_shares -> add_metadata with a persistent checkpoint per stage (see StageCheckpoint).
+    Only protocols whose text, metadata, rule tables (see get_rules_version) or person registry (see registry.get_registry,
+    built again from the API every max_age days) changed since the last run are processed again.
+    The result is the same as running the three stages on the full data.
+
+    Params:
+     pd.DataFrame: textdata (columns id, text, e.g. result of get_textdata)
+     str: path (folder for the checkpoints)
+     list: metadata (optional, result of get_metadata; loaded if not given)
+     ResponseCache: cache (optional, see cache.py)
+     int: workers (number of processes for the first two stages, see preprocessing.clean_and_split_text)
+     int: chunksize (number of protocols per task of a worker)
+     bool: low_memory (see preprocessing.clean_and_split_text; the results of the earlier stages are released
+                       as soon as the next stage is done, they are still stored in the checkpoints)
+     MemoryReport: report (optional, collects the peak memory per stage, see memory.py)
+     StatsCube: stats (optional, updated with the recomputed protocols and saved, if it has a path, see corpus_stats.py)
+
+    Returns:
+     pd.DataFrame: data split into party contributions. Columns: id, party, text, text_type, text_length, num_words, wahlperiode, datum
+    '''
+    if metadata is None:
+        metadata = get_metadata(cache = cache)
+    # The cleaning depends on the rule tables and on the persons of the registry (MdB names, headers)
+    registry = get_registry(cache = cache)
+    rule_tables = get_rules_version()
+    rules = hash_content(rule_tables, registry.version())
+    measure = report.stage if report is not None else nullcontext
+
+    # Stage 1: cleaning, depends on the protocol text, all rule tables and the person registry
+    # (the rows to recompute are selected with isin, so there is no full copy of the texts)
+    with measure('clean'):
+        textdata_ids = textdata['id'].astype(str)
+        hashes = {protocol_id: hash_content(rules, text) for protocol_id, text in zip(textdata_ids, textdata['text'])}
+        clean, _ = StageCheckpoint(path, 'clean').update(
+            hashes, lambda ids: clean_and_split_text(textdata[textdata_ids.isin(ids)].reset_index(drop = True), cache = cache,
+                                              workers = workers, chunksize = chunksize, low_memory = low_memory,
+                                              registry = registry))
+
+    # Stage 2: party shares, depends on the cleaned text and the rule tables
+    # (interruption_records finds the speakers of interruptions with the government table)
+    with measure('party_shares'):
+        clean_ids = clean['id'].astype(str)
+        hashes = {protocol_id: hash_content(rule_tables, main_text, interruptions)
+                  for protocol_id, main_text, interruptions in zip(clean_ids, clean['main_text'], clean['interruptions'])}
+        shares, _ = StageCheckpoint(path, 'party_shares').update(
+            hashes, lambda ids: party_shares(clean[clean_ids.isin(ids)].reset_index(drop = True), workers = workers,
+                                             chunksize = chunksize, low_memory = low_memory),
+            group = 'text_type')
+        if low_memory:
+            del clean, clean_ids
+
+    # Stage 3: metadata, depends on the party shares and the metadata version of the protocol
+    with measure('metadata'):
+        versions = {str(md['id']): get_version(md) for md in metadata}
+        metadata_table = get_metadata_table(metadata)
+        shares_by_id = shares.groupby(shares['id'].astype(str), sort = False)
+        hashes = {protocol_id: hash_content(versions.get(protocol_id), rows[['party', 'text', 'text_type']].values.tolist())
+                  for protocol_id, rows in shares_by_id}
+        result, changed = StageCheckpoint(path, 'metadata').update(
+            hashes, lambda ids: add_metadata(shares[shares['id'].astype(str).isin(ids)].copy(), metadata = metadata_table),
+            group = 'text_type')
+        if low_memory:
+            del shares, shares_by_id
+            to_categories(result)
+
+    # Statistics: only recomputed protocols and protocols, which are not in the cube yet
+    if stats is not None:
+        missing = set(changed) | (set(hashes) - stats.ids())
+        stats.update(result[result['id'].astype(str).isin(missing)], keep = hashes)
+        if stats.path is not None:
+            stats.save()
+
+    return result
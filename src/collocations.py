@@ -0,0 +1,157 @@
+from collections import Counter
+import numpy as np
+import pandas as pd
+from src.dtm import POS, tokenize
+from src.parallel import map_protocols
+from src.instrumentation import stage
+
+
+def ngram_counts(tokens, sizes, counts):
+    '''
+    Adds the n-grams of a list of tokens (None: removed stopword, no n-gram goes across it) to counts:
+    counts[n] (n-grams), counts['left', n] (first n-1 words of an n-gram), counts['right', n] (last word of an n-gram)
+    and counts['total', n] (number of n-grams).
+    '''
+    for n in sizes:
+        grams, left, right = counts[n], counts['left', n], counts['right', n]
+        total = 0
+        for i in range(len(tokens) - n + 1):
+            gram = tuple(tokens[i:i + n])
+            if None in gram:
+                continue
+            grams[gram] += 1
+            left[gram[:-1]] += 1
+            right[gram[-1]] += 1
+            total += 1
+        counts['total', n] += total
+
+
+def prune(counter, max_size):
+    '''
+    Removes the rarest entries of a Counter (count 1, then 2, ...), until it has at most max_size entries.
+    '''
+    threshold = 1
+    while len(counter) > max_size:
+        for key in [key for key, count in counter.items() if count <= threshold]:
+            del counter[key]
+        threshold += 1
+
+
+def new_counts(sizes):
+    counts = {}
+    for n in sizes:
+        counts[n], counts['left', n], counts['right', n], counts['total', n] = Counter(), Counter(), Counter(), 0
+    return counts
+
+
+def count_ngrams(protocols, column = 'text', sizes = (2, 3), lemmatizer = 'spacy', pos = POS, stopwords = frozenset(),
+                 model = 'de_core_news_sm', max_size = None):
+    '''
+    Counts the n-grams of all texts of a chunk (see ngram_counts) and returns them as dataframe with 1 row
+    (column counts), so it can run in parallel (see parallel.map_protocols).
+    The tokens are the same as in the document-term matrix (see dtm.tokenize), stopwords end an n-gram.
+    '''
+    counts = new_counts(sizes)
+    for tokens in tokenize(protocols[column].fillna('').tolist(), lemmatizer, pos, model):
+        ngram_counts([None if t in stopwords else t for t in tokens], sizes, counts)
+    if max_size is not None:
+        for n in sizes:
+            prune(counts[n], max_size)
+    return pd.DataFrame({'counts': [counts]})
+
+
+class CollocationFinder:
+    '''
+    Finds collocations (n-grams, which occur more often than their words would suggest) batch by batch,
+    like textstat_collocations in keyATM_posTagging.R: add() counts the n-grams of a batch of texts in `workers`
+    processes (1 shard per chunk of `chunksize` texts) and merges the counts, top() scores them.
+
+    finder = CollocationFinder(stopwords = get_stopwords())
+    finder.add(df_party_shares)
+    collocations = finder.top(250, min_count = 25)
+    builder = DTMBuilder(stopwords = get_stopwords(), compounds = collocations['collocation'])  # see dtm.py
+
+    Params:
+     tuple: sizes (lengths of the n-grams)
+     str: lemmatizer, tuple: pos, frozenset: stopwords, str: model (see dtm.DTMBuilder)
+     int: workers (number of processes, see parallel.map_protocols)
+     int: chunksize (number of texts per shard)
+     int: max_size (optional, memory cap: max. number of n-grams per size, the rarest are removed when it is reached,
+                    so counts below the removed ones are only lower bounds)
+    '''
+    def __init__(self, sizes = (2, 3), lemmatizer = 'spacy', pos = POS, stopwords = frozenset(), workers = 1, chunksize = 10,
+                 model = 'de_core_news_sm', max_size = None):
+        self.sizes = tuple(sizes)
+        self.options = {'sizes': self.sizes, 'lemmatizer': lemmatizer, 'pos': pos, 'stopwords': frozenset(stopwords),
+                        'model': model, 'max_size': max_size}
+        self.workers = workers
+        self.chunksize = chunksize
+        self.max_size = max_size
+        self.counts = new_counts(self.sizes)
+
+    def add(self, df, column = 'text'):
+        '''
+        Counts the n-grams of the texts of a dataframe and adds them to the counts.
+        '''
+        with stage('collocations', df, column):
+            shards = map_protocols(count_ngrams, df, [column], self.workers, self.chunksize, ignore_index = True,
+                                   column = column, **self.options)
+            for shard in shards['counts']:
+                for key, value in shard.items():
+                    if isinstance(value, Counter):
+                        self.counts[key].update(value) # adds the counts (in place, += would copy the Counter)
+                    else:
+                        self.counts[key] += value
+            if self.max_size is not None:
+                for n in self.sizes:
+                    prune(self.counts[n], self.max_size)
+        return self
+
+    def score(self, min_count = 2):
+        '''
+        Returns all n-grams with at least min_count occurrences with their scores:
+        - lambda: log odds ratio of the 2x2 table (first n-1 words, last word), like textstat_collocations for bigrams
+          (for longer n-grams, the first n-1 words are taken as one), with 0.5 added to every cell
+        - z: lambda / its standard error (the default order of textstat_collocations)
+        - pmi: pointwise mutual information log(count * total / (count of first n-1 words * count of last word))
+
+        Returns:
+         pd.DataFrame: columns collocation (words separated by spaces), count, length, lambda, z, pmi
+        '''
+        frames = []
+        for n in self.sizes:
+            grams = [(gram, count) for gram, count in self.counts[n].items() if count >= min_count]
+            if not grams:
+                continue
+            left, right, total = self.counts['left', n], self.counts['right', n], self.counts['total', n]
+            n11 = np.array([count for _, count in grams], dtype = float)
+            first = np.array([left[gram[:-1]] for gram, _ in grams], dtype = float)
+            last = np.array([right[gram[-1]] for gram, _ in grams], dtype = float)
+            n12, n21 = first - n11, last - n11
+            n22 = total - n11 - n12 - n21
+            cells = [n11 + 0.5, n12 + 0.5, n21 + 0.5, n22 + 0.5]
+            lam = np.log(cells[0]) - np.log(cells[1]) - np.log(cells[2]) + np.log(cells[3])
+            sigma = np.sqrt(sum(1 / c for c in cells))
+            frames.append(pd.DataFrame({'collocation': [' '.join(gram) for gram, _ in grams], 'count': n11.astype(np.int64),
+                                        'length': n, 'lambda': lam, 'z': lam / sigma,
+                                        'pmi': np.log(n11 * total / (first * last))}))
+        if not frames:
+            return pd.DataFrame(columns = ['collocation', 'count', 'length', 'lambda', 'z', 'pmi'])
+        return pd.concat(frames, ignore_index = True)
+
+    def top(self, k = 250, min_count = 25, by = 'z', exclude = ()):
+        '''
+        Returns the k best collocations (see score) with at least min_count occurrences, ordered by `by`
+        ('z', 'lambda', 'pmi' or 'count'), without the collocations in exclude (e.g. salutations like
+        'geehrt dame herr', words separated by spaces).
+        '''
+        scores = self.score(min_count)
+        scores = scores[~scores['collocation'].isin(set(exclude))]
+        return scores.sort_values([by, 'collocation'], ascending = [False, True], kind = 'stable').head(k).reset_index(drop = True)
+
+
+def find_collocations(df, column = 'text', k = 250, min_count = 25, by = 'z', exclude = (), **kwargs):
+    '''
+    Returns the k best collocations of all texts of a dataframe at once (see CollocationFinder, kwargs are passed on to it).
+    '''
+    return CollocationFinder(**kwargs).add(df, column).top(k, min_count, by, exclude)
@@ -0,0 +1,140 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+# Dimensions of the cube (besides the protocol id, which is kept for incremental updates)
+DIMENSIONS = ['party', 'text_type', 'wahlperiode', 'datum']
+
+# Measures per cell: number of documents (rows of party_shares), characters and words
+MEASURES = ['documents', 'text_length', 'num_words']
+
+
+def add_counts(df, column = 'text'):
+    '''
+    Adds the number of characters (text_length) and words (num_words, like in start_here.ipynb: spaces + 1) of every text.
+
+    Params:
+     pd.DataFrame: data
+     str: column (text column)
+
+    Returns:
+     pd.DataFrame: data with columns text_length and num_words
+    '''
+    texts = df[column].fillna('')
+    df['text_length'] = texts.str.len()
+    df['num_words'] = texts.str.count(' ') + 1
+    return df
+
+
+def filter_mask(df, start = None, end = None, **filters):
+    '''
+    Returns a boolean mask of the rows within start and end (dates of column datum, inclusive) and the filters,
+    e.g. party = ['SPD', 'AfD'] (list: one of the values) or wahlperiode = 19.
+    '''
+    mask = np.ones(len(df), dtype = bool)
+    if start is not None:
+        mask &= (df['datum'] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        mask &= (df['datum'] <= pd.Timestamp(end)).to_numpy()
+    for column, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            mask &= df[column].isin(value).to_numpy()
+        else:
+            mask &= (df[column] == value).to_numpy()
+    return mask
+
+
+class StatsCube:
+    '''
+    Pre-aggregated text statistics over party x text_type x wahlperiode x datum (date of the session),
+    with the number of documents, characters and words per cell. Updated protocol by protocol (see update),
+    so the statistics of all protocols are answered without the texts, e.g.
+
+    cube = StatsCube('out/stats.pkl')
+    cube.mean('text_length', party = party_filter)                        # -> out/mean_text_length.csv
+    cube.sum('num_words', party = party_filter, wahlperiode = 19)         # -> out/mean_word_count_sum_19.csv
+    cube.series('num_words', by = ['party'], freq = 'MS')                 # words per month and party
+
+    Params:
+     str: path (optional pickle file, loaded if it exists, see save)
+    '''
+    def __init__(self, path = None):
+        self.path = path
+        if path is not None and os.path.exists(path):
+            self.cells = pd.read_pickle(path)
+        else:
+            self.cells = pd.DataFrame(columns = ['id'] + DIMENSIONS + MEASURES)
+
+    def ids(self):
+        '''
+        Returns the ids of all protocols in the cube.
+        '''
+        return set(self.cells['id'])
+
+    def update(self, df, keep = None):
+        '''
+        Adds the statistics of the given protocols, the cells of protocols, which are already in the cube, are replaced.
+        The counts are taken from the columns text_length and num_words (see party_shares) or counted, if missing.
+
+        Params:
+         pd.DataFrame: df (result of add_metadata: id, party, text_type, wahlperiode, datum and text or counts)
+         iterable: keep (optional, ids of all current protocols: cells of other protocols are dropped)
+
+        Returns:
+         StatsCube: self
+        '''
+        if 'text_length' not in df or 'num_words' not in df or df[['text_length', 'num_words']].isna().any(axis = None):
+            df = add_counts(df[['id'] + DIMENSIONS + ['text']].copy())
+
+        rows = pd.DataFrame({'id': df['id'].astype(str).to_numpy(),
+                             'party': df['party'].astype(str).to_numpy(),
+                             'text_type': df['text_type'].astype(str).to_numpy(),
+                             'wahlperiode': df['wahlperiode'].astype('Int64').to_numpy(),
+                             'datum': pd.to_datetime(df['datum']).to_numpy(),
+                             'documents': 1,
+                             'text_length': df['text_length'].to_numpy(),
+                             'num_words': df['num_words'].to_numpy()})
+        new = rows.groupby(['id'] + DIMENSIONS, sort = False, dropna = False)[MEASURES].sum().reset_index()
+
+        cells = self.cells[~self.cells['id'].isin(new['id'])]
+        if keep is not None:
+            cells = cells[cells['id'].isin({str(protocol_id) for protocol_id in keep})]
+        self.cells = pd.concat([cells, new], ignore_index = True) if len(cells) else new
+        return self
+
+    def save(self, path = None):
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        self.cells.to_pickle(path)
+
+    def select(self, start = None, end = None, **filters):
+        '''
+        Returns the cells within start and end (dates, inclusive) and the filters,
+        e.g. party = ['SPD', 'AfD'] (list: one of the values) or wahlperiode = 19.
+        '''
+        return self.cells[filter_mask(self.cells, start, end, **filters)]
+
+    def sum(self, measure, by = ('party', 'text_type'), **filters):
+        '''
+        Returns the sum of a measure (documents, text_length or num_words) per group (filters: see select).
+        '''
+        return self.select(**filters).groupby(list(by))[measure].sum()
+
+    def mean(self, measure, by = ('party', 'text_type'), **filters):
+        '''
+        Returns the mean of a measure per document (row of party_shares) and group (filters: see select),
+        the same as groupby(by)[measure].mean() on the texts.
+        '''
+        sums = self.select(**filters).groupby(list(by))[[measure, 'documents']].sum()
+        return (sums[measure] / sums['documents']).rename(measure)
+
+    def series(self, measure, by = ('party',), freq = 'MS', stat = 'sum', **filters):
+        '''
+        Returns a time series of a measure (sum or mean per document) with 1 row per period (freq, e.g. 'MS' = month,
+        'YS' = year, 'D' = session) and 1 column per group.
+        '''
+        cells = self.select(**filters)
+        grouped = cells.groupby([pd.Grouper(key = 'datum', freq = freq)] + list(by))[[measure, 'documents']].sum()
+        values = grouped[measure] if stat == 'sum' else grouped[measure] / grouped['documents']
+        return values.unstack(list(by)) if by else values
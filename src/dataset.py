@@ -0,0 +1,149 @@
+import os
+import shutil
+import pandas as pd
+
+
+# Folder levels of the dataset: out/party_shares/wahlperiode=19/party=AfD/text_type=main_text/part-0.parquet
+PARTITIONS = ('wahlperiode', 'party', 'text_type')
+
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError:
+        raise ImportError('the parquet dataset needs the package pyarrow (pip install pyarrow)')
+    return pyarrow, pyarrow.dataset
+
+
+def get_schema():
+    '''
+    Returns the schema of the party shares (see pipeline.stream_party_shares):
+    doc is the running number of the row (the index column X of df_party_shares.csv).
+    '''
+    pa, _ = _arrow()
+    return pa.schema([('doc', pa.int64()), ('id', pa.string()), ('party', pa.string()), ('text_type', pa.string()),
+                      ('wahlperiode', pa.int16()), ('datum', pa.date32()), ('text_length', pa.int64()),
+                      ('num_words', pa.int64()), ('text', pa.string())])
+
+
+def get_partitioning(partitions = PARTITIONS):
+    pa, ds = _arrow()
+    schema = get_schema()
+    return ds.partitioning(pa.schema([schema.field(column) for column in partitions]), flavor = 'hive')
+
+
+def to_batches(frames, schema):
+    '''
+    Yields every frame (result of add_metadata) as arrow RecordBatch with a running doc number over all frames.
+    text_length and num_words are counted, if missing (see corpus_stats.add_counts).
+    '''
+    pa, _ = _arrow()
+    from src.corpus_stats import add_counts
+    written = 0
+    for frame in frames:
+        if not len(frame):
+            continue
+        frame = frame.copy()
+        if 'text_length' not in frame or 'num_words' not in frame:
+            frame = add_counts(frame)
+        frame['doc'] = pd.RangeIndex(written, written + len(frame))
+        frame['id'] = frame['id'].astype(str)
+        frame['datum'] = pd.to_datetime(frame['datum'])
+        written += len(frame)
+        yield pa.RecordBatch.from_pandas(frame[schema.names], schema = schema, preserve_index = False)
+
+
+def write_party_shares(frames, path = 'out/party_shares', partitions = PARTITIONS, compression = 'zstd', batch_rows = 16):
+    '''
+    Writes the party shares as parquet dataset (columnar, compressed), partitioned into folders by
+    wahlperiode/party/text_type, so readers (see read_party_shares, or arrow::open_dataset in R) only read
+    the partitions and columns they need. The frames are written as they arrive (memory does not depend on the
+    number of frames). An existing dataset in path is replaced.
+
+    Params:
+     pd.DataFrame/iterable: frames (result of add_metadata, or dataframes from pipeline.stream_party_shares)
+     str: path (folder)
+     tuple: partitions (columns, 1 folder level per column)
+     str: compression (parquet codec, e.g. 'zstd', 'snappy', 'gzip')
+     int: batch_rows (min. number of rows per row group of a file: rows are buffered per partition until then,
+                     so memory grows with batch_rows * number of partitions)
+
+    Returns:
+     int: number of rows written
+    '''
+    pa, ds = _arrow()
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+    schema = get_schema()
+    rows = [0]
+
+    def counted():
+        for batch in to_batches(frames, schema):
+            rows[0] += batch.num_rows
+            yield batch
+
+    options = ds.ParquetFileFormat().make_write_options(compression = compression)
+    ds.write_dataset(counted(), path, schema = schema, format = 'parquet', partitioning = get_partitioning(partitions),
+                     file_options = options, min_rows_per_group = batch_rows, max_rows_per_group = max(batch_rows, 2**14),
+                     existing_data_behavior = 'overwrite_or_ignore')
+    return rows[0]
+
+
+def open_party_shares(path = 'out/party_shares', partitions = PARTITIONS):
+    '''
+    Returns the parquet dataset of the party shares (pyarrow.dataset.Dataset, nothing is read yet).
+    '''
+    _, ds = _arrow()
+    return ds.dataset(path, format = 'parquet', partitioning = get_partitioning(partitions))
+
+
+def filter_expression(start = None, end = None, **filters):
+    '''
+    Returns the arrow filter expression of start and end (dates of column datum, inclusive) and the filters,
+    e.g. party = ['SPD', 'AfD'] (list: one of the values) or wahlperiode = 19 (like corpus_stats.filter_mask).
+    Filters on partition columns only select folders, filters on other columns use the statistics of the row groups.
+    '''
+    _, ds = _arrow()
+    conditions = []
+    if start is not None:
+        conditions.append(ds.field('datum') >= pd.Timestamp(start).date())
+    if end is not None:
+        conditions.append(ds.field('datum') <= pd.Timestamp(end).date())
+    for column, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            conditions.append(ds.field(column).isin(list(value)))
+        else:
+            conditions.append(ds.field(column) == value)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_party_shares(path = 'out/party_shares', columns = None, start = None, end = None, **filters):
+    '''
+    Reads the party shares (see write_party_shares), only the given columns and the rows within start and end and
+    the filters, e.g. the input of keyATM_posTagging.R:
+
+    read_party_shares(columns = ['doc', 'text'], party = 'AfD', text_type = 'main_text')
+
+    Params:
+     str: path (folder)
+     list: columns (optional, default: all)
+     str: start, end (optional, dates, inclusive)
+     filters: only rows with these values (see filter_expression)
+
+    Returns:
+     pd.DataFrame: rows ordered by doc (the order in which they were written), if doc is read
+    '''
+    table = open_party_shares(path).to_table(columns = columns, filter = filter_expression(start, end, **filters))
+    df = table.to_pandas(date_as_object = False)
+    if columns is None:
+        df = df[get_schema().names] # partition columns are read last
+    if 'doc' in df:
+        df = df.sort_values('doc', ignore_index = True)
+    return df
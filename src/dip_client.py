@@ -0,0 +1,172 @@
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from src.instrumentation import record_latency
+from src.transport import get_adapter, get_base_url
+
+
+# Base URL of the DIP API (see openapi.yaml)
+DIP_URL = 'https://search.dip.bundestag.de/api/v1/'
+
+# Status codes, after which a request is worth another try
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+class RateLimiter:
+    '''
+    Allows at most `rate` requests per second, shared by all threads that use the same limiter.
+    A rate of None (or 0) disables the limit.
+    '''
+    def __init__(self, rate = None):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        # Reserve the next free time slot and sleep outside the lock, so other threads can reserve theirs
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def get_session(pool_size = 8):
+    '''
+    Returns a requests.Session with a connection pool big enough for `pool_size` parallel requests.
+    The connections are kept alive and reused for all requests of the session.
+    Within transport.use_transport, the session sends the requests over the adapter of the transport instead
+    (e.g. to record or replay them).
+
+    Params:
+     int: pool_size (number of parallel connections)
+
+    Returns:
+     requests.Session: session
+    '''
+    session = requests.Session()
+    adapter = get_adapter() or HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size) # see transport.use_transport
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_json(session, resource, key, params = None, timeout = 30, retries = 3, backoff = 1.0, limiter = None):
+    '''
+    Requests a resource of the DIP API (e.g. 'plenarprotokoll-text/908') and returns the JSON response.
+    Connection errors, timeouts and the status codes in RETRY_STATUS are retried with exponential backoff
+    (backoff * 2^attempt seconds, or the Retry-After header of the API, if given).
+
+    Params:
+     requests.Session: session
+     str: resource (path relative to DIP_URL, or to the base url of transport.use_transport)
+     str: current api key
+     dict: params (additional query parameters)
+     float: timeout (per request, in seconds)
+     int: retries (number of retries after the first attempt)
+     float: backoff (base of the waiting time between attempts, in seconds)
+     RateLimiter: limiter (optional)
+
+    Returns:
+     dict: JSON response
+    '''
+    payload = {'apikey': key, 'format': 'json'}
+    payload.update(params or {})
+    base_url = get_base_url(DIP_URL) # see transport.use_transport
+
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.wait()
+        wait = backoff * 2 ** attempt
+
+        start = time.perf_counter()
+        try:
+            response = session.get(base_url + resource, params = payload, timeout = timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            record_latency(resource, time.perf_counter() - start)
+            if attempt == retries:
+                raise
+        else:
+            record_latency(resource, time.perf_counter() - start)
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code not in RETRY_STATUS or attempt == retries:
+                response.raise_for_status()
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                wait = int(retry_after)
+
+        time.sleep(wait)
+
+
+def iter_documents(resource, key, params = None, session = None, timeout = 30, retries = 3, backoff = 1.0, limiter = None):
+    '''
+    Yields all documents of a list resource of the DIP API (e.g. 'plenarprotokoll'), page by page as they arrive:
+    every follow-up request repeats the params with the cursor of the last response, until the cursor does not change
+    (see openapi.yaml: Cursor). Filters in params are applied by the API, e.g. {'f.wahlperiode': [18, 19]}
+    (lists are sent as repeated parameters).
+
+    Params:
+     str: resource
+     str: current api key
+     dict: params (filters, e.g. f.wahlperiode, f.zuordnung, f.datum.start, f.aktualisiert.start)
+     requests.Session: session (optional, a new one if not given)
+     (all other params: see get_json)
+
+    Returns:
+     generator: documents (dict)
+    '''
+    own_session = session is None
+    session = session or get_session(1)
+    params = dict(params or {})
+    cursor = None
+    try:
+        while True:
+            if cursor is not None:
+                params['cursor'] = cursor
+            page = get_json(session, resource, key, params, timeout = timeout, retries = retries, backoff = backoff,
+                            limiter = limiter)
+            documents = page.get('documents') or []
+            yield from documents
+            if not documents or page.get('cursor') in (None, cursor):
+                break
+            cursor = page['cursor']
+    finally:
+        if own_session:
+            session.close()
+
+
+def fetch_protocols(ids, key, max_workers = 8, rate_limit = 10, timeout = 30, retries = 3, backoff = 1.0):
+    '''
+    Downloads the full text documents (raw JSON, resource plenarprotokoll-text) of many protocols at once.
+    At most `max_workers` requests run at the same time, over one pool of keep-alive connections
+    and limited to `rate_limit` requests per second.
+    The result is in the same order as `ids`, no matter in which order the requests finish.
+
+    Params:
+     list: ids (protocol ids)
+     str: current api key
+     int: max_workers (number of parallel requests)
+     float: rate_limit (max. requests per second, None for no limit)
+     float: timeout (per request, in seconds)
+     int: retries (number of retries per request)
+     float: backoff (base of the waiting time between retries, in seconds)
+
+    Returns:
+     list: JSON response (dict) per protocol
+    '''
+    session = get_session(max_workers)
+    limiter = RateLimiter(rate_limit)
+
+    def fetch(protocol_id):
+        return get_json(session, f'plenarprotokoll-text/{protocol_id}', key, timeout = timeout,
+                        retries = retries, backoff = backoff, limiter = limiter)
+
+    with session, ThreadPoolExecutor(max_workers = max_workers) as executor:
+        return list(executor.map(fetch, ids)) # map keeps the order of ids
+
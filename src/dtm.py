@@ -0,0 +1,314 @@
+import os
+import re
+from array import array
+from collections import Counter
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src.parallel import map_protocols
+from src.instrumentation import stage
+
+
+# Parts of speech kept for the topic model (like keyATM_posTagging.R), only used by lemmatizer = 'spacy'
+POS = ('NOUN', 'PROPN', 'ADJ')
+
+# Words without digits, punctuation and symbols (hyphenated words are one token)
+TOKEN_PATTERN = re.compile(r'[^\W\d_]+(?:-[^\W\d_]+)*')
+
+# Columns of party_shares / add_metadata, which are kept as document variables
+DOC_COLUMNS = ['id', 'party', 'text_type', 'wahlperiode', 'datum']
+
+
+def get_stopwords(sources = ('snowball',), extra = ()):
+    '''
+    Returns a set of German stopwords (lower case).
+    'snowball' is built in, 'spacy' (pip install spacy) and 'nltk' (pip install nltk, nltk.download('stopwords'))
+    are only used, if they are installed.
+
+    Params:
+     tuple: sources ('snowball', 'spacy', 'nltk')
+     iterable: extra (additional words, e.g. names, which should not be in the vocabulary)
+
+    Returns:
+     frozenset: stopwords
+    '''
+    words = set(extra)
+    for source in sources:
+        if source == 'snowball':
+            words.update(SNOWBALL_STOPWORDS)
+        elif source == 'spacy':
+            try:
+                from spacy.lang.de.stop_words import STOP_WORDS
+            except ImportError:
+                raise ImportError('stopwords "spacy" need the package spacy (pip install spacy)')
+            words.update(STOP_WORDS)
+        elif source == 'nltk':
+            try:
+                from nltk.corpus import stopwords
+            except ImportError:
+                raise ImportError('stopwords "nltk" need the package nltk (pip install nltk)')
+            words.update(stopwords.words('german'))
+        else:
+            raise ValueError(f"unknown stopword source {source!r} (use 'snowball', 'spacy' or 'nltk')")
+    return frozenset(w.lower() for w in words)
+
+
+@lru_cache(maxsize = None)
+def load_spacy(model = 'de_core_news_sm'):
+    '''
+    Loads a German spaCy model once per process (without parser and named entities, they are not needed).
+    '''
+    try:
+        import spacy
+    except ImportError:
+        raise ImportError('lemmatizer="spacy" needs spaCy and a German model '
+                          '(pip install spacy && python -m spacy download de_core_news_sm)')
+    return spacy.load(model, disable = ['parser', 'ner'])
+
+
+def tokenize(texts, lemmatizer = 'spacy', pos = POS, model = 'de_core_news_sm'):
+    '''
+    Splits texts into lower case tokens, one list per text (without numbers, punctuation and symbols).
+
+    Params:
+     list: texts
+     str: lemmatizer ('spacy': lemmas, only the parts of speech in pos, like udpipe in keyATM_posTagging.R;
+                      'simplemma': lemmas of all words (pip install simplemma), faster, but without parts of speech;
+                      None: the words as they are)
+     tuple: pos (parts of speech, only with 'spacy')
+     str: model (spaCy model)
+
+    Returns:
+     generator: list of tokens per text
+    '''
+    if lemmatizer == 'spacy':
+        nlp = load_spacy(model)
+        nlp.max_length = max([nlp.max_length] + [len(t) + 1 for t in texts]) # the party shares of a protocol can be long
+        for doc in nlp.pipe(texts, batch_size = 16):
+            yield [t.lemma_.lower() for t in doc if t.pos_ in pos and TOKEN_PATTERN.fullmatch(t.lemma_)]
+    elif lemmatizer == 'simplemma':
+        try:
+            import simplemma
+        except ImportError:
+            raise ImportError('lemmatizer="simplemma" needs the package simplemma (pip install simplemma)')
+        for text in texts:
+            yield [simplemma.lemmatize(w, lang = 'de').lower() for w in TOKEN_PATTERN.findall(text)]
+    elif lemmatizer is None:
+        for text in texts:
+            yield TOKEN_PATTERN.findall(text.lower())
+    else:
+        raise ValueError(f"unknown lemmatizer {lemmatizer!r} (use 'spacy', 'simplemma' or None)")
+
+
+def compound_table(collocations, separator = '_'):
+    '''
+    Returns a lookup table for compound_tokens: first word -> [(words, compound)], longest n-grams first.
+
+    Params:
+     iterable: collocations (words separated by spaces, e.g. 'deutsch bundestag', or tuples of words)
+     str: separator (between the words of a compound, e.g. 'deutsch_bundestag' like tokens_compound in quanteda)
+
+    Returns:
+     dict: table
+    '''
+    table = {}
+    for collocation in collocations:
+        words = tuple(collocation.split() if isinstance(collocation, str) else collocation)
+        table.setdefault(words[0], []).append((words, separator.join(words)))
+    for candidates in table.values():
+        candidates.sort(key = lambda candidate: -len(candidate[0]))
+    return table
+
+
+def compound_tokens(tokens, table):
+    '''
+    Joins the collocations (see compound_table) in a list of tokens, from left to right, the longest first.
+    None marks a removed stopword, no compound goes across it.
+    '''
+    result = []
+    i = 0
+    while i < len(tokens):
+        for words, compound in table.get(tokens[i], ()):
+            if tuple(tokens[i:i + len(words)]) == words:
+                result.append(compound)
+                i += len(words)
+                break
+        else:
+            result.append(tokens[i])
+            i += 1
+    return result
+
+
+def count_terms(protocols, column = 'text', lemmatizer = 'spacy', pos = POS, stopwords = frozenset(), model = 'de_core_news_sm',
+                compounds = None):
+    '''
+    Returns the term counts (without stopwords) of every text as dataframe with column counts (Counter per row),
+    same index as the input. Module-level, so it can run in parallel (see parallel.map_protocols).
+    With compounds (see compound_table), collocations are counted as one term (after the stopwords are removed).
+    '''
+    texts = protocols[column].fillna('').tolist()
+    counts = []
+    for tokens in tokenize(texts, lemmatizer, pos, model):
+        if compounds:
+            tokens = compound_tokens([None if t in stopwords else t for t in tokens], compounds)
+        counts.append(Counter(t for t in tokens if t is not None and t not in stopwords))
+    return pd.DataFrame({'counts': counts}, index = protocols.index)
+
+
+class DocumentTermMatrix:
+    '''
+    Sparse document-term matrix (scipy CSR, rows: documents, columns: terms) with vocabulary and document variables.
+
+    Params:
+     scipy.sparse.csr_matrix: matrix (counts)
+     list: vocabulary (term per column)
+     pd.DataFrame: docs (1 row per matrix row, e.g. id, party, text_type, wahlperiode, datum)
+    '''
+    def __init__(self, matrix, vocabulary, docs):
+        self.matrix = matrix
+        self.vocabulary = list(vocabulary)
+        self.docs = docs.reset_index(drop = True)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def save(self, path, format = 'npz'):
+        '''
+        Stores the matrix in a folder: dtm.npz (compressed CSR, see load) or dtm.mtx (Matrix Market,
+        e.g. for R: Matrix::readMM), vocabulary.txt (1 term per line) and docs.csv.
+        '''
+        os.makedirs(path, exist_ok = True)
+        if format == 'npz':
+            sparse.save_npz(os.path.join(path, 'dtm.npz'), self.matrix, compressed = True)
+        elif format == 'mtx':
+            from scipy.io import mmwrite
+            mmwrite(os.path.join(path, 'dtm.mtx'), self.matrix, field = 'integer')
+        else:
+            raise ValueError(f"format must be 'npz' or 'mtx', not {format!r}")
+        with open(os.path.join(path, 'vocabulary.txt'), 'w', encoding = 'utf-8') as f:
+            f.write('\n'.join(self.vocabulary) + '\n')
+        self.docs.to_csv(os.path.join(path, 'docs.csv'), index = False)
+
+    @classmethod
+    def load(cls, path):
+        if os.path.exists(os.path.join(path, 'dtm.npz')):
+            matrix = sparse.load_npz(os.path.join(path, 'dtm.npz')).tocsr()
+        else:
+            from scipy.io import mmread
+            matrix = mmread(os.path.join(path, 'dtm.mtx')).tocsr()
+        with open(os.path.join(path, 'vocabulary.txt'), encoding = 'utf-8') as f:
+            vocabulary = f.read().splitlines()
+        docs = pd.read_csv(os.path.join(path, 'docs.csv'), dtype = {'id': str})
+        if 'datum' in docs:
+            docs['datum'] = pd.to_datetime(docs['datum'])
+        return cls(matrix, vocabulary, docs)
+
+
+class DTMBuilder:
+    '''
+    Builds a DocumentTermMatrix batch by batch (e.g. from pipeline.stream_party_shares): add() tokenizes and lemmatizes
+    the texts of a batch (in `workers` processes), removes the stopwords and appends the counts to the matrix,
+    so the texts are not needed any more. finish() prunes the vocabulary by document frequency, e.g. like
+    dfm_trim(min_docfreq = 0.1, max_docfreq = 0.5, docfreq_type = "prop") in keyATM_posTagging.R:
+
+    builder = DTMBuilder(stopwords = get_stopwords())
+    builder.add(df_party_shares[(df_party_shares['party'] == 'AfD') & (df_party_shares['text_type'] == 'main_text')])
+    dtm = builder.finish(min_docfreq = 0.1, max_docfreq = 0.5)
+    dtm.save('out/dtm_afd')
+
+    Params:
+     str: lemmatizer (see tokenize)
+     tuple: pos (see tokenize)
+     frozenset: stopwords (see get_stopwords)
+     int: workers (number of processes, see parallel.map_protocols)
+     int: chunksize (number of texts per task of a worker)
+     str: model (spaCy model)
+     iterable: compounds (optional, collocations counted as one term, e.g. the top of collocations.find_collocations)
+    '''
+    def __init__(self, lemmatizer = 'spacy', pos = POS, stopwords = frozenset(), workers = 1, chunksize = 10,
+                 model = 'de_core_news_sm', compounds = None):
+        self.options = {'lemmatizer': lemmatizer, 'pos': pos, 'stopwords': frozenset(stopwords), 'model': model,
+                        'compounds': compound_table(compounds) if compounds is not None else None}
+        self.workers = workers
+        self.chunksize = chunksize
+        self.vocabulary = {} # term -> column
+        self.indptr = array('q', [0])
+        self.indices = array('i')
+        self.data = array('i')
+        self.docs = []
+
+    def add(self, df, column = 'text'):
+        '''
+        Adds the texts of a dataframe (1 document per row, the columns in DOC_COLUMNS are kept as document variables).
+        '''
+        with stage('dtm', df, column):
+            counts = map_protocols(count_terms, df, [column], self.workers, self.chunksize, column = column, **self.options)
+
+            vocabulary = self.vocabulary
+            for doc in counts['counts']:
+                for term, n in doc.items():
+                    self.indices.append(vocabulary.setdefault(term, len(vocabulary)))
+                    self.data.append(n)
+                self.indptr.append(len(self.indices))
+            self.docs.append(df[[c for c in DOC_COLUMNS if c in df]].reset_index(drop = True))
+        return self
+
+    def finish(self, min_docfreq = 0, max_docfreq = 1, min_count = 1, drop_empty = True):
+        '''
+        Returns the DocumentTermMatrix of all added documents.
+
+        Params:
+         float: min_docfreq (terms in fewer documents are removed; < 1: share of the documents, else number of documents)
+         float: max_docfreq (terms in more documents are removed; <= 1: share of the documents, else number of documents)
+         int: min_count (terms with fewer occurrences in all documents are removed)
+         bool: drop_empty (remove documents without any term after pruning, the topic model does not accept them)
+
+        Returns:
+         DocumentTermMatrix: dtm
+        '''
+        n_docs = len(self.indptr) - 1
+        # copies, so more documents can be added afterwards (the arrays can't grow while numpy uses their memory)
+        indices = np.frombuffer(self.indices, dtype = np.int32).copy()
+        data = np.frombuffer(self.data, dtype = np.int32).copy()
+        indptr = np.frombuffer(self.indptr, dtype = np.int64).copy()
+        matrix = sparse.csr_matrix((data, indices, indptr), shape = (n_docs, len(self.vocabulary)))
+
+        docfreq = np.bincount(indices, minlength = len(self.vocabulary))
+        counts = np.bincount(indices, weights = data, minlength = len(self.vocabulary))
+        low = min_docfreq * n_docs if min_docfreq < 1 else min_docfreq
+        high = max_docfreq * n_docs if max_docfreq <= 1 else max_docfreq
+        keep = np.flatnonzero((docfreq >= low) & (docfreq <= high) & (counts >= min_count))
+
+        terms = np.array(list(self.vocabulary), dtype = object)
+        matrix = matrix[:, keep].tocsr()
+        docs = pd.concat(self.docs, ignore_index = True) if self.docs else pd.DataFrame(columns = DOC_COLUMNS)
+        if drop_empty:
+            rows = np.flatnonzero(matrix.getnnz(axis = 1))
+            matrix, docs = matrix[rows], docs.iloc[rows]
+        return DocumentTermMatrix(matrix, terms[keep].tolist(), docs)
+
+
+def build_dtm(df, column = 'text', min_docfreq = 0, max_docfreq = 1, min_count = 1, drop_empty = True, **kwargs):
+    '''
+    Builds the DocumentTermMatrix of all texts of a dataframe at once (see DTMBuilder, kwargs are passed on to it).
+    '''
+    return DTMBuilder(**kwargs).add(df, column).finish(min_docfreq, max_docfreq, min_count, drop_empty)
+
+
+# German stopword list of the Snowball project (snowballstem.org)
+SNOWBALL_STOPWORDS = '''
+aber alle allem allen aller alles als also am an ander andere anderem anderen anderer anderes anderm andern anderr
+anders auch auf aus bei bin bis bist da damit dann der den des dem die das dass daß derselbe derselben denselben
+desselben demselben dieselbe dieselben dasselbe dazu dein deine deinem deinen deiner deines denn derer dessen dich dir
+du dies diese diesem diesen dieser dieses doch dort durch ein eine einem einen einer eines einig einige einigem einigen
+einiger einiges einmal er ihn ihm es etwas euer eure eurem euren eurer eures für gegen gewesen hab habe haben hat hatte
+hatten hier hin hinter ich mich mir ihr ihre ihrem ihren ihrer ihres euch im in indem ins ist jede jedem jeden jeder
+jedes jene jenem jenen jener jenes jetzt kann kein keine keinem keinen keiner keines können könnte machen man manche
+manchem manchen mancher manches mein meine meinem meinen meiner meines mit muss musste nach nicht nichts noch nun nur
+ob oder ohne sehr sein seine seinem seinen seiner seines selbst sich sie ihnen sind so solche solchem solchen solcher
+solches soll sollte sondern sonst über um und uns unsere unserem unseren unser unseres unter viel vom von vor während
+war waren warst was weg weil weiter welche welchem welchen welcher welches wenn werde werden wie wieder will wir wird
+wirst wo wollen wollte würde würden zu zum zur zwar zwischen
+'''.split()
@@ -0,0 +1,195 @@
+import os
+import time
+import json
+import cProfile
+import pstats
+import numpy as np
+from contextlib import contextmanager, nullcontext
+from src.memory import reset_peak, peak_rss
+
+
+class Metrics:
+    '''
+    Collects structured metrics of a pipeline run (see instrument()):
+    - stages: wall time, number of protocols, protocols/s, MB/s (text size in million characters) and peak memory per stage
+    - protocols: time per protocol and stage (only with per_protocol=True, see parallel.map_protocols)
+    - api: latency percentiles of the DIP API requests per resource
+    - cache: hits and misses of the ResponseCache per resource
+
+    Params:
+     bool: per_protocol (also record the time of every protocol in every stage, costs a little more time)
+     list: profile (names of stages, which are run with a profiler)
+     str: profile_dir (folder for the profiler output, <stage>.prof or <stage>.html)
+     str: profiler ('cprofile' or 'pyinstrument', a sampling profiler with less overhead)
+    '''
+    def __init__(self, per_protocol = False, profile = (), profile_dir = 'profiles', profiler = 'cprofile'):
+        self.per_protocol = per_protocol
+        self.profile = set(profile)
+        self.profile_dir = profile_dir
+        self.profiler = profiler
+        self.stages = []
+        self.protocols = []
+        self.latencies = {}
+        self.cache = {}
+        self.open_stages = [] # peak memory of the running stages (nested stages reset the peak)
+
+    @contextmanager
+    def stage(self, name, data = None, column = None):
+        '''
+        Measures a stage. data (dataframe of protocols) and column (text column) are used for the throughput.
+        '''
+        record = {'stage': name, 'protocols': None, 'mb': None}
+        if data is not None:
+            record['protocols'] = len(data)
+            if column is not None and column in data:
+                record['mb'] = round(float(data[column].str.len().sum()) / 2**20, 3)
+
+        profiler = self._start_profiler() if name in self.profile else None
+        self.open_stages.append(0)
+        reset_peak()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            peak = max(peak_rss() or 0, self.open_stages.pop())
+            if self.open_stages:
+                self.open_stages[-1] = max(self.open_stages[-1], peak)
+            if profiler is not None:
+                record['profile'] = self._stop_profiler(name, profiler)
+
+            record['seconds'] = round(seconds, 4)
+            if record['protocols'] and seconds:
+                record['protocols_per_s'] = round(record['protocols'] / seconds, 2)
+            if record['mb'] and seconds:
+                record['mb_per_s'] = round(record['mb'] / seconds, 3)
+            record['peak_rss_mb'] = round(peak / 2**20, 1) if peak else None
+            self.stages.append(record)
+
+    def _start_profiler(self):
+        if self.profiler == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                raise ImportError('profiler="pyinstrument" needs the package pyinstrument (pip install pyinstrument)')
+            profiler = Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, name, profiler):
+        os.makedirs(self.profile_dir, exist_ok = True)
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            path = os.path.join(self.profile_dir, f'{name}.prof') # e.g. for snakeviz
+            profiler.dump_stats(path)
+            stats = pstats.Stats(profiler).sort_stats('cumulative')
+            top = [{'function': f'{f[0]}:{f[1]}({f[2]})', 'calls': s[1], 'cumulative_s': round(s[3], 4)}
+                   for f, s in sorted(stats.stats.items(), key = lambda item: item[1][3], reverse = True)[:20]]
+            return {'file': path, 'top': top}
+        profiler.stop()
+        path = os.path.join(self.profile_dir, f'{name}.html')
+        with open(path, 'w', encoding = 'utf-8') as f:
+            f.write(profiler.output_html())
+        return {'file': path}
+
+    def record_protocols(self, name, ids, seconds, chars = None):
+        '''
+        Records the time of a chunk of protocols in a stage (the time is split evenly, if there are several).
+        '''
+        for protocol_id in ids:
+            self.protocols.append({'stage': name, 'id': protocol_id, 'seconds': round(seconds / len(ids), 5),
+                                   'chars': None if chars is None else int(chars / len(ids))})
+
+    def record_latency(self, resource, seconds):
+        self.latencies.setdefault(resource.split('/')[0], []).append(seconds)
+
+    def record_cache(self, resource, hits, misses):
+        counts = self.cache.setdefault(resource, {'hits': 0, 'misses': 0})
+        counts['hits'] += hits
+        counts['misses'] += misses
+
+    def to_dict(self):
+        '''
+        Returns all metrics as dict (JSON compatible).
+        '''
+        api = {}
+        for resource, latencies in self.latencies.items():
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            api[resource] = {'requests': len(latencies), 'mean_s': round(float(np.mean(latencies)), 4),
+                             'p50_s': round(float(p50), 4), 'p90_s': round(float(p90), 4), 'p99_s': round(float(p99), 4),
+                             'max_s': round(float(max(latencies)), 4)}
+        cache = {resource: {**counts, 'hit_rate': round(counts['hits'] / (counts['hits'] + counts['misses']), 3)
+                            if counts['hits'] + counts['misses'] else None}
+                 for resource, counts in self.cache.items()}
+        return {'stages': self.stages, 'protocols': self.protocols, 'api': api, 'cache': cache}
+
+    def to_json(self, path):
+        with open(path, 'w', encoding = 'utf-8') as f:
+            json.dump(self.to_dict(), f, indent = 1, default = str)
+
+
+# Metrics of the current run, None = no instrumentation (all hooks below do nothing)
+_active = None
+
+
+@contextmanager
+def instrument(metrics = None):
+    '''
+    Activates the instrumentation for all stages, downloads and cache lookups within the with block, e.g.:
+
+    with instrument(Metrics(profile = ['remove_president_text'])) as metrics:
+        textdata = get_textdata(cache = cache)
+        df = clean_and_split_text(textdata)
+    metrics.to_json('metrics.json')
+
+    Params:
+     Metrics: metrics (optional, a new one if not given)
+
+    Returns:
+     Metrics: metrics
+    '''
+    global _active
+    previous, _active = _active, metrics or Metrics()
+    try:
+        yield _active
+    finally:
+        _active = previous
+
+
+def get_metrics():
+    '''
+    Returns the active Metrics or None.
+    '''
+    return _active
+
+
+def stage(name, data = None, column = None):
+    '''
+    Context manager, which measures a stage (see Metrics.stage), if the instrumentation is active.
+    '''
+    return _active.stage(name, data, column) if _active is not None else nullcontext()
+
+
+def record_latency(resource, seconds):
+    if _active is not None:
+        _active.record_latency(resource, seconds)
+
+
+def record_cache(resource, hits, misses):
+    if _active is not None:
+        _active.record_cache(resource, hits, misses)
+
+
+def record_protocols(name, ids, seconds, chars = None):
+    if _active is not None:
+        _active.record_protocols(name, ids, seconds, chars)
+
+
+def per_protocol():
+    '''
+    Returns True, if the times per protocol are recorded.
+    '''
+    return _active is not None and _active.per_protocol
@@ -0,0 +1,168 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src.dtm import POS, DocumentTermMatrix, build_dtm
+from src.corpus_stats import filter_mask
+
+
+class KeywordIndex:
+    '''
+    Persistent inverted index over the party shares (1 document per row of party_shares / add_metadata):
+    for every term the documents with their counts (columns of a sparse CSC matrix), tagged with
+    id, party, text_type, wahlperiode and datum of the document and the number of terms per document.
+    Keyword lists (e.g. the keywords of keyATM_posTagging.R) are counted without reading the texts again:
+
+    index = KeywordIndex.build(df_party_shares, stopwords = get_stopwords())
+    index.save('out/keyword_index')
+    index = KeywordIndex.load('out/keyword_index')
+    index.counts({'1_Flucht': ['migration', 'afrika', 'syrien']}, freq = 'MS', party = 'AfD', text_type = 'main_text')
+
+    The terms are tokenized and lemmatized like in dtm.py (see dtm.tokenize), the keywords have to be given
+    in the same form (lower case lemmas).
+
+    Params:
+     DocumentTermMatrix: dtm (all terms, without pruning)
+     dict: options (lemmatizer, pos, model and stopwords used for the index, see dtm.DTMBuilder)
+    '''
+    def __init__(self, dtm, options):
+        self.dtm = dtm
+        self.options = options
+        self.postings = dtm.matrix.tocsc() # column = documents of a term
+        self.terms = {term: i for i, term in enumerate(dtm.vocabulary)}
+        self.lengths = np.asarray(dtm.matrix.sum(axis = 1)).ravel()
+
+    @classmethod
+    def build(cls, df, column = 'text', lemmatizer = 'spacy', pos = POS, stopwords = frozenset(), model = 'de_core_news_sm',
+              workers = 1, chunksize = 10):
+        '''
+        Builds the index over all texts of a dataframe (see dtm.DTMBuilder for the params).
+        '''
+        options = {'lemmatizer': lemmatizer, 'pos': list(pos), 'stopwords': sorted(stopwords), 'model': model}
+        return cls(cls._build_dtm(df, column, options, workers, chunksize), options)
+
+    @staticmethod
+    def _build_dtm(df, column, options, workers, chunksize):
+        return build_dtm(df, column, drop_empty = False, lemmatizer = options['lemmatizer'], pos = tuple(options['pos']),
+                         stopwords = frozenset(options['stopwords']), model = options['model'],
+                         workers = workers, chunksize = chunksize)
+
+    def update(self, df, column = 'text', keep = None, workers = 1, chunksize = 10):
+        '''
+        Adds the documents of new or changed protocols, the documents of protocols, which are already in the index,
+        are replaced.
+
+        Params:
+         pd.DataFrame: df (party shares of the protocols)
+         str: column (text column)
+         iterable: keep (optional, ids of all current protocols: documents of other protocols are dropped)
+         int: workers, chunksize (see dtm.DTMBuilder)
+
+        Returns:
+         KeywordIndex: self
+        '''
+        new = self._build_dtm(df, column, self.options, workers, chunksize)
+
+        # Terms of the new documents get the column of the same term in the index (or a new column at the end)
+        vocabulary = list(self.dtm.vocabulary)
+        terms = dict(self.terms)
+        for term in new.vocabulary:
+            if term not in terms:
+                terms[term] = len(vocabulary)
+                vocabulary.append(term)
+        new_matrix = new.matrix.tocoo()
+        new_matrix = sparse.csr_matrix((new_matrix.data, (new_matrix.row, np.array([terms[t] for t in new.vocabulary],
+                                        dtype = np.int64)[new_matrix.col])), shape = (new.shape[0], len(vocabulary)))
+
+        ids = self.dtm.docs['id'].astype(str)
+        kept = ~ids.isin(set(new.docs['id'].astype(str)))
+        if keep is not None:
+            kept &= ids.isin({str(protocol_id) for protocol_id in keep})
+        kept = np.flatnonzero(kept.to_numpy())
+        old_matrix = self.dtm.matrix[kept]
+        old_matrix.resize((len(kept), len(vocabulary)))
+
+        matrix = sparse.vstack([old_matrix, new_matrix], format = 'csr')
+        docs = pd.concat([self.dtm.docs.iloc[kept], new.docs], ignore_index = True)
+        self.__init__(DocumentTermMatrix(matrix, vocabulary, docs), self.options)
+        return self
+
+    def save(self, path):
+        '''
+        Stores the index in a folder (see DocumentTermMatrix.save, and the options in options.json).
+        '''
+        self.dtm.save(path)
+        with open(os.path.join(path, 'options.json'), 'w', encoding = 'utf-8') as f:
+            json.dump(self.options, f, ensure_ascii = False)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'options.json'), encoding = 'utf-8') as f:
+            options = json.load(f)
+        return cls(DocumentTermMatrix.load(path), options)
+
+    def lookup(self, term):
+        '''
+        Returns the documents (rows of dtm.docs) with the term and its count.
+        '''
+        column = self.terms.get(term.lower())
+        if column is None:
+            return self.dtm.docs.iloc[0:0].assign(count = pd.Series(dtype = 'int64'))
+        start, end = self.postings.indptr[column], self.postings.indptr[column + 1]
+        rows = self.postings.indices[start:end]
+        return self.dtm.docs.iloc[rows].assign(count = self.postings.data[start:end])
+
+    def counts(self, keywords, by = (), freq = None, start = None, end = None, **filters):
+        '''
+        Returns count and proportion of every keyword per group, e.g. per month for AfD main_text:
+        counts(keywords, freq = 'MS', party = 'AfD', text_type = 'main_text')
+
+        Params:
+         list/dict: keywords (list of words or dict topic -> list of words, like the keyword lists of keyATM)
+         tuple: by (columns of the documents to group by, e.g. ('party', 'text_type'))
+         str: freq (optional, group by periods of the datum, e.g. 'MS' = month, 'YS' = year)
+         str: start, end (optional, dates, inclusive)
+         filters: only documents with these values, e.g. party = 'AfD' or wahlperiode = [18, 19] (see corpus_stats.filter_mask)
+
+        Returns:
+         pd.DataFrame: 1 row per group (and topic) and keyword. Columns: groups, (topic), keyword,
+                       count, documents (number of documents with the keyword), proportion (count / all terms of the group)
+        '''
+        topics = keywords.items() if isinstance(keywords, dict) else [(None, keywords)]
+        pairs = [(topic, word.lower()) for topic, words in topics for word in words]
+        words = list(dict.fromkeys(word for _, word in pairs))
+
+        docs = self.dtm.docs
+        rows = np.flatnonzero(filter_mask(docs, start, end, **filters))
+        counts = np.zeros((len(rows), len(words)), dtype = np.int64)
+        present = [i for i, word in enumerate(words) if word in self.terms]
+        if present:
+            columns = self.postings[:, [self.terms[words[i]] for i in present]] # only the postings of the keywords
+            counts[:, present] = columns[rows].toarray()
+
+        frame = pd.DataFrame(counts, columns = words)
+        frame['_terms'] = self.lengths[rows]
+        for column in list(by) + (['datum'] if freq else []):
+            frame[column] = docs[column].iloc[rows].to_numpy()
+        keys = list(by) + ([pd.Grouper(key = 'datum', freq = freq)] if freq else [])
+        if not keys:
+            frame['_all'] = 0
+            keys = ['_all']
+
+        sums = frame.groupby(keys, observed = True)[words + ['_terms']].sum()
+        frame[words] = frame[words] > 0
+        documents = frame.groupby(keys, observed = True)[words].sum()
+
+        grouped = sums[words].stack().rename('count').to_frame()
+        grouped['documents'] = documents.stack()
+        terms = sums['_terms'].reindex(grouped.index.droplevel(-1)).to_numpy()
+        grouped['proportion'] = np.divide(grouped['count'].to_numpy(), terms, out = np.zeros(len(grouped)), where = terms > 0)
+        groups = list(grouped.index.names[:-1])
+        grouped = grouped.rename_axis(groups + ['keyword']).reset_index().drop(columns = '_all', errors = 'ignore')
+        groups = [g for g in groups if g != '_all']
+
+        result = pd.DataFrame(pairs, columns = ['topic', 'keyword']).merge(grouped, on = 'keyword')
+        sort = groups + (['topic'] if isinstance(keywords, dict) else [])
+        return result.sort_values(sort + ['count'], ascending = [True] * len(sort) + [False], kind = 'stable',
+                                  ignore_index = True)[sort + ['keyword', 'count', 'documents', 'proportion']]
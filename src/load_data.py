@@ -1,8 +1,44 @@
 import pandas as pd
-import bundestag_api
+from src.dip_client import fetch_protocols, iter_documents, RateLimiter
+from src.cache import get_version
+from src.people import get_speaker_matcher
+from src.instrumentation import stage, record_cache
 
 
-def get_metadata(key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF'):
+def iter_metadata(key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF', wahlperioden = (18, 19), zuordnung = 'BT',
+                  start = None, end = None, updated_since = None, rate_limit = None, timeout = 30, retries = 3):
+    '''
+    Yields the metadata of the Plenarprotokolle page by page, as they arrive (see dip_client.iter_documents).
+    All filters are applied by the API, so only the needed records are downloaded (and there is no limit on the number).
+
+    Params:
+     str: current api key
+     tuple: wahlperioden
+     str: zuordnung ('BT' = Bundestag, 'BR' = Bundesrat)
+     str: start, end (optional, dates of the sessions, e.g. '2021-01-11', inclusive)
+     str: updated_since (optional, only records updated since then, e.g. '2022-12-06T10:00:00+01:00')
+     float: rate_limit (optional, max. requests per second)
+     float: timeout (per request, in seconds)
+     int: retries (retries with backoff per request)
+
+    Returns:
+     generator: metadata (dict) per protocol
+    '''
+    params = {'f.wahlperiode': list(wahlperioden), 'f.zuordnung': zuordnung}
+    if start is not None:
+        params['f.datum.start'] = start
+    if end is not None:
+        params['f.datum.end'] = end
+    if updated_since is not None:
+        params['f.aktualisiert.start'] = updated_since
+
+    for d in iter_documents('plenarprotokoll', key, params, timeout = timeout, retries = retries,
+                            limiter = RateLimiter(rate_limit)):
+        if d['wahlperiode'] in wahlperioden and d['herausgeber'] == zuordnung: # nur Bundestag (nicht Bundesrat)
+            yield d
+
+
+def get_metadata(key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF', cache = None, refresh = False, updated_since = None):
     '''
     Returns Bundestagsprotokolle of period 18 and 19 as list of dictionaries
     
@@ -12,46 +48,120 @@ def get_metadata(key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF'):
 
     Params: 
      str: current api key
+     ResponseCache: cache (optional, see cache.py). If given, the metadata are only loaded from the API
+                    the first time or with refresh=True, otherwise they are read from the cache.
+                    With refresh=True, only the records updated since the newest cached record are loaded
+                    and merged into the cached ones.
+     bool: refresh (load metadata from the API, even if they are cached)
+     str: updated_since (optional, return only the records updated since then, see iter_metadata; no cache)
 
     Returns:
      list: metadata as list of dicts
     '''
-    # Initialize data (will be list of dictionaries)
-    all_protocolls_18_19 = []
-    
-    bta = bundestag_api.btaConnection(apikey = key)
-    data = bta.query(resource="plenarprotokoll", num=1000)
-    count = 0
-    
-    for d in data:
-        if (d['wahlperiode'] == 18 or d['wahlperiode'] == 19) and d['herausgeber'] == 'BT':  # nur Bundestag (nicht Bundesrat)
-            all_protocolls_18_19.append(d)
-            count+=1
+    if updated_since is not None:
+        with stage('get_metadata'):
+            return list(iter_metadata(key = key, updated_since = updated_since))
+
+    cached = None
+    if cache is not None:
+        cached = cache.get('listing', 'plenarprotokoll')
+        record_cache('listing', int(cached is not None), int(cached is None))
+        if cached is not None and not refresh:
+            print(f'Plenarprotkolle (Bundestag) aus den Wahlperioden 18 und 19 aus dem Cache geladen. Anzahl: {len(cached)}')
+            return cached
+
+    with stage('get_metadata'):
+        if cached:
+            # Only what changed since the last download: changed records replace the cached ones, new ones come first
+            since = pd.to_datetime([d['aktualisiert'] for d in cached], utc = True).max().isoformat()
+            updated = {d['id']: d for d in iter_metadata(key = key, updated_since = since)}
+            known = {d['id'] for d in cached}
+            all_protocolls_18_19 = ([d for d in updated.values() if d['id'] not in known]
+                                    + [updated.get(d['id'], d) for d in cached])
+            print(f'Plenarprotkolle (Bundestag) aus den Wahlperioden 18 und 19 aktualisiert: {len(updated)}')
+        else:
+            all_protocolls_18_19 = list(iter_metadata(key = key))
             
-    print(f'Plenarprotkolle (Bundestag) aus den Wahlperioden 18 und 19 geladen. Anzahl: {count}')
+    print(f'Plenarprotkolle (Bundestag) aus den Wahlperioden 18 und 19 geladen. Anzahl: {len(all_protocolls_18_19)}')
+
+    if cache is not None:
+        cache.put('listing', 'plenarprotokoll', all_protocolls_18_19)
+        cache.save()
 
     return all_protocolls_18_19
 
 
-def clean_protocols(protocols):
+def get_metadata_table(metadata = None, key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF', cache = None):
+    '''
+    Returns the metadata of the protocols as typed table with 1 row per protocol, to be loaded once and shared by all stages.
+    Columns: id (int), wahlperiode (int), datum (datetime64), dokumentnummer, titel, herausgeber, dokumentart,
+    aktualisiert (datetime64, UTC), pdf_hash
+
+    Params:
+     list: metadata (optional, result of get_metadata; loaded if not given). An existing table is returned unchanged.
+     str: current api key
+     ResponseCache: cache (optional, used when the metadata are loaded, see get_metadata)
+
+    Returns:
+     pd.DataFrame: metadata table
+    '''
+    if isinstance(metadata, pd.DataFrame):
+        return metadata
+    if metadata is None:
+        metadata = get_metadata(key = key, cache = cache)
+
+    columns = ['id', 'wahlperiode', 'datum', 'dokumentnummer', 'titel', 'herausgeber', 'dokumentart', 'aktualisiert', 'pdf_hash']
+    table = pd.DataFrame([{c: md.get(c) for c in columns} for md in metadata], columns = columns)
+
+    table['id'] = table['id'].astype('int64')
+    table['wahlperiode'] = table['wahlperiode'].astype('int64')
+    table['datum'] = pd.to_datetime(table['datum'], format = '%Y-%m-%d')
+    table['aktualisiert'] = pd.to_datetime(table['aktualisiert'], utc = True, format = 'ISO8601', errors = 'coerce')
+
+    return table.drop_duplicates('id').reset_index(drop = True)
+
+
+def get_relevant_text(t, matcher):
+    '''
+    Returns the main text of a protocol text (the last part, which starts with a presiding person, see clean_protocols).
+    '''
+    relevant = ''
+    for s in t.split('\n\n\n\n\n\n'):    # Inhaltsverzeichnis löschen: alles vor: \n\n\n\n\n\n\n\n
+        s = s.strip()
+        if matcher.match(s, 'presiding'):
+            relevant = s
+    return relevant.replace('\xa0', ' ') # replace this funky char (see names list)
+
+
+def clean_protocols(protocols, low_memory = False):
     '''
     For a given dataframe of protocols (with text), returns a cleaned version with only the main text:
     - no contents
     - no title
     - no appendix
+    With low_memory, the column text is replaced by the main text one protocol after the other
+    (instead of the additional columns text_split and text_relevant).
     Params: 
      pd.DataFrame: data
+     bool: low_memory
 
     Returns:
      pd.DataFrame: cleaned data
     '''
-    # alle Namen in Liste speichern
-    known_names = ['Präsident Dr. Wolfgang Schäuble:', 'Präsident Dr. Wolfgang Schäuble :', 
-                   'Präsident Dr. Norbert Lammert:', 'Präsident Dr. Norbert Lammert:', 'Präsident Prof. Dr. Norbert Lammert:', 'Präsident Dr. Norbert Lammert :', 'Präsident Dr. Norbert Lammert :',
-                   'Vizepräsidentin Claudia Roth:', 'Vizepräsident Dr. Hans-Peter Friedrich', 'Vizepräsident Wolfgang Kubicki',
-                   'Vizepräsident Thomas Oppermann:', 'Vizepräsidentin Petra Pau:', 'Alterspräsident Dr. Hermann Otto Solms:',
-                   'Vizepräsident Johannes Singhammer:', 'Vizepräsidentin Ulla Schmidt:', 'Vizepräsident Peter Hintze:',
-                   'Vizepräsidentin Edelgard Bulmahn:', 'Alterspräsident Dr. Heinz Riesenhuber:']
+    with stage('clean_protocols', protocols, 'text'):
+        return _clean_protocols(protocols, low_memory)
+
+
+def _clean_protocols(protocols, low_memory):
+    # alle Namen der Präsidenten (siehe people.get_neutral_persons) in einem Matcher
+    matcher = get_speaker_matcher()
+
+    if low_memory:
+        texts = protocols.pop('text').tolist()
+        for i in range(len(texts)):
+            texts[i] = get_relevant_text(texts[i], matcher) # the full text is released right away
+        protocols['text'] = texts
+        return protocols
     
     protocols['text_split'] = ''
     protocols['text_relevant'] = ''
@@ -63,11 +173,7 @@ def clean_protocols(protocols):
         
         for s in split_text:
             s = s.strip()
-            isrelevant = False
-            for n in known_names:
-                if s.startswith(n):
-                    isrelevant = True
-            if isrelevant:
+            if matcher.match(s, 'presiding'):
                 protocols.at[index, 'text_relevant'] = s
         
         protocols.at[index, 'text_relevant'] = protocols.at[index, 'text_relevant'].replace('\xa0', ' ') # replace this funky char (see names list)
@@ -77,30 +183,85 @@ def clean_protocols(protocols):
     return protocols
 
 
-def get_textdata(pure_text = True, key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF'):
+def get_protocol_texts(ids, versions, key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF', concurrent = False,
+                       max_workers = 8, rate_limit = 10, timeout = 30, retries = 3, cache = None):
+    '''
+    Returns [id, text] for the given protocols (full text, same order as ids).
+    With a cache, only protocols, which are not cached in their current version, are downloaded (see get_textdata).
+
+    Params:
+     list: ids (protocol ids)
+     dict: versions (protocol id -> version, see cache.get_version)
+     (all other params: see get_textdata)
+
+    Returns:
+     list: [id, text] per protocol
+    '''
+    # Only download what is not cached in the current version
+    to_fetch = ids if cache is None else cache.stale_keys('plenarprotokoll-text', versions)
+    if cache is not None:
+        record_cache('plenarprotokoll-text', len(ids) - len(to_fetch), len(to_fetch))
+
+    with stage('download', to_fetch) as record:
+        # get extensive data for specific protocols (one after the other, if not concurrent)
+        if concurrent:
+            fetched = fetch_protocols(to_fetch, key, max_workers = max_workers, rate_limit = rate_limit,
+                                      timeout = timeout, retries = retries)
+        else:
+            fetched = fetch_protocols(to_fetch, key, max_workers = 1, rate_limit = None, timeout = timeout, retries = retries)
+        if record is not None:
+            record['mb'] = round(sum(len(p['text']) for p in fetched) / 2**20, 3)
+
+    fetched = dict(zip(to_fetch, fetched))
+    if cache is not None:
+        for protocol_id, p in fetched.items():
+            cache.put('plenarprotokoll-text', protocol_id, p, versions[protocol_id])
+        cache.save()
+
+    result_list = []
+    for protocol_id in ids:
+        p = fetched[protocol_id] if protocol_id in fetched else cache.get('plenarprotokoll-text', protocol_id)
+        result_list.append([protocol_id, p['text']])
+    return result_list
+
+
+def get_textdata(pure_text = True, key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF', concurrent = False,
+                 max_workers = 8, rate_limit = 10, timeout = 30, retries = 3, cache = None, refresh = False,
+                 low_memory = False):
     '''
     Returns protocoll text + protocoll id
     metadata as list of dicts
     Params: 
      bool: pure_text (if True, return cleaned text with clean_protocoll() function)
      str: current api key
+     bool: concurrent (if True, download several protocols at once, see dip_client.fetch_protocols)
+     int: max_workers (only concurrent: number of parallel requests)
+     float: rate_limit (only concurrent: max. requests per second)
+     float: timeout (only concurrent: timeout per request in seconds)
+     int: retries (only concurrent: retries with backoff per request)
+     ResponseCache: cache (optional, see cache.py). If given, only protocols that are new or changed
+                    (different aktualisiert/pdf_hash) are downloaded, all others are read from the cache.
+     bool: refresh (only with cache: check the API for new or changed protocols)
+     bool: low_memory (only pure_text: keep only one copy of the texts, see clean_protocols)
 
     Returns:
      pd.DataFrame: data as dataframe
     '''
-    bta = bundestag_api.btaConnection(apikey = key)
-    metadata = get_metadata()
-    result_list = []
+    metadata = get_metadata(key = key, cache = cache, refresh = refresh)
+    ids = [protocol['id'] for protocol in metadata]
+    versions = {protocol['id']: get_version(protocol) for protocol in metadata}
 
-    for protocol in metadata:
-        p = bta.get_plenaryprotocol(protocol['id']) # get extensive data for specific protocol
-        result_list.append([protocol['id'], p['text']])
+    result_list = get_protocol_texts(ids, versions, key = key, concurrent = concurrent, max_workers = max_workers,
+                                     rate_limit = rate_limit, timeout = timeout, retries = retries, cache = cache)
     
     protocols = pd.DataFrame(result_list, columns = ['id', 'text'])
                                   
+    if pure_text and low_memory:
+        del result_list # only the dataframe holds the full texts now
+        return clean_protocols(protocols, low_memory = True)
     if pure_text:
         protocols = clean_protocols(protocols)[['id', 'text_relevant']] # select only main text
         protocols = protocols.rename(columns = {'text_relevant': 'text'})
         return protocols
     else: 
-        return protocols
\ No newline at end of file
+        return protocols
@@ -1,33 +1,228 @@
+import os
+import re
 import pandas as pd
-import numpy as np
-from io import StringIO
-# you might need to install lxml
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from src.people import get_parties, get_government_table
 
-def get_df():
+
+# Root element of the structured protocols (DTD of the Bundestag since period 19): speeches, speakers and comments are
+# marked up (<rede>, <redner>, <kommentar>). Other files (<DOKUMENT> with a flat TEXT) are parsed by parse_protocol_file.
+STRUCTURED_ROOT = 'dbtplenarprotokoll'
+
+# Fraktion as written in <fraktion> -> name in get_parties()
+FRAKTIONEN = {'fraktionslos': 'parteilos', 'bündnis 90/die grünen': 'BÜNDNIS 90/DIE GRÜNEN', 'die linke': 'DIE LINKE',
+              'cdu/csu': 'CDU/CSU', 'spd': 'SPD', 'afd': 'AfD', 'fdp': 'FDP'}
+
+
+def find_protocol_files(wahlperioden = (18, 19), path = 'data'):
+    '''
+    Returns all available XML files of the given Wahlperioden, sorted by protocol number.
+    The files are expected in <path>/pp<wahlperiode>/<protocol number>.xml (e.g. data/pp18/18001.xml)
+
+    Params:
+     list: wahlperioden
+     str: path (folder with the downloaded data)
+
+    Returns:
+     list: file paths
+    '''
+    files = []
+    for wp in wahlperioden:
+        folder = os.path.join(path, f'pp{wp}')
+        if not os.path.isdir(folder):
+            print(f'Ordner {folder} nicht gefunden, Wahlperiode {wp} wird übersprungen.')
+            continue
+        numbers = [int(f[:-4]) for f in os.listdir(folder) if re.fullmatch(r'\d+\.xml', f)]
+        files += [os.path.join(folder, f'{n}.xml') for n in sorted(numbers)]
+    return files
+
+
+def parse_protocol_file(file):
+    '''
+    Parses one XML file incrementally (iterparse) and returns the elements of <DOKUMENT> as dict,
+    e.g. WAHLPERIODE, DOKUMENTART, NR, DATUM, TITEL, TEXT.
+    Missing or corrupt files return None.
+
+    Params:
+     str: file path
+
+    Returns:
+     dict: protocol data (or None)
+    '''
+    record = {}
+    depth = 0
+    try:
+        for event, elem in ET.iterparse(file, events = ('start', 'end')):
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1: # direct child of <DOKUMENT>
+                record[elem.tag] = elem.text
+                elem.clear() # free memory of the (large) TEXT element
+    except (OSError, ET.ParseError) as e:
+        print(f'Datei {file} konnte nicht gelesen werden und wird übersprungen: {e}')
+        return None
+    return record
+
+
+@lru_cache(maxsize = 1)
+def _government_parties():
+    # Name without titles and office (e.g. 'Angela Merkel') -> party, see people.get_government_table
+    return {strip_titles(name.split(',')[0]): party for name, party, _ in get_government_table()}
+
+
+def strip_titles(name):
+    return ' '.join(w for w in name.split() if not w.endswith('.'))
+
+
+def get_party(fraktion, name = None):
+    '''
+    Returns the party (as in get_parties) of a <fraktion> or, if it is missing (government persons),
+    of the name in the government table (see people.get_government_table). None, if unknown.
+    '''
+    if fraktion:
+        fraktion = ' '.join(fraktion.split())
+        return FRAKTIONEN.get(fraktion.lower(), fraktion if fraktion in get_parties() else None)
+    if name:
+        return _government_parties().get(strip_titles(name))
+    return None
+
+
+def get_speaker(redner):
+    '''
+    Returns speaker, party and role ('MdB' or 'government', see preprocessing.segment_speeches) of a <redner> element.
+    '''
+    name = redner.find('name')
+    name = name if name is not None else redner
+    text = lambda tag: ' '.join((name.findtext(tag) or '').split())
+    speaker = ' '.join(t for t in (text('titel'), text('vorname'), text('namenszusatz'), text('nachname')) if t)
+    role = 'government' if name.find('rolle') is not None or not text('fraktion') else 'MdB'
+    return speaker, get_party(text('fraktion'), speaker), role
+
+
+def parse_structured_file(file):
+    '''
+    Parses a structured XML file (see STRUCTURED_ROOT) incrementally in one pass and returns the protocol as dict:
+    NR (e.g. '19/1'), WAHLPERIODE, DATUM and
+    - speeches: list of dicts speech, speaker, party, role, text (the paragraphs of the speech, without comments).
+      A speech starts at every speaker (<p klasse="redner">, e.g. again after a question of another MdB) and at every
+      presiding person (<name> within <rede>, role 'presiding', party None). Text outside <rede> (agenda, presiding
+      persons between the speeches) belongs to no speech.
+    - interruptions: list of the texts of all <kommentar> (with parentheses, see preprocessing.interruption_records)
+    Files without this structure are parsed by parse_protocol_file (flat TEXT, for the text heuristics).
+    Missing or corrupt files return None.
+
+    Params:
+     str: file path
+
+    Returns:
+     dict: protocol data (or None)
+    '''
+    record = None
+    speeches, interruptions = [], []
+    tags = [] # open elements
+    current = None # speech of the current paragraphs
+    try:
+        for event, elem in ET.iterparse(file, events = ('start', 'end')):
+            if event == 'start':
+                if record is None:
+                    if elem.tag != STRUCTURED_ROOT:
+                        break
+                    record = {'NR': f"{elem.get('wahlperiode')}/{elem.get('sitzung-nr')}",
+                              'WAHLPERIODE': int(elem.get('wahlperiode')), 'DATUM': elem.get('sitzung-datum')}
+                tags.append(elem.tag)
+                if elem.tag == 'rede':
+                    current = None
+                continue
+
+            tags.pop()
+            in_rede = 'rede' in tags
+            if elem.tag == 'p' and in_rede and 'kommentar' not in tags:
+                if elem.get('klasse') == 'redner' and elem.find('redner') is not None:
+                    speaker, party, role = get_speaker(elem.find('redner'))
+                    current = {'speech': len(speeches), 'speaker': speaker, 'party': party, 'role': role, 'text': []}
+                    speeches.append(current)
+                elif current is not None:
+                    paragraph = ' '.join(''.join(elem.itertext()).split())
+                    if paragraph:
+                        current['text'].append(paragraph)
+                elem.clear()
+            elif elem.tag == 'name' and tags and tags[-1] == 'rede':
+                # presiding person within a speech, e.g. "Präsident Dr. Wolfgang Schäuble:"
+                speaker = ' '.join(''.join(elem.itertext()).split()).rstrip(': ')
+                current = {'speech': len(speeches), 'speaker': speaker, 'party': None, 'role': 'presiding', 'text': []}
+                speeches.append(current)
+            elif elem.tag == 'kommentar':
+                comment = ' '.join(''.join(elem.itertext()).split())
+                if comment:
+                    interruptions.append(comment if comment.startswith('(') else f'({comment})')
+                elem.clear()
+            elif elem.tag == 'rede':
+                current = None
+                elem.clear()
+            elif elem.tag in ('vorspann', 'anlagen', 'rednerliste', 'tagesordnungspunkt', 'sitzungsbeginn'):
+                elem.clear()
+    except (OSError, ET.ParseError) as e:
+        print(f'Datei {file} konnte nicht gelesen werden und wird übersprungen: {e}')
+        return None
+
+    if record is None:
+        return parse_protocol_file(file)
+    for speech in speeches:
+        speech['text'] = '\n'.join(speech['text'])
+    record['speeches'] = speeches
+    record['interruptions'] = interruptions
+    return record
+
+
+def iter_protocols(wahlperioden = (18, 19), path = 'data', workers = None, chunksize = 4, structured = False):
+    '''
+    Yields the protocols of the given Wahlperioden one by one as dict (see parse_protocol_file), in protocol order.
+    The files are parsed in parallel by `workers` processes (None = number of CPUs, 1 = no extra processes).
+    Missing or corrupt files are skipped.
+
+    Params:
+     list: wahlperioden
+     str: path (folder with the downloaded data)
+     int: workers
+     int: chunksize (number of files per task of a worker)
+     bool: structured (speeches and interruptions of structured files, see parse_structured_file)
+
+    Returns:
+     generator: protocol dicts
+    '''
+    files = find_protocol_files(wahlperioden, path)
+    parse = parse_structured_file if structured else parse_protocol_file
+
+    if workers == 1:
+        records = map(parse, files)
+        yield from (r for r in records if r is not None)
+        return
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        for record in executor.map(parse, files, chunksize = chunksize):
+            if record is not None:
+                yield record
+
+
+def get_df(wahlperioden = (18, 19), path = 'data', workers = None):
     '''
     Returns Bundestagsprotokolle of period 18 and 19 as pandas Dataframe
+    :param wahlperioden: Wahlperioden to load (files in <path>/pp<wahlperiode>/)
+    :param path: folder with the downloaded data
+    :param workers: number of processes for parsing (None = number of CPUs)
     :return: pandas dataframe containing data
     '''
-    # Initialize data frame
-    df = pd.DataFrame()
-    
-    # Iterate over the documents of period 18 and append to df 
-    protokolle_18 = np.arange(18001, 18246)
-    default_path_18 = 'data/pp18/'
-  
-    for p in  protokolle_18:
-        p_path = default_path_18 + str(p) + '.xml'
-        p_df = pd.read_xml(p_path, xpath = '//DOKUMENT')  # name of XML ('DOKUMENT') has to be specified
-        df = pd.concat([df, p_df])
-
-
-    # Now repeat for period 19
-    protokolle_19 = np.arange(19001, 19240)
-    default_path_19 = 'data/pp19/'
-
-    for p in  protokolle_19:
-        p_path = default_path_19 + str(p) + '.xml'
-        p_df = pd.read_xml(p_path, xpath = '//DOKUMENT')  # name of XML ('DOKUMENT') has to be specified
-        df = pd.concat([df, p_df])
-
-    return df
\ No newline at end of file
+    df = pd.DataFrame(list(iter_protocols(wahlperioden, path, workers)))  # build the frame only once
+
+    # Numeric columns (e.g. WAHLPERIODE) as numbers, like pd.read_xml does
+    for column in df.columns:
+        try:
+            df[column] = pd.to_numeric(df[column])
+        except (ValueError, TypeError):
+            pass
+
+    return df
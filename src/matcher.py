@@ -0,0 +1,104 @@
+import re
+
+
+def compile_trie(patterns):
+    '''
+    Compiles a list of strings into one regular expression, which is built like a trie:
+    common prefixes are shared, so the regex engine checks all patterns at once and the cost
+    depends on the length of the text, not on the number of patterns.
+    At every position the longest pattern wins.
+
+    Params:
+     list: patterns
+
+    Returns:
+     re.Pattern: compiled regex (matches nothing if patterns is empty)
+    '''
+    trie = {}
+    for pattern in patterns:
+        node = trie
+        for char in pattern:
+            node = node.setdefault(char, {})
+        node[''] = None # end of a pattern
+
+    def to_regex(node):
+        alternatives = [re.escape(char) + to_regex(child) for char, child in sorted(node.items()) if char != '']
+        if not alternatives:
+            return ''
+        body = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+        return f'(?:{body})?' if '' in node else body # greedy, so longer patterns are preferred
+
+    return re.compile(to_regex(trie) if trie else '(?!)')
+
+
+class SpeakerMatcher:
+    '''
+    Finds and rewrites speaker headers (e.g. 'Präsident Dr. Norbert Lammert:') in a single pass over a text.
+
+    Every pattern belongs to one or more roles (e.g. 'presiding', 'government', 'mdb') and can have a replacement.
+    For every set of roles, the patterns are compiled once into a trie regex (see compile_trie).
+    '''
+    def __init__(self):
+        self.patterns = {} # pattern -> {role: replacement}
+        self.compiled = {}
+
+    def add(self, pattern, role, replacement = None):
+        '''
+        Adds a pattern for a role. If the pattern was already added for this role, the first replacement is kept.
+        '''
+        self.patterns.setdefault(pattern, {}).setdefault(role, replacement)
+        self.compiled = {}
+
+    def _roles(self, roles):
+        return (roles,) if isinstance(roles, str) else tuple(roles)
+
+    def regex(self, roles):
+        '''
+        Returns the compiled regex for all patterns of the given role(s).
+        '''
+        roles = self._roles(roles)
+        if roles not in self.compiled:
+            patterns = [p for p, p_roles in self.patterns.items() if any(r in p_roles for r in roles)]
+            self.compiled[roles] = compile_trie(patterns)
+        return self.compiled[roles]
+
+    def search(self, text, roles):
+        '''
+        Returns the first (longest) pattern of the given role(s) found anywhere in text, or None.
+        '''
+        m = self.regex(roles).search(text)
+        return m.group() if m else None
+
+    def match(self, text, roles):
+        '''
+        Returns the longest pattern of the given role(s), which text starts with, or None.
+        '''
+        m = self.regex(roles).match(text)
+        return m.group() if m else None
+
+    def finditer(self, text, roles):
+        '''
+        Yields (start, end, pattern) for all non-overlapping patterns of the given role(s) in text.
+        '''
+        for m in self.regex(roles).finditer(text):
+            yield m.start(), m.end(), m.group()
+
+    def replace(self, text, roles):
+        '''
+        Replaces all patterns of the given role(s) in text by their replacement (patterns without replacement stay).
+        '''
+        roles = self._roles(roles)
+
+        def replacement(m):
+            p_roles = self.patterns[m.group()]
+            new = next((p_roles[r] for r in roles if r in p_roles), None)
+            return m.group() if new is None else new
+
+        return self.regex(roles).sub(replacement, text)
+
+    def is_pattern(self, text, roles):
+        '''
+        Returns True, if text is exactly one of the patterns of the given role(s) (dict lookup).
+        '''
+        p_roles = self.patterns.get(text, {})
+        return any(r in p_roles for r in self._roles(roles))
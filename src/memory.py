@@ -0,0 +1,61 @@
+import sys
+import pandas as pd
+from contextlib import contextmanager
+
+
+def reset_peak():
+    '''
+    Resets the peak memory (VmHWM) of the process, so the next peak_rss() is the peak since now.
+    Only possible on Linux, elsewhere the peak stays the peak since the start of the process.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    '''
+    Returns the peak memory (resident set size) of the process in bytes (since the start or the last reset_peak),
+    or None if it is not available (Windows).
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource # not available on Windows
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryReport:
+    '''
+    Collects the peak memory of every pipeline stage, e.g.:
+
+    report = MemoryReport()
+    clean = clean_and_split_text(textdata, low_memory = True, report = report)
+    report.to_frame()
+    '''
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        reset_peak()
+        yield name
+        peak = peak_rss()
+        self.stages.append({'stage': name, 'peak_rss_mb': None if peak is None else round(peak / 2**20, 1)})
+
+    def to_frame(self):
+        '''
+        Returns the report as dataframe. Columns: stage, peak_rss_mb
+        '''
+        return pd.DataFrame(self.stages, columns = ['stage', 'peak_rss_mb'])
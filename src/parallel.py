@@ -0,0 +1,70 @@
+import os
+import time
+import pandas as pd
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from src.instrumentation import per_protocol, record_protocols
+
+
+def split_chunks(protocols, chunksize = 10):
+    '''
+    Splits a dataframe into chunks of `chunksize` rows (protocols), in order.
+
+    Params:
+     pd.DataFrame: data
+     int: chunksize
+
+    Returns:
+     list: dataframes
+    '''
+    return [protocols.iloc[i:i + chunksize] for i in range(0, len(protocols), chunksize)]
+
+
+def map_protocols(func, protocols, columns = None, workers = None, chunksize = 10, ignore_index = False, **kwargs):
+    '''
+    Runs a stage, which processes every protocol independently of all others (e.g. identify_interruptions),
+    on chunks of `chunksize` protocols in `workers` processes and puts the results together in the original order.
+    Only the given columns are sent to the processes.
+    func has to be a module-level function (so it can be sent to the processes), kwargs are passed on to it.
+    If the times per protocol are recorded (see instrumentation.Metrics), the time of every chunk is recorded as well.
+
+    Params:
+     function: func (gets a dataframe, returns a dataframe)
+     pd.DataFrame: data
+     list: columns (columns needed by func, None = all)
+     int: workers (number of processes, None = number of CPUs, 1 = no extra processes)
+     int: chunksize (number of protocols per task of a worker)
+     bool: ignore_index (True for stages, which return new rows instead of the rows of the input)
+
+    Returns:
+     pd.DataFrame: results of all chunks
+    '''
+    timed = per_protocol()
+    if columns is not None:
+        protocols = protocols[(['id'] if timed and 'id' not in columns and 'id' in protocols else []) + list(columns)]
+    chunks = split_chunks(protocols, chunksize)
+    name = func.__name__
+    func = partial(func, **kwargs)
+    run = partial(_timed, func) if timed else func
+
+    if workers == 1 or len(chunks) <= 1:
+        results = [run(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers = min(workers or os.cpu_count(), len(chunks))) as executor:
+            results = list(executor.map(run, chunks)) # map keeps the order of the chunks
+
+    if timed:
+        for chunk, (_, seconds) in zip(chunks, results):
+            record_protocols(name, chunk['id'].tolist() if 'id' in chunk else chunk.index.tolist(), seconds)
+        results = [result for result, _ in results]
+
+    results = [r for r in results if not r.empty] or results[:1]
+    if not results:
+        return func(protocols)
+    return pd.concat(results, ignore_index = ignore_index)
+
+
+def _timed(func, chunk):
+    start = time.perf_counter()
+    result = func(chunk)
+    return result, time.perf_counter() - start
@@ -1,6 +1,20 @@
 import pandas as pd
 import re
-import bundestag_api
+from functools import lru_cache
+from src.cache import get_version
+from src.matcher import SpeakerMatcher
+from src.dip_client import iter_documents
+from src.instrumentation import record_cache
+
+
+def get_parties():
+    '''
+    Returns a list of the parties (Fraktionen) in the Bundestag of period 18 and 19, as they are written in the protocols.
+
+    Returns:
+     list: party names
+    '''
+    return ['SPD', 'CDU/CSU', 'DIE LINKE', 'BÜNDNIS 90/DIE GRÜNEN', 'AfD', 'FDP', 'parteilos']
 
 
 def get_neutral_persons():
@@ -14,22 +28,60 @@ def get_neutral_persons():
     neutral_persons = ['Präsident Dr. Wolfgang Schäuble:', 'Präsident Dr. Wolfgang Schäuble :', 'Präsident Dr. Wolfgang Schäuble :', 'Präsident Dr. Wolfgang Schäuble:',
                    'Präsident Dr. Norbert Lammert:', 'Präsident Dr. Norbert Lammert:', 'Präsident Prof. Dr. Norbert Lammert:', 'Präsident Dr. Norbert Lammert :', 'Präsident Dr. Norbert Lammert :',
                    'Vizepräsidentin Claudia Roth:', 'Vizepräsident Dr. Hans-Peter Friedrich', 'Vizepräsident Dr. Hans-Peter Friedrich', 'Vizepräsident Wolfgang Kubicki',
-                   'Vizepräsident Thomas Oppermann:', 'Vizepräsidentin Petra Pau:', 'Alterspräsident Dr. Hermann Otto Solms:', 'Alterspräsident Dr. Hermann Otto Solms:'
+                   'Vizepräsident Thomas Oppermann:', 'Vizepräsidentin Petra Pau:', 'Alterspräsident Dr. Hermann Otto Solms:', 'Alterspräsident Dr. Hermann Otto Solms:',
                    'Vizepräsident Johannes Singhammer:', 'Vizepräsidentin Ulla Schmidt:', 'Vizepräsident Peter Hintze:',
                    'Vizepräsidentin Edelgard Bulmahn:', 'Alterspräsident Dr. Heinz Riesenhuber:']
     
     return neutral_persons
 
 
-def get_mdb(key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF'):
+def get_persons(key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF', cache = None, refresh = False):
+    '''
+    Returns all persons of the DIP API (raw JSON records, see openapi.yaml: Person)
+
+    Params:
+     str: current api key
+     ResponseCache: cache (optional, see cache.py). If given, the persons are only loaded from the API
+                    the first time or with refresh=True, otherwise they are read from the cache.
+     bool: refresh (load persons from the API, even if they are cached)
+
+    Returns:
+     list: persons as dict
+    '''
+    data = None
+    if cache is not None and not refresh:
+        person_ids = cache.get('listing', 'person')
+        record_cache('listing', int(person_ids is not None), int(person_ids is None))
+        if person_ids is not None:
+            data = [cache.get('person', person_id) for person_id in person_ids]
+
+    if data is None:
+        data = list(iter_documents('person', key)) # all pages of the person list
+
+        if cache is not None:
+            for p in data:
+                if not cache.is_fresh('person', p['id'], get_version(p)): # only write new or changed persons
+                    cache.put('person', p['id'], p, get_version(p))
+            cache.put('listing', 'person', [p['id'] for p in data])
+            cache.save()
+
+    return data
+
+
+def get_mdb(key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF', cache = None, refresh = False):
     '''
     Returns a list of relevant politicians, who are MdB (of period 18 and 19)
+    (see also registry.py: the person registry keeps these persons with party, role and Wahlperioden)
+
+    Params:
+     str: current api key
+     ResponseCache: cache (optional, see get_persons)
+     bool: refresh (load persons from the API, even if they are cached)
 
     Returns:
      list: politicians with full name
     '''
-    bta = bundestag_api.btaConnection(apikey = key)
-    data = bta.search_person(num = 10000)
+    data = get_persons(key = key, cache = cache, refresh = refresh)
 
     mdb = []
     try:
@@ -43,7 +95,7 @@ def get_mdb(key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF'):
         for p in data:  
             for role in p['person_roles']:
                 if role['funktion'] == 'MdB' and (18 in role['wahlperiode_nummer'] or 19 in role['wahlperiode_nummer']):
-                    mdb.append(role['nachname'] + ' ' + role['nachname'])
+                    mdb.append(role['vorname'] + ' ' + role['nachname'])
 
     except: KeyError
 
@@ -54,10 +106,24 @@ def get_regierende(mdb_format = False, include_party = False):
     '''
     Returns a list of politicians, who are part of the federal government (of period 18 and 19) or Ministerpräsident during that time.
     Returns also their party.
+    The lists are built only once (see get_government_table).
 
     Returns:
      list: politicians with full name and party [name, party_name]
     '''
+    return [p.copy() if isinstance(p, list) else p for p in _regierende(mdb_format, include_party)]
+
+
+@lru_cache(maxsize = 1)
+def get_government_table():
+    '''
+    Returns all government persons (see get_regierende) with the Wahlperioden, in which they speak:
+    Regierung 17 -> 18 (Sitzung 1-3), Regierung 18 -> 18, Regierung 19 -> 19, Landesregierungen -> 18 and 19.
+    Built only once.
+
+    Returns:
+     tuple: (name and office, party, wahlperioden) per person
+    '''
     # im Folgenden die Bundesregierung 18
     bundreg_18 = [['Dr. Angela Merkel, Bundeskanzlerin', 'CDU/CSU'], 
                ['Sigmar Gabriel, Bundesminister des Auswärtigen', 'SPD'],
@@ -234,7 +300,13 @@ def get_regierende(mdb_format = False, include_party = False):
                ]
     
 
-    government = bundreg_17 + bundreg_18 + bundreg_19 + landreg
+    groups = [(bundreg_17, (18,)), (bundreg_18, (18,)), (bundreg_19, (19,)), (landreg, (18, 19))]
+    return tuple((person, party, wahlperioden) for group, wahlperioden in groups for person, party in group)
+
+
+@lru_cache(maxsize = 4)
+def _regierende(mdb_format, include_party):
+    government = [[person, party] for person, party, _ in get_government_table()]
 
     # Change format to format of the other MdB --> "<Full Name> (<party>):\n"
     gov_mdb_format = []
@@ -254,4 +326,39 @@ def get_regierende(mdb_format = False, include_party = False):
         if include_party:
             return government
         else:
-            return [pair[0] for pair in government]
\ No newline at end of file
+            return [pair[0] for pair in government]
+
+
+def get_speaker_matcher(mdb = ()):
+    '''
+    Returns a SpeakerMatcher (see matcher.py) for all speaker headers used by the cleaning stages.
+    It is built only once (per MdB list) and then shared. Roles:
+    - 'presiding': neutral persons (see get_neutral_persons)
+    - 'government': government persons in original format "<<name>>, <<office>>:", replaced by "<<name>> (<<party>>):"
+    - 'mdb': full names of the MdB (only if mdb is given, see get_mdb)
+
+    Params:
+     list: mdb (optional, result of get_mdb)
+
+    Returns:
+     SpeakerMatcher: matcher
+    '''
+    return _build_speaker_matcher(tuple(mdb))
+
+
+@lru_cache(maxsize = 4)
+def _build_speaker_matcher(mdb):
+    matcher = SpeakerMatcher()
+
+    for person in get_neutral_persons():
+        matcher.add(person, 'presiding')
+
+    regierende_original = get_regierende(mdb_format = False, include_party = True)
+    regierende_correct = get_regierende(mdb_format = True, include_party = True)
+    for person_old, person_new in zip(regierende_original, regierende_correct):
+        matcher.add(f'{person_old[0]}:', 'government', person_new)
+
+    for name in mdb:
+        matcher.add(name, 'mdb')
+
+    return matcher
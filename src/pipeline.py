@@ -0,0 +1,220 @@
+import os
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from src.cache import get_version
+from src.people import get_speaker_matcher
+from src.registry import get_registry
+from src.load_data import get_metadata, get_metadata_table, get_protocol_texts, get_relevant_text
+from src.load_data_website import iter_protocols
+from src.preprocessing import clean_and_split_text, party_shares, party_shares_structured, add_metadata
+from src.dataset import write_party_shares
+
+
+def iter_batches(items, batch_size = 10):
+    '''
+    Yields lists of at most batch_size items.
+    '''
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_textdata(batch_size = 10, key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF', metadata = None,
+                  concurrent = False, max_workers = 8, rate_limit = 10, timeout = 30, retries = 3, cache = None, refresh = False):
+    '''
+    Like get_textdata (with pure_text), but yields the protocols in batches of batch_size as dataframe (columns id, text).
+    The next batch is already downloaded, while the current one is processed.
+
+    Params:
+     int: batch_size (number of protocols per batch)
+     list: metadata (optional, result of get_metadata; loaded if not given)
+     (all other params: see load_data.get_textdata)
+
+    Returns:
+     generator: dataframes
+    '''
+    if metadata is None:
+        metadata = get_metadata(key = key, cache = cache, refresh = refresh)
+    matcher = get_speaker_matcher()
+
+    def load(batch):
+        versions = {protocol['id']: get_version(protocol) for protocol in batch}
+        texts = get_protocol_texts([protocol['id'] for protocol in batch], versions, key = key, concurrent = concurrent,
+                                   max_workers = max_workers, rate_limit = rate_limit, timeout = timeout,
+                                   retries = retries, cache = cache)
+        return pd.DataFrame([[protocol_id, get_relevant_text(t, matcher)] for protocol_id, t in texts], columns = ['id', 'text'])
+
+    # Download in a background thread, one batch ahead
+    with ThreadPoolExecutor(max_workers = 1) as downloader:
+        future = None
+        for batch in iter_batches(metadata, batch_size):
+            current, future = future, downloader.submit(load, batch)
+            if current is not None:
+                yield current.result()
+        if future is not None:
+            yield future.result()
+
+
+def stream_party_shares(batches, metadata = None, cache = None, workers = 1, chunksize = 10, stats = None):
+    '''
+    Runs clean_and_split_text -> party_shares -> add_metadata on one batch of protocols after the other
+    and yields the party shares of every batch, as soon as it is done. Only one batch is in memory at a time.
+
+    Params:
+     iterable: batches (dataframes with columns id, text, e.g. from iter_textdata)
+     list: metadata (optional, result of get_metadata or get_metadata_table; loaded if not given)
+     ResponseCache: cache (optional, used for metadata and person registry)
+     int: workers (number of processes per batch, see preprocessing.clean_and_split_text)
+     int: chunksize (number of protocols per task of a worker)
+     StatsCube: stats (optional, updated with every batch, see corpus_stats.py)
+
+    Returns:
+     generator: dataframes with columns id, party, text, text_type, text_length, num_words, wahlperiode, datum
+    '''
+    metadata = get_metadata_table(metadata, cache = cache)
+    registry = get_registry(cache = cache)
+
+    for protocols in batches:
+        clean = clean_and_split_text(protocols, cache = cache, workers = workers, chunksize = chunksize,
+                                     low_memory = True, registry = registry)
+        shares = party_shares(clean, workers = workers, chunksize = chunksize, low_memory = True)
+        shares = add_metadata(shares, metadata = metadata)
+        if stats is not None:
+            stats.update(shares)
+        yield shares
+
+
+def stream_website_party_shares(wahlperioden = (18, 19), path = 'data', batch_size = 10, workers = None, metadata = None,
+                                cache = None, chunksize = 10, stats = None):
+    '''
+    Like stream_party_shares for the downloaded XML files: structured files (see load_data_website.parse_structured_file)
+    go directly from their speeches and comments to the party shares (see preprocessing.party_shares_structured),
+    without the cleaning stages. Only files with a flat TEXT go through clean_and_split_text and party_shares.
+    The id of the DIP API is looked up by the protocol number (e.g. 19/1) in the metadata, protocols without metadata are skipped.
+
+    Params:
+     list: wahlperioden
+     str: path (folder with the downloaded data)
+     int: batch_size (number of protocols per batch)
+     int: workers (number of processes for parsing and for the text heuristics)
+     list: metadata (optional, result of get_metadata or get_metadata_table; loaded if not given)
+     ResponseCache: cache (optional, used for metadata and person registry)
+     int: chunksize (number of protocols per task of a worker, see stream_party_shares)
+     StatsCube: stats (optional, updated with every batch, see corpus_stats.py)
+
+    Returns:
+     generator: dataframes with columns id, party, text, text_type, text_length, num_words, wahlperiode, datum
+    '''
+    metadata = get_metadata_table(metadata, cache = cache)
+    ids = dict(zip(metadata['dokumentnummer'], metadata['id'].astype(str)))
+
+    for batch in iter_batches(iter_protocols(wahlperioden, path, workers, structured = True), batch_size):
+        structured, flat = [], []
+        for record in batch:
+            if record.get('NR') not in ids:
+                print(f'Protokoll {record.get("NR")} nicht in den Metadaten gefunden und wird übersprungen.')
+            elif 'speeches' in record:
+                structured.append([ids[record['NR']], record['speeches'], record['interruptions']])
+            else:
+                flat.append([ids[record['NR']], record.get('TEXT') or ''])
+
+        if structured:
+            protocols = pd.DataFrame(structured, columns = ['id', 'speeches', 'interruptions'])
+            shares = add_metadata(party_shares_structured(protocols, low_memory = True), metadata = metadata)
+            if stats is not None:
+                stats.update(shares)
+            yield shares
+        if flat:
+            yield from stream_party_shares([pd.DataFrame(flat, columns = ['id', 'text'])], metadata = metadata, cache = cache,
+                                           workers = workers or 1, chunksize = chunksize, stats = stats)
+
+
+def write_csv(frames, path = 'df_party_shares.csv', batch_rows = 1000):
+    '''
+    Appends the rows of all frames to a csv file (like to_csv of one big dataframe: with header and a running index),
+    written in batches of at least batch_rows rows. An existing file is replaced.
+
+    Params:
+     iterable: frames (e.g. from stream_party_shares)
+     str: path
+     int: batch_rows
+
+    Returns:
+     int: number of rows written
+    '''
+    if os.path.exists(path):
+        os.remove(path)
+
+    buffer, buffered, written = [], 0, 0
+
+    def flush():
+        batch = pd.concat(buffer, ignore_index = True)
+        batch.index = pd.RangeIndex(written, written + len(batch))
+        batch.to_csv(path, mode = 'a', header = written == 0)
+        buffer.clear()
+        return len(batch)
+
+    for frame in frames:
+        buffer.append(frame)
+        buffered += len(frame)
+        if buffered >= batch_rows:
+            written += flush()
+            buffered = 0
+    if buffer:
+        written += flush()
+
+    return written
+
+
+def run_streaming(output = 'out/party_shares', source = 'api', batch_size = 10, batch_rows = 1000, cache = None,
+                  stats = None, format = 'parquet', workers = None, chunksize = 10, **kwargs):
+    '''
+    Streams all protocols from the API (source = 'api', see iter_textdata, stream_party_shares) or the downloaded
+    XML files (source = 'website', see stream_website_party_shares) through the pipeline into
+    a parquet dataset partitioned by wahlperiode/party/text_type (see dataset.write_party_shares) or a csv file.
+    Memory use does not depend on the number of protocols.
+
+    Params:
+     str: output (folder of the parquet dataset or csv file, e.g. 'df_party_shares.csv')
+     str: source ('api' or 'website')
+     int: batch_size (number of protocols per batch)
+     int: batch_rows (number of rows per write, only csv)
+     ResponseCache: cache (optional, see cache.py)
+     StatsCube: stats (optional, updated with all protocols and saved at the end, see corpus_stats.py)
+     str: format ('parquet' or 'csv')
+     int: workers (number of processes per batch, see stream_party_shares and stream_website_party_shares;
+                   None: 1 for the API, number of CPUs for the XML files)
+     int: chunksize (number of protocols per task of a worker)
+     kwargs: passed on to iter_textdata or stream_website_party_shares
+
+    Returns:
+     int: number of rows written
+    '''
+    if format not in ('parquet', 'csv'):
+        raise ValueError(f"format must be 'parquet' or 'csv', not {format!r}")
+    metadata = kwargs.pop('metadata', None)
+    if metadata is None:
+        metadata = get_metadata(cache = cache)
+
+    if source == 'api':
+        batches = iter_textdata(batch_size, metadata = metadata, cache = cache, **kwargs)
+        frames = stream_party_shares(batches, metadata = metadata, cache = cache, workers = 1 if workers is None else workers,
+                                     chunksize = chunksize, stats = stats)
+    elif source == 'website':
+        frames = stream_website_party_shares(batch_size = batch_size, metadata = metadata, cache = cache, workers = workers,
+                                             chunksize = chunksize, stats = stats, **kwargs)
+    else:
+        raise ValueError(f"source must be 'api' or 'website', not {source!r}")
+
+    if format == 'parquet':
+        rows = write_party_shares(frames, output)
+    else:
+        rows = write_csv(frames, output, batch_rows)
+    if stats is not None and stats.path is not None:
+        stats.save()
+    return rows
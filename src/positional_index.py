@@ -0,0 +1,217 @@
+import os
+from array import array
+import numpy as np
+import pandas as pd
+from src.dtm import TOKEN_PATTERN
+from src.corpus_stats import filter_mask
+from src.load_data import get_metadata_table
+from src.preprocessing import segment_speeches, speech_texts
+
+
+# Columns of the speech table, which are returned with every snippet
+SPEECH_COLUMNS = ['id', 'speech', 'speaker', 'party', 'role', 'wahlperiode', 'datum']
+
+
+class PositionalIndex:
+    '''
+    Positional full-text index over the speeches (see preprocessing.segment_speeches, main text without interruptions)
+    for phrase, proximity and keyword-in-context (KWIC) queries, e.g.
+
+    PositionalIndex.build(textdata, 'out/positional_index', metadata = metadata)
+    index = PositionalIndex('out/positional_index')
+    index.kwic('illegal*', party = 'AfD')                              # words starting with "illegal"
+    index.kwic('illegale migration', window = 15, wahlperiode = 19)    # phrase
+    index.kwic('welle', near = 'migration', distance = 10)             # "welle" at most 10 words from "migration"
+
+    All words are lower case (no lemmas, see dtm.TOKEN_PATTERN) and numbered in one sequence over all speeches
+    (position). All arrays are stored as .npy files in the folder and memory-mapped, so the index opens
+    without reading them and a query only reads the postings of its terms and the text of its snippets:
+    - terms.npy: sorted vocabulary; term_offsets.npy, postings.npy: positions of every term (in order)
+    - token_start.npy, token_length.npy: byte offsets of every position in text.bin (UTF-8 text of all speeches)
+    - doc_starts.npy: first position of every speech (rows of speeches.pkl, the speech table)
+
+    Params:
+     str: path (folder of the index, see build)
+    '''
+    def __init__(self, path):
+        self.path = path
+        load = lambda name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode = 'r')
+        self.terms = load('terms')
+        self.term_offsets = load('term_offsets')
+        self.postings = load('postings')
+        self.token_start = load('token_start')
+        self.token_length = load('token_length')
+        self.doc_starts = load('doc_starts')
+        self.speeches = pd.read_pickle(os.path.join(path, 'speeches.pkl'))
+        size = os.path.getsize(os.path.join(path, 'text.bin'))
+        self.text = np.memmap(os.path.join(path, 'text.bin'), dtype = np.uint8, mode = 'r') if size else np.zeros(0, np.uint8)
+
+    @classmethod
+    def build(cls, protocols, path, metadata = None, batch_size = 50):
+        '''
+        Builds the index of all speeches of the given protocols and stores it in the folder path.
+        The protocols are split into speeches in batches of batch_size protocols, so only the token arrays
+        (and not the speech texts) of all protocols are kept in memory.
+
+        Params:
+         pd.DataFrame: protocols (columns id, text, e.g. result of load_data.get_textdata)
+         str: path (folder)
+         list: metadata (optional, see load_data.get_metadata_table; loaded if not given)
+         int: batch_size
+
+        Returns:
+         PositionalIndex: index
+        '''
+        os.makedirs(path, exist_ok = True)
+        metadata = get_metadata_table(metadata).set_index('id')[['wahlperiode', 'datum']]
+
+        vocabulary = {}
+        term_ids = array('i')
+        token_start = array('q')
+        token_length = array('B')
+        doc_starts = array('q', [0])
+        tables = []
+        offset = 0
+
+        with open(os.path.join(path, 'text.bin'), 'wb') as f:
+            for i in range(0, len(protocols), batch_size):
+                batch = protocols.iloc[i:i + batch_size]
+                speeches = segment_speeches(batch)
+                for text in speech_texts(batch, speeches):
+                    data = text.encode('utf-8')
+                    previous, position = 0, offset # byte offsets follow the characters, token by token
+                    for m in TOKEN_PATTERN.finditer(text):
+                        position += len(text[previous:m.start()].encode('utf-8'))
+                        length = len(m.group().encode('utf-8'))
+                        term_ids.append(vocabulary.setdefault(m.group().lower(), len(vocabulary)))
+                        token_start.append(position)
+                        token_length.append(min(length, 255))
+                        position += length
+                        previous = m.end()
+                    f.write(data + b'\n')
+                    offset += len(data) + 1
+                    doc_starts.append(len(term_ids))
+                tables.append(speeches.drop(columns = ['start', 'end']))
+
+        speeches = pd.concat(tables, ignore_index = True) if tables else pd.DataFrame(columns = SPEECH_COLUMNS)
+        joined = metadata.reindex(speeches['id'].astype('int64'))
+        speeches['wahlperiode'] = joined['wahlperiode'].to_numpy()
+        speeches['datum'] = joined['datum'].to_numpy()
+        speeches[SPEECH_COLUMNS].to_pickle(os.path.join(path, 'speeches.pkl'))
+
+        # Postings: positions sorted by term (in order of the sorted vocabulary), then by position
+        terms = sorted(vocabulary)
+        rank = np.empty(len(terms), dtype = np.int32)
+        rank[[vocabulary[t] for t in terms]] = np.arange(len(terms), dtype = np.int32)
+        ranks = rank[np.frombuffer(term_ids, dtype = np.int32)] if len(term_ids) else np.zeros(0, np.int32)
+        postings = np.argsort(ranks, kind = 'stable').astype(np.int64)
+        term_offsets = np.concatenate([[0], np.cumsum(np.bincount(ranks, minlength = len(terms)))]).astype(np.int64)
+
+        width = max([len(t) for t in terms] + [1])
+        save = lambda name, values: np.save(os.path.join(path, f'{name}.npy'), values)
+        save('terms', np.array(terms, dtype = f'U{width}'))
+        save('term_offsets', term_offsets)
+        save('postings', postings)
+        save('token_start', np.frombuffer(token_start, dtype = np.int64) if len(token_start) else np.zeros(0, np.int64))
+        save('token_length', np.frombuffer(token_length, dtype = np.uint8) if len(token_length) else np.zeros(0, np.uint8))
+        save('doc_starts', np.frombuffer(doc_starts, dtype = np.int64))
+        return cls(path)
+
+    def positions(self, term):
+        '''
+        Returns the sorted positions of a word, or of all words with the same beginning, if it ends with "*" (e.g. "welle*").
+        '''
+        term = term.lower()
+        if term.endswith('*'):
+            prefix = term[:-1]
+            if len(prefix) >= self.terms.dtype.itemsize // 4: # no longer terms in the index
+                return self.positions(prefix)
+            first = np.searchsorted(self.terms, prefix, side = 'left')
+            last = np.searchsorted(self.terms, prefix + '\U0010ffff', side = 'left')
+            if last - first == 1:
+                return np.asarray(self.postings[self.term_offsets[first]:self.term_offsets[last]])
+            return np.sort(np.asarray(self.postings[self.term_offsets[first]:self.term_offsets[last]]))
+        i = np.searchsorted(self.terms, term)
+        if i == len(self.terms) or self.terms[i] != term:
+            return np.zeros(0, dtype = np.int64)
+        return np.asarray(self.postings[self.term_offsets[i]:self.term_offsets[i + 1]])
+
+    def doc(self, positions):
+        '''
+        Returns the speech (row of the speech table) of every position.
+        '''
+        return np.searchsorted(self.doc_starts, positions, side = 'right') - 1
+
+    def find(self, query):
+        '''
+        Returns the first positions of all matches of a word or phrase (words separated by spaces, "*" at the end
+        of a word: see positions) within one speech, and the number of words of the query.
+        '''
+        words = query.split()
+        if not words:
+            return np.zeros(0, dtype = np.int64), 0
+        matches = self.positions(words[0])
+        for k, word in enumerate(words[1:], start = 1):
+            matches = matches[np.isin(matches + k, self.positions(word), assume_unique = True)]
+        if len(words) > 1:
+            matches = matches[self.doc(matches) == self.doc(matches + len(words) - 1)]
+        return matches, len(words)
+
+    def near(self, matches, length, query, distance = 5):
+        '''
+        Returns the matches (first positions, see find), which have a match of query at most `distance` words
+        before or after them in the same speech.
+        '''
+        others, other_length = self.find(query)
+        if not len(others) or not len(matches):
+            return matches[:0]
+        # Nearest match of query before (ending before the match) and after (starting after the match)
+        i = np.searchsorted(others, matches, side = 'left')
+        before = others[np.maximum(i - 1, 0)]
+        after = others[np.minimum(i, len(others) - 1)]
+        ok_before = (i > 0) & (matches - (before + other_length - 1) <= distance) & (self.doc(before) == self.doc(matches))
+        ok_after = (i < len(others)) & (after - (matches + length - 1) <= distance) & (self.doc(after) == self.doc(matches))
+        return matches[ok_before | ok_after]
+
+    def _snippet(self, first, last):
+        start = self.token_start[first]
+        end = self.token_start[last] + self.token_length[last]
+        return bytes(self.text[start:end]).decode('utf-8', errors = 'replace').replace('\n', ' ')
+
+    def kwic(self, query, window = 10, near = None, distance = 5, limit = None, start = None, end = None, **filters):
+        '''
+        Returns keyword-in-context snippets of a word or phrase (see find) with speaker, party and date of the speech.
+
+        Params:
+         str: query (e.g. 'illegal', 'illegal*' or 'illegale migration')
+         int: window (number of words left and right of the match, within the speech)
+         str: near (optional, only matches with this word or phrase at most `distance` words away, see near)
+         int: distance
+         int: limit (optional, max. number of snippets, in order of the positions)
+         str: start, end (optional, dates of the speeches, inclusive)
+         filters: only speeches with these values, e.g. party = 'AfD', role = 'MdB' (see corpus_stats.filter_mask)
+
+        Returns:
+         pd.DataFrame: 1 row per match. Columns: id, speech, speaker, party, role, wahlperiode, datum, left, match, right
+        '''
+        matches, length = self.find(query)
+        if near is not None:
+            matches = self.near(matches, length, near, distance)
+
+        docs = self.doc(matches)
+        if start is not None or end is not None or filters:
+            allowed = filter_mask(self.speeches, start, end, **filters)
+            keep = allowed[docs]
+            matches, docs = matches[keep], docs[keep]
+        if limit is not None:
+            matches, docs = matches[:limit], docs[:limit]
+
+        rows = []
+        for p, d in zip(matches.tolist(), docs.tolist()):
+            first, last = self.doc_starts[d], self.doc_starts[d + 1] - 1
+            left = self._snippet(max(first, p - window), p - 1) if p > first and window else ''
+            right = self._snippet(p + length, min(last, p + length - 1 + window)) if p + length - 1 < last and window else ''
+            rows.append({'left': left, 'match': self._snippet(p, p + length - 1), 'right': right})
+
+        result = self.speeches.iloc[docs].reset_index(drop = True)
+        return pd.concat([result, pd.DataFrame(rows, columns = ['left', 'match', 'right'])], axis = 1)
@@ -1,54 +1,91 @@
 import pandas as pd
 import re
-import bundestag_api
-import ast
-import datetime
+from itertools import accumulate
+from functools import lru_cache
+from contextlib import nullcontext
 from src.people import *
-from src.load_data import get_metadata
+from src.load_data import get_metadata, get_metadata_table
+from src.parallel import map_protocols
+from src.registry import get_registry
+from src.instrumentation import stage, per_protocol
+from src.corpus_stats import add_counts
 
 
-def identify_interruptions(protocols):
+# Any text in parentheses. One level of nested parentheses belongs to it, e.g. the page markers "(A)" or a city and
+# party pair "(Zuruf Claudia Roth (Augsburg) (BÜNDNIS 90/DIE GRÜNEN))". If the nested parentheses are not balanced,
+# it ends at the first closing parenthesis. (The nested part is an unrolled loop, so the regex never backtracks.)
+INTERRUPTION_PATTERN = re.compile(r'(\((?:(?!\))[^()]*(?:\([^()]*\)[^()]*)*\)|[^)]+\)))')
+
+
+def tokenize_interruptions(text, parties):
     '''
-    For a given dataframe of protocols, returns a dataframe, where the main text is separated from the interruptions.
-    Final Columns: id, main_text, interruptions
+    Walks a protocol text once and splits it into main text and interruptions (text in parentheses, see INTERRUPTION_PATTERN).
+    A party in parentheses, e.g. "(SPD)", is listed as interruption as well, but stays in the main text
+    -> we need to keep that info to know, who is speaking.
+    Cities in parentheses, e.g. in Claudia Roth (Augsburg) (BÜNDNIS 90/DIE GRÜNEN), are removed from the main text.
 
-    Params: 
-     pd.DataFrame: data
+    Params:
+     str: text
+     set: parties
 
     Returns:
-     pd.DataFrame: data with column 'main_text' and 'interruptions'
+     str: main text
+     list: interruptions (with parentheses)
+     list: interruption spans (start, end) as offsets into text
     '''
-    new_protocols = protocols.copy()
-    new_protocols['main_text'], new_protocols['interruptions'] = '', ''
+    # One pass: [main, interruption, main, interruption, ..., main]
+    parts = INTERRUPTION_PATTERN.split(text)
+    interruptions = parts[1::2]
 
-    # Define the parties
-    parties = ['SPD', 'CDU/CSU', 'DIE LINKE', 'BÜNDNIS 90/DIE GRÜNEN', 'AfD', 'FDP', 'parteilos']
+    # Offsets of the interruptions in the original text
+    offsets = list(accumulate(map(len, parts), initial = 0))
+    spans = list(zip(offsets[1::2], offsets[2::2]))
+
+    # Remove the interruptions (but not the parties) from the main text
+    parts[1::2] = [i if i[1:-1] in parties else '' for i in interruptions]
+    main_text = ''.join(parts)
+
+    return main_text, interruptions, spans
 
-    # Loop over all texts:
-    for index, row in new_protocols.iterrows():
-        t = row['text']
 
-        # Regular expression to identify interruptions (but not when it's just one party in parentheses 
-        # -> we need to keep that info to know, who is speaking)
-        # This also tracks the cities in parentheses, e.g., in Claudia Roth (Augsburg) (BÜNDNIS 90/DIE GRÜNEN)
-        # -> so they are not included in main_text later
-        interruption_pattern_main = re.compile(r'\((?!(?:' + '|'.join(parties) + ')\\))[^)]+\\)')
+def identify_interruptions(protocols, inplace = False, keep_text = True):
+    '''
+    For a given dataframe of protocols, returns a dataframe, where the main text is separated from the interruptions.
+    Final Columns: id, main_text, interruptions, interruption_spans
 
-        # Separate main text and interruptions
-        main_text = re.sub(interruption_pattern_main, '', t)
+    Params: 
+     pd.DataFrame: data
+     bool: inplace (modify the given dataframe instead of a copy)
+     bool: keep_text (if False, the column 'text' is dropped and every text is released as soon as it is split,
+                      so together with inplace only one copy of the corpus is in memory)
 
-        # Find all matches of interruptions in the parliament session text
-        interruption_pattern_inter = re.compile(r'\([^)]+\)')
-        interruptions = interruption_pattern_inter.findall(t)
+    Returns:
+     pd.DataFrame: data with column 'main_text', 'interruptions' and 'interruption_spans' (offsets into 'text')
+    '''
+    new_protocols = protocols if inplace else protocols.copy()
 
-        # Write main text into new column
-        new_protocols.at[index, 'main_text'] = main_text
-        new_protocols.at[index, 'interruptions'] = interruptions
+    # Define the parties
+    parties = set(get_parties())
+
+    # Loop over all texts (one pass per text, see tokenize_interruptions):
+    if keep_text:
+        results = [tokenize_interruptions(t, parties) for t in new_protocols['text']]
+    else:
+        texts = new_protocols.pop('text').tolist()
+        results = []
+        for i in range(len(texts)):
+            results.append(tokenize_interruptions(texts[i], parties))
+            texts[i] = None
+
+    # Write results into new columns
+    new_protocols['main_text'] = [r[0] for r in results]
+    new_protocols['interruptions'] = [r[1] for r in results]
+    new_protocols['interruption_spans'] = [r[2] for r in results]
 
     return new_protocols
 
 
-def remove_president_text(protocols):
+def remove_president_text(protocols, cache = None, registry = None, inplace = False):
     '''
     For a given dataframe of protocols, returns a dataframe, where all utterances by presidents and other neutral or moderating people
     from the main text are removed. They are saved in a column "neutral_text"
@@ -56,19 +93,24 @@ def remove_president_text(protocols):
 
     Params: 
      pd.DataFrame: data
+     ResponseCache: cache (optional, used for the MdB list, see registry.get_registry)
+     PersonRegistry: registry (optional, see registry.get_registry; loaded if not given)
+     bool: inplace (modify the given dataframe instead of a copy)
 
     Returns:
      pd.DataFrame: data, with new column neutral_text
     '''
-    new_protocols = protocols.copy()
+    new_protocols = protocols if inplace else protocols.copy()
     new_protocols['neutral_text'] = ''
 
     # Define the parties and persons
-    parties = ['SPD', 'CDU/CSU', 'DIE LINKE', 'BÜNDNIS 90/DIE GRÜNEN', 'AfD', 'FDP', 'parteilos']
+    parties = get_parties()
 
-    mdb = get_mdb()
+    if registry is None:
+        registry = get_registry(cache = cache)
 
-    neutral_persons = get_neutral_persons()
+    # Matcher for neutral persons and MdB names (see people.get_speaker_matcher)
+    matcher = registry.matcher()
 
     # Loop over all texts:
     for index, row in new_protocols.iterrows():
@@ -85,7 +127,7 @@ def remove_president_text(protocols):
         # Iterate through each utterance
         for utterance in utterances:
             # Check if the utterance belongs to a neutral person
-            if any(neutral_person in utterance for neutral_person in neutral_persons):
+            if matcher.search(utterance, 'presiding'):
                 is_neutral_person = True
             elif utterance.endswith(":"):
                 is_neutral_person = False
@@ -100,7 +142,7 @@ def remove_president_text(protocols):
         # Remove neutral utterances from main text
         utterances_new = utterances.copy()
         for u in utterances:
-            if u in neutral_utterances and u not in mdb and u not in parties: # Make sure, important info doesn't get removed!
+            if u in neutral_utterances and not matcher.is_pattern(u, 'mdb') and u not in parties: # Make sure, important info doesn't get removed!
                 utterances_new.remove(u) 
         
         new_protocols.at[index, 'main_text'] = '\n'.join(utterances_new)
@@ -108,65 +150,211 @@ def remove_president_text(protocols):
     return new_protocols
 
 
-def clean_gov_persons(protocols):
+def clean_gov_persons(protocols, inplace = False):
     '''
     For a given dataframe of protocols, returns a dataframe, where all mentionings of government people now follow the same format
     as the other MdB: "<<full name>> (<<party name>>):"
-    Does this for main_text and interruptions
+    Does this for main_text (government persons in interruptions are recognized by interruption_records)
     Columns: id, text, main_text, interruptions, neutral_text
 
     Params: 
      pd.DataFrame: data
+     bool: inplace (modify the given dataframe instead of a copy)
 
     Returns:
      pd.DataFrame: data, with modified column main_text
     '''
-    new_protocols = protocols.copy()
+    new_protocols = protocols if inplace else protocols.copy()
 
-    # Get government persons
-    regierende_original = get_regierende(mdb_format=False, include_party=True)
-    regierende_correct = get_regierende(mdb_format=True, include_party=True)
+    # Get government persons (all of them are replaced in one pass, see people.get_speaker_matcher)
+    matcher = get_speaker_matcher()
 
     for index, row in new_protocols.iterrows():
         t_main = str(row['main_text'])
-        t_inter = str(row['interruptions'])
 
         # Split the data into utterances based on newlines
         utterances_main = [line.strip() for line in t_main.split('\n') if line.strip()]
-        utterances_inter = [line.strip() for line in t_inter.split('\n') if line.strip()]
 
         # Replace all occurrences of government persons with new format
-        for i in range(len(regierende_original)):
-            person_old = f'{regierende_original[i][0]}:'
-            person_new = regierende_correct[i]
-            utterances_main = [u.replace(person_old, person_new) for u in utterances_main]
-            utterances_inter = [u.replace(person_old, person_new) for u in utterances_inter]
+        new_protocols.at[index, 'main_text'] = matcher.replace('\n'.join(utterances_main), 'government')
+
+    return new_protocols
 
-        # Save new text in main_text column
-        new_protocols.at[index, 'main_text'] = '\n'.join(utterances_main)
-        new_protocols.at[index, 'interruptions'] = '\n'.join(utterances_inter)
 
+def run_stage(func, protocols, columns, new_columns, workers = None, chunksize = 10, inplace = False, **kwargs):
+    '''
+    Runs a cleaning stage. With workers = 1 it simply calls func on protocols.
+    Otherwise it runs in parallel (see parallel.map_protocols): only `columns` are sent to the processes
+    and only `new_columns` of the result are written back into protocols (or a copy of it).
+    If the times per protocol are recorded (see instrumentation.Metrics), workers = 1 runs one protocol after the other.
+
+    Returns:
+     pd.DataFrame: data, with new or modified new_columns
+    '''
+    if workers == 1 and not per_protocol():
+        return func(protocols, inplace = inplace, **kwargs)
+
+    chunksize = 1 if workers == 1 else chunksize
+    result = map_protocols(func, protocols, columns, workers = workers, chunksize = chunksize, **kwargs)
+    new_protocols = protocols if inplace else protocols.copy()
+    for column in new_columns:
+        new_protocols[column] = result[column]
     return new_protocols
 
 
-def clean_and_split_text(protocols):
+def clean_and_split_text(protocols, cache = None, workers = 1, chunksize = 10, low_memory = False, report = None,
+                         registry = None):
     '''
     For a given dataframe of protocols, returns a "clean" version of that dataframe. Uses the cleaning functions defined above.
+    With workers other than 1, every stage runs on chunks of `chunksize` protocols in parallel processes
+    (None = number of CPUs); the result is the same as with workers = 1.
+    With low_memory, the stages work in place (the given dataframe is modified) and the column 'text' is dropped
+    once it is split, so only one copy of the corpus is kept in memory.
     Columns: id, text, main_text, interruptions, neutral_text
 
     Params: 
      pd.DataFrame: data
+     ResponseCache: cache (optional, used for the MdB list, see registry.get_registry)
+     int: workers (number of processes)
+     int: chunksize (number of protocols per task of a worker)
+     bool: low_memory
+     MemoryReport: report (optional, collects the peak memory per stage, see memory.py)
+     PersonRegistry: registry (optional, see registry.get_registry; loaded if not given)
 
     Returns:
      pd.DataFrame: data split into party contributions. Columns: protocol_id, party, text
     '''
-    clean = identify_interruptions(protocols)
-    clean = remove_president_text(clean)
-    clean = clean_gov_persons(clean)
+    measure = report.stage if report is not None else nullcontext
+
+    # Load the persons and build the matcher only once (the processes get a copy of it, where possible)
+    if registry is None:
+        registry = get_registry(cache = cache)
+    registry.matcher()
+
+    with measure('identify_interruptions'), stage('identify_interruptions', protocols, 'text'):
+        clean = run_stage(identify_interruptions, protocols, ['text'], ['main_text', 'interruptions', 'interruption_spans'],
+                          workers, chunksize, inplace = low_memory, keep_text = not low_memory)
+        if low_memory and 'text' in clean:
+            del clean['text']
+    with measure('remove_president_text'), stage('remove_president_text', clean, 'main_text'):
+        clean = run_stage(remove_president_text, clean, ['main_text'], ['main_text', 'neutral_text'],
+                          workers, chunksize, inplace = low_memory, registry = registry)
+    with measure('clean_gov_persons'), stage('clean_gov_persons', clean, 'main_text'):
+        clean = run_stage(clean_gov_persons, clean, ['main_text'], ['main_text'], workers, chunksize, inplace = low_memory)
 
     return clean
 
 
+def get_header_pattern():
+    '''
+    Returns the regular expression for speaker headers (a line of its own), compiled only once. Named groups:
+    - presiding: neutral person, e.g. "Präsident Dr. Norbert Lammert:" (see people.get_neutral_persons)
+    - government: government person, e.g. "Dr. Angela Merkel, Bundeskanzlerin:" (see people.get_regierende)
+    - mdb + party: MdB, e.g. "Volker Kauder (CDU/CSU):" or "Claudia Roth (Augsburg) (BÜNDNIS 90/DIE GRÜNEN):"
+    '''
+    return _header_pattern()
+
+
+@lru_cache(maxsize = 1)
+def _header_pattern():
+    matcher = get_speaker_matcher()
+    presiding = matcher.regex('presiding').pattern
+    government = matcher.regex('government').pattern
+    parties = '|'.join(re.escape(p) for p in get_parties())
+    mdb = f'(?P<mdb>[^\\n():]+?)(?: \\([^()\\n]+\\))? \\((?P<party>{parties})\\):'
+    header = f'(?:(?P<presiding>{presiding})|(?P<government>{government})|{mdb})'
+    # The line has to end with ":" (some neutral persons are listed without it)
+    return re.compile(f'^[ \\t]*{header}(?:(?<=:)|[ \\t]*:)[ \\t]*$\\n?', re.MULTILINE)
+
+
+def segment_speeches(protocols):
+    '''
+    For a given dataframe of protocols, returns a table with 1 row per speech, found in a single pass over each text.
+    A speech starts after a speaker header (see get_header_pattern) and ends at the next header.
+    Text before the first header (title, contents) belongs to no speech.
+    Columns: id, speech, speaker, party, role, start, end
+    -> role: 'MdB', 'government' or 'presiding' (party is None for presiding persons)
+    -> start, end: offsets of the speech (without header) in the column 'text', i.e. text[start:end]
+
+    Params: 
+     pd.DataFrame: data (columns id, text)
+
+    Returns:
+     pd.DataFrame: speech table
+    '''
+    pattern = get_header_pattern()
+    matcher = get_speaker_matcher()
+    speeches = []
+
+    for protocol_id, t in zip(protocols['id'], protocols['text']):
+        headers = list(pattern.finditer(t))
+
+        for i, m in enumerate(headers):
+            if m.group('presiding'):
+                speaker, party, role = m.group('presiding').rstrip(': '), None, 'presiding'
+            elif m.group('government'):
+                person_new = matcher.patterns[m.group('government')]['government'] # "<<name>> (<<party>>):"
+                party_start = person_new.rindex(' (')
+                speaker, party, role = person_new[:party_start], person_new[party_start + 2:-2], 'government'
+            else:
+                speaker, party, role = m.group('mdb').strip(), m.group('party'), 'MdB'
+
+            end = headers[i + 1].start() if i + 1 < len(headers) else len(t)
+            speeches.append({'id': protocol_id, 'speech': i, 'speaker': speaker, 'party': party, 'role': role,
+                             'start': m.end(), 'end': end})
+
+    return pd.DataFrame(speeches, columns = ['id', 'speech', 'speaker', 'party', 'role', 'start', 'end'])
+
+
+def speech_texts(protocols, speeches):
+    '''
+    For a given speech table (see segment_speeches), returns the main text of every speech: interruptions are removed
+    (see tokenize_interruptions), lines are stripped and empty lines dropped.
+
+    Params: 
+     pd.DataFrame: data (columns id, text)
+     pd.DataFrame: speech table
+
+    Returns:
+     list: main text per row of the speech table
+    '''
+    parties = set(get_parties())
+    texts = dict(zip(protocols['id'], protocols['text']))
+    result = []
+
+    for protocol_id, start, end in zip(speeches['id'], speeches['start'], speeches['end']):
+        main_text = tokenize_interruptions(texts[protocol_id][start:end], parties)[0]
+        result.append('\n'.join(line.strip() for line in main_text.split('\n') if line.strip()))
+
+    return result
+
+
+def party_shares_speeches(protocols, speeches):
+    '''
+    Like party_shares_main, but reads from the speech table (see segment_speeches) instead of the cleaned main text:
+    1 row per protocol and party (for the main text!). Speeches of presiding persons are neutral and left out.
+    Columns: id, party, text, text_type (here: main_text)
+    Note: the result differs from party_shares_main, which adds speeches of the president, that remove_president_text
+    does not catch, to the party of the previous speaker (e.g. Lammert's speech after his election, see party_shares).
+
+    Params: 
+     pd.DataFrame: data (columns id, text)
+     pd.DataFrame: speech table
+
+    Returns:
+     pd.DataFrame: data split into party contributions. Columns: id, party, text, text_type
+    '''
+    speeches = speeches[speeches['role'] != 'presiding'].copy()
+    speeches['text'] = speech_texts(protocols, speeches)
+    speeches = speeches[speeches['text'] != '']
+
+    # Join the speeches per protocol and party (in order of the first speech of the party, like party_shares_main)
+    new_protocols = speeches.groupby(['id', 'party'], sort = False)['text'].agg('\n'.join).reset_index()
+    new_protocols['text_type'] = 'main_text'
+
+    return new_protocols
+
+
 def party_shares_main(protocols):
     '''
     For a given dataframe of protocols, returns a dataframe with 1 row per protocol and party (for the main text!)
@@ -224,135 +412,276 @@ def party_shares_main(protocols):
     return new_protocols
 
 
-def party_shares_inter(protocols):
+# Parties as they are mentioned in interruptions (e.g. "Beifall bei der LINKEN") -> name in get_parties()
+PARTY_MENTIONS = {'SPD': 'SPD', 'CDU/CSU': 'CDU/CSU', 'AfD': 'AfD', 'FDP': 'FDP',
+                  'DIE LINKE': 'DIE LINKE', 'LINKEN': 'DIE LINKE',
+                  'BÜNDNIS 90/DIE GRÜNEN': 'BÜNDNIS 90/DIE GRÜNEN', 'BÜNDNISSES 90/DIE GRÜNEN': 'BÜNDNIS 90/DIE GRÜNEN'}
+
+
+# Kinds of interruptions (regex -> kind), e.g. "Anhaltender Beifall" -> Beifall, "Zurufe" -> Zuruf.
+# Parts without one of them (and without a speaker) are no interruptions, e.g. constituencies like "(Aachen)" in the name lists.
+INTERRUPTION_KINDS = {r'Beifall': 'Beifall', r'Heiterkeit': 'Heiterkeit', r'Lachen': 'Lachen', r'Zurufe?': 'Zuruf',
+                      r'Gegenrufe?': 'Gegenruf', r'Widerspruch': 'Widerspruch', r'Unruhe': 'Unruhe', r'Zustimmung': 'Zustimmung'}
+
+
+def interruption_records(protocols):
+    '''
+    For a given dataframe of protocols (result of identify_interruptions), returns 1 typed record per part of an interruption.
+    An interruption like "(Beifall bei der SPD – Volker Kauder [CDU/CSU]: Stimmt! – Heiterkeit)" has 3 parts, separated by " – ".
+    Page markers like "(A)" and parties in parentheses (speaker info of the main text) are no interruptions.
+    Columns:
+    - id, interruption (number of the interruption in the protocol), part (number of the part in the interruption)
+    - start: offset of the interruption in the column 'text'
+    - kind: Zuruf or Gegenruf for parts with a speaker, otherwise the first kind in the part (see INTERRUPTION_KINDS:
+      Beifall, Heiterkeit, Zuruf, Widerspruch, ...). Parts without speaker and kind are follow-up remarks of the speaker
+      of the part before (kind Zuruf); without a speaker before (e.g. constituencies), they are dropped.
+    - speaker, party: only for parts with a speaker, e.g. "Volker Kauder [CDU/CSU]: ..." or government persons
+    - parties: list of all parties in the part (e.g. all parties that applaud)
+    - text: what was said (for parts with a speaker) or the whole part
+
+    Params: 
+     pd.DataFrame: data (columns id, interruptions, interruption_spans)
+
+    Returns:
+     pd.DataFrame: interruption records
+    '''
+    columns = ['id', 'interruption', 'part', 'start', 'kind', 'speaker', 'party', 'parties', 'text']
+    records = protocols[['id', 'interruptions', 'interruption_spans']].explode(['interruptions', 'interruption_spans'])
+    records = records.dropna(subset = ['interruptions'])
+    if records.empty:
+        return pd.DataFrame(columns = columns)
+
+    records['interruption'] = records.groupby('id', sort = False).cumcount()
+    records['start'] = records['interruption_spans'].str[0]
+
+    # Without parentheses, page markers and parties
+    records['text'] = records['interruptions'].str[1:-1]
+    records = records[~records['text'].str.fullmatch(r'[A-D]') & ~records['text'].isin(get_parties())]
+
+    # Split into parts
+    records['text'] = records['text'].str.split(' – ')
+    records = records.explode('text')
+    records['text'] = records['text'].str.strip()
+    records = records[records['text'] != ''].reset_index(drop = True)
+    records['part'] = records.groupby(['id', 'interruption'], sort = False).cumcount()
+
+    # Parts with a speaker: "[Zuruf des Abg.] <<name>> [<<city>>] [<<party>>]: <<text>>"
+    parties = '|'.join(re.escape(p) for p in get_parties())
+    said = records['text'].str.extract(r'^(?:(?P<kind>Zuruf|Gegenruf)\w* (?:des|der) Abg\. )?(?P<speaker>[^\[\]:]+?)'
+                                       rf'(?:\s*\[[^\[\]]*\])*?\s*\[(?P<party>{parties})\]\s*:\s*(?P<text>.*)$', flags = re.S)
+
+    # Government persons: "<<name>>, <<office>>: <<text>>" (see people.get_speaker_matcher)
+    matcher = get_speaker_matcher()
+    government = records['text'].str.extract(f'^(?P<person>{matcher.regex("government").pattern})\\s*(?P<text>.*)$', flags = re.S)
+    person_new = government['person'].map(lambda p: matcher.patterns[p]['government'], na_action = 'ignore')
+    is_government = person_new.notna() & said['speaker'].isna()
+    if is_government.any():
+        name_party = person_new[is_government].str.rsplit(' (', n = 1)
+        said.loc[is_government, 'speaker'] = name_party.str[0]
+        said.loc[is_government, 'party'] = name_party.str[1].str[:-2]
+        said.loc[is_government, 'text'] = government['text']
+
+    has_speaker = said['speaker'].notna()
+    kinds = '|'.join(f'(?P<kind{i}>{pattern})' for i, pattern in enumerate(INTERRUPTION_KINDS))
+    found = records['text'].str.extract(rf'\b(?:{kinds})\b')
+    kind = pd.Series(None, index = records.index, dtype = object)
+    for i, name in enumerate(INTERRUPTION_KINDS.values()):
+        kind = kind.where(found[f'kind{i}'].isna(), name)
+
+    # Follow-up remarks (no speaker, no kind) belong to the speaker of the part before within the same interruption,
+    # e.g. "Claudia Roth [Augsburg] [BÜNDNIS 90/DIE GRÜNEN]: Ja, Herr Präsident! – Sie müssen mich erst fragen!"
+    follow_up = ~has_speaker & kind.isna()
+    previous = said[['speaker', 'party']].where(has_speaker, '').mask(follow_up)
+    previous = previous.groupby([records['id'], records['interruption']], sort = False).ffill()
+    inherited = follow_up & previous['speaker'].fillna('').ne('')
+    said.loc[inherited, ['speaker', 'party']] = previous.loc[inherited]
+    said.loc[inherited, 'text'] = records.loc[inherited, 'text']
+    has_speaker = said['speaker'].notna()
+    records['speaker'] = said['speaker'].str.strip()
+    records['party'] = said['party']
+    records['kind'] = said['kind'].where(said['kind'].notna(), 'Zuruf').where(has_speaker, kind)
+    records['text'] = said['text'].where(has_speaker, records['text'])
+    keep = has_speaker | kind.notna()
+    records, has_speaker = records[keep], has_speaker[keep]
+
+    # All mentioned parties (for parts with a speaker: his/her party)
+    mentions = '|'.join(re.escape(p) for p in sorted(PARTY_MENTIONS, key = len, reverse = True))
+    mentioned = records['text'].str.findall(mentions).map(lambda found: list(dict.fromkeys(PARTY_MENTIONS[f] for f in found)))
+    records['parties'] = mentioned.where(~has_speaker, records['party'].map(lambda p: [p], na_action = 'ignore'))
+
+    return records[columns].reset_index(drop = True)
+
+
+def save_interruptions(records, path):
+    '''
+    Saves interruption records (see interruption_records) as Parquet file, the list column 'parties' is kept as list.
+    # you might need to install pyarrow
+    '''
+    records.to_parquet(path, index = False)
+
+
+def load_interruptions(path):
+    '''
+    Loads interruption records saved with save_interruptions.
+    '''
+    records = pd.read_parquet(path)
+    records['parties'] = records['parties'].map(list)
+    return records
+
+
+def party_shares_inter(protocols, records = None):
     '''
     For a given dataframe of protocols, returns a dataframe with 1 row per protocol and party (for the interruptions!)
     -> rows: row_num*5 for 18th period and row_num*6 for 19th period (+ "parteilos")
+    Only what was said by a speaker of the party counts (not e.g. applause).
     Columns: protocol_id, party, text, 
 
     Params: 
      pd.DataFrame: data
+     pd.DataFrame: interruption records (optional, see interruption_records; computed from data if not given)
 
     Returns:
      pd.DataFrame: data split into party contributions. Columns: protocol_id, party, text
     '''
-    # Initialise result list
-    party_data = []
+    if records is None:
+        records = interruption_records(protocols)
 
-    # Define the parties
-    parties = ['SPD', 'CDU/CSU', 'DIE LINKE', 'BÜNDNIS 90/DIE GRÜNEN', 'AfD', 'FDP', 'parteilos']
+    said = records[records['party'].notna() & (records['text'] != '')]
 
-    # Define pattern for detecting text in brackets [ ]
-    pattern = re.compile(r'\[[^\[\]]*\]')
+    # Join what was said per protocol and party (in order of the first interruption of the party)
+    new_protocols = said.groupby(['id', 'party'], sort = False)['text'].agg('\n'.join).reset_index()
+    new_protocols['text_type'] = 'interruption'
 
-    # Loop over all texts:
-    for index, row in protocols.iterrows():
-        # Initialise result dictionary
-        party_dict = {}
+    return new_protocols
+    
 
-        # Make sure interruptions is not empty
-        if row['interruptions'] != '[]':
-
-            # Turn interruptions list into list data type (is string before)
-            interruptions_list = ast.literal_eval(row['interruptions'])
-            # Turn the interruptions list into the correct string format with new lines, when new speaker or new utterance
-            result_list = []
-            
-            for item in interruptions_list:
-
-                # Remove parentheses around text
-                item = item.replace('(', '')
-                item = item.replace(')', '')
-
-                # Remove city information in parentheses after name (so it isn't read as party name later on)
-                item = pattern.sub(lambda x: x.group(0) if any(word in x.group(0) for word in parties) else '', item)
-
-                # Turn the interruptions list into the correct string format with new lines, when new speaker or new utterance
-                if ':' in item: # filter actual speech (not just applause)
-                    # append new lines, so the format is the same as in the main text
-                    item_list = item.split(': ')
-                    item_string = ':\n'.join(item_list)
-                    item_list = item_string.split(' – ')
-                    item_string = '\n'.join(item_list)
-                    result_list.append(item_string)
-            
-            # Turn list into text
-            interruptions_text = '\n'.join(result_list)
-
-            # Split the data into lines
-            lines = interruptions_text.split('\n')
-
-            # Iterate through the lines to identify speakers and assign utterances to parties
-            current_party = None
-            current_speaker = None
-            
-            for line in lines:
-                if line.strip():  # Skip empty lines
-                    if '[' in line and ']' in line and ':' in line:
-                        
-                        # Extract party information
-                        party_start = line.index('[') + 1
-                        party_end = line.index(']')
-                        current_party = line[party_start:party_end]
-                        party_dict.setdefault(current_party, [])
-                        
-                        # Extract speaker information
-                        speaker_end = line.index(':')
-                        current_speaker = line[:speaker_end].strip()
-                        
-                    elif current_party and current_speaker:
-                        # Assign utterances to the current speaker within the party
-                        party_dict[current_party].append({current_speaker: line.strip()})
-
-                
-            # Write in result df
-            this_id = row['id']
-
-            for party, utterances in party_dict.items():
-                utterances_str = '\n'.join([string for u in utterances for string in u.values()])
-                party_data.append({'id': this_id, 'party': party, 'text': utterances_str, 'text_type': 'interruption'})
+def party_shares_structured(protocols, low_memory = False):
+    '''
+    Like party_shares, but for protocols, whose speeches and interruptions are already marked up in the XML
+    (see load_data_website.parse_structured_file): no cleaning stages and no speaker heuristics are needed.
+    Main text: the speeches per protocol and party (without presiding persons), like party_shares_speeches.
+    Interruptions: the comments, split into parts by interruption_records, like party_shares_inter.
 
-    new_protocols = pd.DataFrame(party_data)
+    Params:
+     pd.DataFrame: data (columns id, speeches, interruptions)
+     bool: low_memory (return party and text_type as categorical)
 
+    Returns:
+     pd.DataFrame: data split into party contributions. Columns: id, party, text, text_type, text_length, num_words
+    '''
+    with stage('party_shares_main', protocols):
+        speeches = pd.DataFrame([dict(speech, id = protocol_id) for protocol_id, protocol_speeches in
+                                 zip(protocols['id'], protocols['speeches']) for speech in protocol_speeches],
+                                columns = ['id', 'speech', 'speaker', 'party', 'role', 'text'])
+        speeches = speeches[(speeches['role'] != 'presiding') & speeches['party'].notna() & (speeches['text'] != '')]
+        party_shares_main_df = speeches.groupby(['id', 'party'], sort = False)['text'].agg('\n'.join).reset_index()
+        party_shares_main_df['text_type'] = 'main_text'
+
+    with stage('party_shares_inter', protocols):
+        # Every comment is its own interruption (the spans are only used for the order)
+        comments = protocols[['id', 'interruptions']].copy()
+        comments['interruption_spans'] = comments['interruptions'].map(lambda found: [(i, i) for i in range(len(found))])
+        party_shares_inter_df = party_shares_inter(comments)
+
+    new_protocols = pd.concat([party_shares_main_df, party_shares_inter_df], ignore_index = True)
+    add_counts(new_protocols)
+    if low_memory:
+        to_categories(new_protocols)
     return new_protocols
-    
 
-def party_shares(protocols):
+
+def to_categories(df, columns = ('party', 'text_type', 'wahlperiode')):
+    '''
+    Converts the given columns (if present) to categorical dtype, so each of the few distinct values is stored only once.
+    Modifies df and returns it.
+    '''
+    for column in columns:
+        if column in df:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def party_shares(protocols, speeches = None, workers = 1, chunksize = 10, low_memory = False):
     '''
     For a given dataframe of protocols, returns a dataframe with 1 row per protocol and party and text_type (interruptions vs main text) 
     -> rows: row_num*5 for 18th period and row_num*6 for 19th period (+ "parteilos")
     Columns: protocol_id, party, text_type, text
+    The number of characters and words of every text is counted here once (text_length, num_words, see corpus_stats.py).
 
     Params: 
      pd.DataFrame: data
+     pd.DataFrame: speech table (optional, see segment_speeches). If given, the main text is read from the speeches
+                   (party_shares_speeches) instead of the cleaned main text (party_shares_main).
+                   This is opt-in: the default keeps the results of df_party_shares.csv, on which the R models are
+                   based, and works without the column 'text' (dropped with low_memory; the party_shares stage of
+                   checkpoint.run_incremental only hashes main_text and interruptions).
+                   The main texts differ: e.g. in the example protocol, CDU/CSU has 14865 characters by default
+                   and 3902 from the speeches, because by default Lammert's speeches as president (after his
+                   election) are counted as CDU/CSU text.
+     int: workers (number of processes, see clean_and_split_text)
+     int: chunksize (number of protocols per task of a worker)
+     bool: low_memory (drop the columns main_text, interruptions and interruption_spans of the given dataframe
+                       once they are used, and return party and text_type as categorical)
 
     Returns:
-     pd.DataFrame: data split into party contributions. Columns: protocol_id, party, text, text_type
+     pd.DataFrame: data split into party contributions. Columns: protocol_id, party, text, text_type, text_length, num_words
     '''
-    party_shares_main_df = party_shares_main(protocols)
-    party_shares_inter_df = party_shares_inter(protocols)
+    serial = workers == 1 and not per_protocol()
+    chunksize = 1 if workers == 1 else chunksize
+
+    with stage('party_shares_main', protocols, 'main_text'):
+        if speeches is not None:
+            party_shares_main_df = party_shares_speeches(protocols, speeches)
+        elif serial:
+            party_shares_main_df = party_shares_main(protocols)
+        else:
+            party_shares_main_df = map_protocols(party_shares_main, protocols, ['id', 'main_text'],
+                                                 workers, chunksize, ignore_index = True)
+    if low_memory:
+        protocols.drop(columns = ['main_text'], inplace = True, errors = 'ignore')
+
+    with stage('party_shares_inter', protocols):
+        if serial:
+            party_shares_inter_df = party_shares_inter(protocols)
+        else:
+            party_shares_inter_df = map_protocols(party_shares_inter, protocols, ['id', 'interruptions', 'interruption_spans'],
+                                                  workers, chunksize, ignore_index = True)
+    if low_memory:
+        protocols.drop(columns = ['interruptions', 'interruption_spans'], inplace = True, errors = 'ignore')
+
     new_protocols = pd.concat([party_shares_main_df, party_shares_inter_df], ignore_index=True)
+    add_counts(new_protocols)
+    if low_memory:
+        to_categories(new_protocols)
     return new_protocols
 
 
-def add_metadata(df_text_of_parties):
+def add_metadata(df_text_of_parties, metadata = None, cache = None, low_memory = False):
     '''
     For a given dataframe with 1 row per protocol and party and text_type (interruptions vs main text) 
-    adds metadata date and wahlperiode
+    adds metadata date and wahlperiode (with one join on the protocol id)
     Columns: protocol_id, party, text_type, text, date, wahlperiode
 
     Params: 
      pd.DataFrame: data
+     pd.DataFrame: metadata (optional, see load_data.get_metadata_table; the result of get_metadata works as well,
+                   loaded again if not given)
+     ResponseCache: cache (optional, used when the metadata are loaded, see load_data.get_metadata)
+     bool: low_memory (party, text_type and wahlperiode as categorical, see to_categories)
 
     Returns:
      pd.DataFrame: data split into party contributions. Columns: protocol_id, party, text, text_type, date, wahlperiode
     '''
-    metadata = get_metadata()
-    
-    for md in metadata:
-        for index, row in df_text_of_parties.iterrows():
-            if int(md['id']) == row['id']:
-                df_text_of_parties.at[index, 'wahlperiode'] = int(md['wahlperiode'])
-                df_text_of_parties.at[index, 'datum'] = datetime.datetime.strptime(md['datum'],'%Y-%m-%d')
+    metadata = get_metadata_table(metadata, cache = cache)
+
+    with stage('add_metadata', df_text_of_parties, 'text'):
+        # Look up all rows at once in the metadata (indexed by id), the ids may be str or int
+        dimensions = metadata.set_index('id')[['wahlperiode', 'datum']]
+        joined = dimensions.reindex(df_text_of_parties['id'].astype('int64'))
+
+        df_text_of_parties['wahlperiode'] = joined['wahlperiode'].to_numpy()
+        df_text_of_parties['datum'] = joined['datum'].to_numpy()
 
-    return df_text_of_parties
\ No newline at end of file
+    if low_memory:
+        to_categories(df_text_of_parties)
+    return df_text_of_parties
@@ -0,0 +1,175 @@
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta
+from src.people import get_parties, get_neutral_persons, get_government_table, get_persons, get_speaker_matcher
+
+
+def normalize_name(name):
+    '''
+    Returns a name with single spaces only (also instead of '\\xa0') and without spaces at the start and end.
+    '''
+    return ' '.join(str(name).replace('\xa0', ' ').split())
+
+
+def get_person_rules_version():
+    '''
+    Returns a hash over the hard-coded person lists in people.py. If one of them is changed, the registry is built again.
+    '''
+    rules = [get_parties(), get_neutral_persons(), get_government_table()]
+    return hashlib.sha1(json.dumps(rules, ensure_ascii = False).encode('utf-8')).hexdigest()
+
+
+class PersonRegistry:
+    '''
+    All persons, who are relevant for the cleaning stages, with 1 entry per person and role:
+    - name: normalized full name (see normalize_name)
+    - party: Fraktion (None for presiding persons)
+    - role: 'MdB', 'government' or 'presiding'
+    - wahlperioden: Wahlperioden, in which the role is valid
+    - start, end: dates of the first and last document of the person (only MdB, from the DIP API)
+    - header: speaker header in the protocols (government: "<<name>>, <<office>>:", presiding: e.g. "Präsident Dr. Norbert Lammert:")
+
+    All lookups are dict or set lookups. Use get_registry() to get the registry,
+    which is stored on disk and shared by all preprocessing stages.
+    '''
+    def __init__(self, persons, built = None, rules = None):
+        self.persons = persons
+        self.built = built or datetime.now().isoformat(timespec = 'seconds')
+        self.rules = rules or get_person_rules_version()
+
+        self.by_name = {}
+        self.by_header = {}
+        for person in persons:
+            self.by_name.setdefault(person['name'], []).append(person)
+            if person['header'] is not None:
+                self.by_header.setdefault(person['header'], person)
+        self.mdb_names = frozenset(p['name'] for p in persons if p['role'] == 'MdB')
+        self.mdb = sorted(self.mdb_names)
+
+    @classmethod
+    def build(cls, persons, wahlperioden = (18, 19)):
+        '''
+        Builds the registry from the persons of the DIP API (see people.get_persons)
+        and the lists of government and presiding persons in people.py.
+        '''
+        wahlperioden = set(wahlperioden)
+        entries = []
+
+        def add(name, party, role, periods, start = None, end = None, header = None):
+            entries.append({'name': normalize_name(name), 'party': party, 'role': role, 'wahlperioden': sorted(periods),
+                            'start': start, 'end': end, 'header': header})
+
+        for p in persons:
+            mdb_roles = [r for r in p.get('person_roles') or [] if r.get('funktion') == 'MdB']
+            periods = {wp for r in mdb_roles for wp in r.get('wahlperiode_nummer') or []}
+            if p.get('wahlperiode') is not None:
+                periods.add(p['wahlperiode'])
+            if not periods & wahlperioden:
+                continue
+
+            party = next((r['fraktion'] for r in mdb_roles if r.get('fraktion')), None)
+            add(f"{p['vorname']} {p['nachname']}", party, 'MdB', periods, p.get('basisdatum'), p.get('datum'))
+
+            # Other names (e.g. after a marriage) and parties of the same person
+            for r in mdb_roles:
+                role_periods = set(r.get('wahlperiode_nummer') or [])
+                if role_periods & wahlperioden:
+                    add(f"{r['vorname']} {r['nachname']}", r.get('fraktion'), 'MdB', role_periods, p.get('basisdatum'), p.get('datum'))
+
+        for header, party, periods in get_government_table():
+            add(header[:header.index(',')], party, 'government', periods, header = f'{header}:')
+
+        for header in get_neutral_persons():
+            name = header.rstrip(': ').split(' ', 1)[1] # without "Präsident", "Vizepräsidentin", ...
+            add(name, None, 'presiding', wahlperioden, header = header)
+
+        # Every entry only once
+        unique = {json.dumps(e, sort_keys = True, ensure_ascii = False): e for e in entries}
+        return cls(list(unique.values()))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding = 'utf-8') as f:
+            data = json.load(f)
+        return cls(data['persons'], data['built'], data['rules'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        with open(path + '.tmp', 'w', encoding = 'utf-8') as f:
+            json.dump({'built': self.built, 'rules': self.rules, 'persons': self.persons}, f, ensure_ascii = False)
+        os.replace(path + '.tmp', path)
+
+    def lookup(self, name, wahlperiode = None):
+        '''
+        Returns all entries of a person (optional: only the roles valid in the given Wahlperiode).
+        '''
+        entries = self.by_name.get(normalize_name(name), [])
+        if wahlperiode is None:
+            return entries
+        return [e for e in entries if wahlperiode in e['wahlperioden']]
+
+    def is_mdb(self, name):
+        return normalize_name(name) in self.mdb_names
+
+    def party(self, name, wahlperiode = None):
+        '''
+        Returns the party of a person (in the given Wahlperiode) or None.
+        '''
+        return next((e['party'] for e in self.lookup(name, wahlperiode) if e['party']), None)
+
+    def header(self, header):
+        '''
+        Returns the entry of a speaker header of a government or presiding person (see people.get_speaker_matcher) or None.
+        '''
+        return self.by_header.get(header)
+
+    def version(self):
+        '''
+        Returns a hash over the entries used by the cleaning stages (name, party, role, Wahlperioden and header
+        of every person). It changes, when the registry is built again with other persons, e.g. after max_age days.
+        '''
+        entries = sorted(json.dumps([p['name'], p['party'], p['role'], p['wahlperioden'], p['header']], ensure_ascii = False)
+                         for p in self.persons)
+        return hashlib.sha1('\n'.join(entries).encode('utf-8')).hexdigest()
+
+    def matcher(self):
+        '''
+        Returns the SpeakerMatcher with all MdB names (see people.get_speaker_matcher).
+        '''
+        return get_speaker_matcher(self.mdb)
+
+
+_registries = {}
+
+
+def get_registry(path = os.path.join('cache', 'persons.json'), key = 'rgsaY4U.oZRQKUHdJhF9qguHMkwCGIoLaqEcaHjYLF',
+                 cache = None, max_age = 30, refresh = False):
+    '''
+    Returns the person registry (see PersonRegistry). It is built only once and stored in `path`.
+    It is built again, if it is older than max_age days (then the persons are loaded from the API again)
+    or if the person lists in people.py were changed (then the persons come from the cache, if given).
+    Within one process, all calls with the same path share one registry.
+
+    Params:
+     str: path (JSON file)
+     str: current api key
+     ResponseCache: cache (optional, see people.get_persons)
+     float: max_age (in days)
+     bool: refresh (build again and load the persons from the API)
+
+    Returns:
+     PersonRegistry: registry
+    '''
+    registry = _registries.get(path)
+    if registry is None and not refresh and os.path.exists(path):
+        registry = PersonRegistry.load(path)
+
+    outdated = refresh or registry is None or datetime.now() - datetime.fromisoformat(registry.built) > timedelta(days = max_age)
+    if outdated or registry.rules != get_person_rules_version():
+        persons = get_persons(key = key, cache = cache, refresh = refresh or (registry is not None and outdated))
+        registry = PersonRegistry.build(persons)
+        registry.save(path)
+
+    _registries[path] = registry
+    return registry
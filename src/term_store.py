@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src.dtm import POS, DOC_COLUMNS, DocumentTermMatrix, compound_table, count_terms
+from src.parallel import map_protocols
+from src.corpus_stats import filter_mask
+from src.instrumentation import stage
+
+
+class TermStore:
+    '''
+    Append-only store of the term counts of every document (row of party_shares), keyed by protocol id and datum,
+    for (dynamic) topic models over time windows: new sessions are tokenized once and appended (see append),
+    vocabulary and document frequencies are updated with them, and matrix() returns the pruned document-term matrix
+    of any time window or with time buckets (month, quarter, year, Wahlperiode) without tokenizing again, e.g.
+
+    store = TermStore.create('out/term_store', stopwords = get_stopwords(), compounds = collocations['collocation'])
+    store.append(df_party_shares)                                # later: store.append(shares of the new sessions)
+    dtm = store.matrix(freq = 'YS', min_docfreq = 0.1, max_docfreq = 0.9, party = 'AfD', text_type = 'main_text')
+    dtm.save('out/dtm_dynamic', format = 'mtx')                  # docs.csv has time_index for keyATM (model = "dynamic")
+
+    Files in the folder (the segments are only written once, see compact):
+    - store.json: tokenizer options, segments, number of terms and version of docs and stats (written last by every
+      append, so the store is always the state of the last complete append)
+    - vocabulary.txt: 1 term per line (new terms are appended, so the column of a term never changes)
+    - segments/<n>.npz: counts of the documents of one append (sparse CSR, columns = vocabulary)
+    - docs-<version>.pkl: document variables (DOC_COLUMNS) with segment, row and active (False: replaced by a later append)
+    - stats-<version>.npz: document frequency and count of every term over all active documents
+
+    Params:
+     str: path (folder of the store, see create)
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'store.json'), encoding = 'utf-8') as f:
+            self.manifest = json.load(f)
+        self.options = self.manifest['options']
+        with open(os.path.join(path, 'vocabulary.txt'), encoding = 'utf-8') as f:
+            vocabulary = f.read().splitlines()
+        self.vocabulary = vocabulary[:self.manifest['terms']]
+        if len(vocabulary) > len(self.vocabulary):
+            # terms of an interrupted append (after the last store.json) are removed, so the next append continues after
+            # the last complete one
+            with open(os.path.join(path, 'vocabulary.txt.tmp'), 'w', encoding = 'utf-8') as f:
+                f.write(''.join(term + '\n' for term in self.vocabulary))
+            os.replace(os.path.join(path, 'vocabulary.txt.tmp'), os.path.join(path, 'vocabulary.txt'))
+        self.terms = {term: i for i, term in enumerate(self.vocabulary)}
+        version = self.manifest['version']
+        self.docs = pd.read_pickle(os.path.join(path, f'docs-{version}.pkl'))
+        stats = np.load(os.path.join(path, f'stats-{version}.npz'))
+        self.docfreq = stats['docfreq']
+        self.counts = stats['counts']
+
+    @classmethod
+    def create(cls, path, lemmatizer = 'spacy', pos = POS, stopwords = frozenset(), model = 'de_core_news_sm', compounds = None):
+        '''
+        Creates an empty store in the folder path (an existing store is replaced). The tokenizer options are
+        used for all appends (see dtm.DTMBuilder for the params).
+
+        Returns:
+         TermStore: store
+        '''
+        os.makedirs(os.path.join(path, 'segments'), exist_ok = True)
+        for file in os.listdir(os.path.join(path, 'segments')):
+            os.remove(os.path.join(path, 'segments', file))
+        options = {'lemmatizer': lemmatizer, 'pos': list(pos), 'stopwords': sorted(stopwords), 'model': model,
+                   'compounds': [c if isinstance(c, str) else ' '.join(c) for c in compounds] if compounds is not None else None}
+        for file in os.listdir(path):
+            if re.fullmatch(r'docs-\d+\.pkl|stats-\d+\.npz', file):
+                os.remove(os.path.join(path, file))
+        with open(os.path.join(path, 'vocabulary.txt'), 'w', encoding = 'utf-8') as f:
+            pass
+        pd.DataFrame(columns = DOC_COLUMNS + ['segment', 'row', 'active']).to_pickle(os.path.join(path, 'docs-0.pkl'))
+        np.savez(os.path.join(path, 'stats-0.npz'), docfreq = np.zeros(0, np.int64), counts = np.zeros(0, np.int64))
+        cls._write_json(os.path.join(path, 'store.json'), {'options': options, 'segments': [], 'terms': 0, 'version': 0})
+        return cls(path)
+
+    @staticmethod
+    def _write_json(file, data):
+        with open(file + '.tmp', 'w', encoding = 'utf-8') as f:
+            json.dump(data, f, ensure_ascii = False)
+        os.replace(file + '.tmp', file)
+
+    def _segment(self, segment):
+        matrix = sparse.load_npz(os.path.join(self.path, 'segments', f'{segment}.npz')).tocsr()
+        matrix.resize((matrix.shape[0], len(self.vocabulary))) # terms added after the segment
+        return matrix
+
+    def _rows(self, docs):
+        '''
+        Returns the counts of the given documents (rows of self.docs) as CSR matrix, in the same order.
+        '''
+        parts, order = [], []
+        for segment, group in docs.groupby('segment', sort = True):
+            parts.append(self._segment(int(segment))[group['row'].to_numpy(dtype = np.int64)])
+            order.append(group.index.to_numpy())
+        if not parts:
+            return sparse.csr_matrix((0, len(self.vocabulary)), dtype = np.int64)
+        position = pd.Series(np.arange(len(docs)), index = docs.index)[np.concatenate(order)].to_numpy()
+        return sparse.vstack(parts, format = 'csr')[np.argsort(position)]
+
+    def _add_stats(self, matrix, sign):
+        matrix = matrix.tocsc()
+        length = len(self.vocabulary)
+        self.docfreq = np.pad(self.docfreq, (0, length - len(self.docfreq))) + sign * np.diff(matrix.indptr)
+        self.counts = np.pad(self.counts, (0, length - len(self.counts))) + sign * np.asarray(matrix.sum(axis = 0)).ravel().astype(np.int64)
+
+    def append(self, df, column = 'text', workers = 1, chunksize = 10):
+        '''
+        Tokenizes the texts of a dataframe (1 document per row, see dtm.count_terms) and appends their counts
+        as new segment. Documents of protocols, which are already in the store, are replaced (marked inactive).
+
+        Params:
+         pd.DataFrame: df (party shares of new or changed protocols, with the columns in DOC_COLUMNS)
+         str: column (text column)
+         int: workers, chunksize (see parallel.map_protocols)
+
+        Returns:
+         TermStore: self
+        '''
+        if not len(df):
+            return self
+        with stage('term_store', df, column):
+            options = dict(self.options, pos = tuple(self.options['pos']), stopwords = frozenset(self.options['stopwords']),
+                           compounds = compound_table(self.options['compounds']) if self.options['compounds'] else None)
+            counts = map_protocols(count_terms, df, [column], workers, chunksize, column = column, **options)
+
+            new_terms = []
+            indptr, indices, data = [0], [], []
+            for doc in counts['counts']:
+                for term, n in doc.items():
+                    if term not in self.terms:
+                        self.terms[term] = len(self.vocabulary)
+                        self.vocabulary.append(term)
+                        new_terms.append(term)
+                    indices.append(self.terms[term])
+                    data.append(n)
+                indptr.append(len(indices))
+            matrix = sparse.csr_matrix((np.array(data, dtype = np.int32), np.array(indices, dtype = np.int32), indptr),
+                                       shape = (len(df), len(self.vocabulary)))
+
+            # Replaced documents: no longer counted in the statistics
+            replaced = self.docs['active'].astype(bool) & self.docs['id'].isin(set(df['id'].astype(str)))
+            if replaced.any():
+                self._add_stats(self._rows(self.docs[replaced]), -1)
+                self.docs.loc[replaced, 'active'] = False
+            self._add_stats(matrix, 1)
+
+            segment = max(self.manifest['segments'], default = -1) + 1
+            sparse.save_npz(os.path.join(self.path, 'segments', f'{segment}.npz'), matrix, compressed = True)
+            docs = df[[c for c in DOC_COLUMNS if c in df]].reset_index(drop = True)
+            docs['id'] = docs['id'].astype(str)
+            docs['datum'] = pd.to_datetime(docs['datum'])
+            docs['segment'], docs['row'], docs['active'] = segment, np.arange(len(docs)), True
+            self.docs = pd.concat([self.docs, docs], ignore_index = True) if len(self.docs) else docs
+
+            self.manifest['segments'].append(segment)
+            self.manifest['terms'] = len(self.vocabulary)
+            self._save(new_terms)
+        return self
+
+    def _save(self, new_terms = ()):
+        if new_terms:
+            with open(os.path.join(self.path, 'vocabulary.txt'), 'a', encoding = 'utf-8') as f:
+                f.write(''.join(term + '\n' for term in new_terms))
+        # New versions of docs and stats, the old ones stay valid until store.json points to the new ones
+        old, version = self.manifest['version'], self.manifest['version'] + 1
+        self.docs.to_pickle(os.path.join(self.path, f'docs-{version}.pkl'))
+        with open(os.path.join(self.path, f'stats-{version}.npz'), 'wb') as f:
+            np.savez(f, docfreq = self.docfreq, counts = self.counts)
+        self.manifest['version'] = version
+        self._write_json(os.path.join(self.path, 'store.json'), self.manifest) # last: the store is complete
+        for file in (f'docs-{old}.pkl', f'stats-{old}.npz'):
+            os.remove(os.path.join(self.path, file))
+
+    def compact(self):
+        '''
+        Rewrites all active documents into one segment and deletes the old segments (and the replaced documents).
+        '''
+        docs = self.docs[self.docs['active'].astype(bool)]
+        docs = docs.sort_values(['datum', 'segment', 'row'], kind = 'stable')
+        matrix = self._rows(docs)
+        old = list(self.manifest['segments'])
+        segment = max(old, default = -1) + 1
+        sparse.save_npz(os.path.join(self.path, 'segments', f'{segment}.npz'), matrix, compressed = True)
+        self.docs = docs.reset_index(drop = True).assign(segment = segment, row = np.arange(len(docs)))
+        self.manifest['segments'] = [segment]
+        self._save()
+        for s in old:
+            os.remove(os.path.join(self.path, 'segments', f'{s}.npz'))
+        return self
+
+    def ids(self):
+        '''
+        Returns the ids of all protocols in the store.
+        '''
+        return set(self.docs.loc[self.docs['active'].astype(bool), 'id'])
+
+    def term_stats(self):
+        '''
+        Returns document frequency and count of every term over all documents in the store.
+        '''
+        return pd.DataFrame({'term': self.vocabulary, 'docfreq': self.docfreq, 'count': self.counts})
+
+    def buckets(self, docs, freq):
+        '''
+        Returns the time bucket of every document: the start of the period of its datum (freq, e.g. 'MS' = month,
+        'QS' = quarter, 'YS' = year) or its wahlperiode (freq = 'period').
+        '''
+        if freq == 'period':
+            return docs['wahlperiode']
+        return docs['datum'].dt.to_period(freq[:-1] if freq.endswith('S') else freq).dt.start_time
+
+    def matrix(self, start = None, end = None, freq = None, min_docfreq = 0, max_docfreq = 1, min_count = 1, drop_empty = True,
+               docfreq = 'window', **filters):
+        '''
+        Returns the document-term matrix of the documents within start and end (dates, inclusive) and the filters,
+        ordered by datum, pruned like dtm.DTMBuilder.finish. Only the segments of these documents are read.
+
+        Params:
+         str: start, end (optional, dates, inclusive)
+         str: freq (optional, see buckets: adds the columns bucket and time_index (1, 2, ... in order of the buckets,
+                    like time_index of keyATM with model = "dynamic"))
+         float: min_docfreq, max_docfreq, int: min_count, bool: drop_empty (see dtm.DTMBuilder.finish)
+         str: docfreq ('window': thresholds relative to the selected documents, 'store': to all documents in the store,
+                       from the kept statistics)
+         filters: only documents with these values, e.g. party = 'AfD', text_type = 'main_text' (see corpus_stats.filter_mask)
+
+        Returns:
+         DocumentTermMatrix: dtm
+        '''
+        active = self.docs[self.docs['active'].astype(bool)]
+        docs = active[filter_mask(active, start, end, **filters)].sort_values('datum', kind = 'stable')
+        matrix = self._rows(docs)
+
+        if docfreq == 'window':
+            n_docs, frequency = matrix.shape[0], np.diff(matrix.tocsc().indptr)
+            counts = np.asarray(matrix.sum(axis = 0)).ravel()
+        elif docfreq == 'store':
+            n_docs, frequency, counts = len(active), self.docfreq, self.counts
+        else:
+            raise ValueError(f"docfreq must be 'window' or 'store', not {docfreq!r}")
+        low = min_docfreq * n_docs if min_docfreq < 1 else min_docfreq
+        high = max_docfreq * n_docs if max_docfreq <= 1 else max_docfreq
+        keep = np.flatnonzero((frequency >= low) & (frequency <= high) & (counts >= min_count) & (frequency > 0))
+
+        matrix = matrix[:, keep].tocsr()
+        docs = docs[[c for c in DOC_COLUMNS if c in docs]].reset_index(drop = True)
+        if drop_empty:
+            rows = np.flatnonzero(matrix.getnnz(axis = 1))
+            matrix, docs = matrix[rows], docs.iloc[rows].reset_index(drop = True)
+        if freq is not None:
+            docs['bucket'] = self.buckets(docs, freq).to_numpy()
+            docs['time_index'] = pd.factorize(docs['bucket'], sort = True)[0] + 1
+        terms = np.array(self.vocabulary, dtype = object)
+        return DocumentTermMatrix(matrix, terms[keep].tolist(), docs)
+
+    def slices(self, freq = 'YS', start = None, end = None, **kwargs):
+        '''
+        Yields (bucket, DocumentTermMatrix) for every time bucket (see buckets), each pruned on its own documents
+        (kwargs: see matrix).
+        '''
+        filters = {k: v for k, v in kwargs.items() if k not in ('min_docfreq', 'max_docfreq', 'min_count', 'drop_empty', 'docfreq')}
+        active = self.docs[self.docs['active'].astype(bool)]
+        docs = active[filter_mask(active, start, end, **filters)]
+        buckets = self.buckets(docs, freq)
+        for bucket in sorted(buckets.dropna().unique()):
+            selected = docs[(buckets == bucket).to_numpy()]
+            yield bucket, self.matrix(selected['datum'].min(), selected['datum'].max(),
+                                      **dict(kwargs, **({'wahlperiode': bucket} if freq == 'period' else {})))
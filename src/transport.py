@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+# Transport of the current run (see use_transport), None = live DIP API over a normal HTTPAdapter
+_active = None
+
+
+def fixture_key(resource, params):
+    '''
+    Returns the file name of the fixture of a request: resource and parameters (without apikey and format), sorted.
+    '''
+    params = sorted((k, str(v)) for k, v in params if k not in ('apikey', 'format'))
+    h = hashlib.sha1(json.dumps([resource, params], ensure_ascii = False).encode('utf-8')).hexdigest()
+    return f"{resource.replace('/', '_')}-{h[:16]}.json"
+
+
+def parse_request(url):
+    '''
+    Returns resource (path after /api/v1/) and parameters (list of pairs) of a request url.
+    '''
+    parts = urlsplit(url)
+    resource = parts.path.split('/api/v1/', 1)[-1].strip('/')
+    return resource, parse_qsl(parts.query, keep_blank_values = True)
+
+
+def save_fixture(path, resource, params, body, status = 200, headers = None):
+    '''
+    Stores a response as fixture (<path>/<fixture_key>.json), e.g. to write fixtures by hand.
+
+    Params:
+     str: path (folder)
+     str: resource (e.g. 'plenarprotokoll-text/908')
+     list/dict: params (query parameters)
+     str/dict: body (JSON text or data)
+     int: status
+     dict: headers
+    '''
+    params = list(params.items()) if isinstance(params, dict) else list(params)
+    params = [(k, str(x)) for k, v in params for x in (v if isinstance(v, (list, tuple)) else [v])]
+    os.makedirs(path, exist_ok = True)
+    body = body if isinstance(body, str) else json.dumps(body, ensure_ascii = False)
+    fixture = {'resource': resource, 'params': params, 'status': status, 'headers': headers or {}, 'body': body}
+    with open(os.path.join(path, fixture_key(resource, params)), 'w', encoding = 'utf-8') as f:
+        json.dump(fixture, f, ensure_ascii = False)
+
+
+def load_fixture(path, resource, params):
+    '''
+    Returns the fixture of a request or None.
+    '''
+    file = os.path.join(path, fixture_key(resource, params))
+    if not os.path.exists(file):
+        return None
+    with open(file, encoding = 'utf-8') as f:
+        return json.load(f)
+
+
+class FaultInjector:
+    '''
+    Decides for every request, how it behaves (deterministic for the same seed and order of requests):
+    a delay (latency + random jitter) and optionally an error instead of the response.
+
+    Params:
+     float: latency (seconds per request)
+     float: jitter (additional random delay between 0 and jitter seconds)
+     float: error_rate (share of requests answered with one of the status codes in errors)
+     tuple: errors (status codes, e.g. (500, 503))
+     float: timeout_rate (share of requests, which time out)
+     float: rate_limit (max. requests per second, more are answered with 429 and a Retry-After header)
+     int: retry_after (seconds, Retry-After of the 429 responses)
+     int: seed
+    '''
+    def __init__(self, latency = 0, jitter = 0, error_rate = 0, errors = (500, 503), timeout_rate = 0, rate_limit = None,
+                 retry_after = 1, seed = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.errors = tuple(errors)
+        self.timeout_rate = timeout_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = deque() # times of the requests in the last second
+        self.stats = {'requests': 0, 'ok': 0, 'errors': 0, 'timeouts': 0, 'rate_limited': 0, 'missing': 0}
+
+    def decide(self):
+        '''
+        Returns the delay (in seconds) and the fault of the next request: None, 'timeout' or a status code.
+        '''
+        with self.lock:
+            self.stats['requests'] += 1
+            delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+            draw = self.rng.random()
+            if self.rate_limit:
+                now = time.monotonic()
+                while self.recent and now - self.recent[0] >= 1:
+                    self.recent.popleft()
+                if len(self.recent) >= self.rate_limit:
+                    self.stats['rate_limited'] += 1
+                    return 0, 429
+                self.recent.append(now)
+            if draw < self.timeout_rate:
+                self.stats['timeouts'] += 1
+                return delay, 'timeout'
+            if draw < self.timeout_rate + self.error_rate:
+                self.stats['errors'] += 1
+                return delay, self.errors[int(draw * 1e6) % len(self.errors)]
+            return delay, None
+
+    def respond(self, path, url):
+        '''
+        Returns status, headers and body for a request url (the fixture or the injected fault) after the delay.
+        '''
+        delay, fault = self.decide()
+        if fault == 429:
+            return 429, {'Retry-After': str(self.retry_after)}, json.dumps({'code': 429, 'message': 'Too Many Requests'})
+        time.sleep(delay)
+        if fault == 'timeout':
+            return 'timeout', {}, ''
+        if fault is not None:
+            return fault, {}, json.dumps({'code': fault, 'message': 'Injected error'})
+
+        fixture = load_fixture(path, *parse_request(url))
+        with self.lock:
+            self.stats['ok' if fixture is not None else 'missing'] += 1
+        if fixture is None:
+            return 404, {}, json.dumps({'code': 404, 'message': 'No fixture for this request'})
+        return fixture['status'], fixture['headers'], fixture['body']
+
+
+def make_response(request, status, headers, body):
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body.encode('utf-8')
+    response.encoding = 'utf-8'
+    response.url = request.url
+    response.request = request
+    response.reason = 'OK' if status == 200 else 'Error'
+    return response
+
+
+class RecordingAdapter(HTTPAdapter):
+    '''
+    Sends the requests to the live API (like the normal HTTPAdapter) and stores every response as fixture in `path`
+    (see save_fixture), so it can be replayed later without network (see ReplayAdapter, ReplayServer).
+    '''
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        resource, params = parse_request(request.url)
+        headers = {k: v for k, v in response.headers.items() if k.lower() in ('content-type', 'retry-after')}
+        save_fixture(self.path, resource, params, response.text, response.status_code, headers)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    '''
+    Answers the requests in-process from the fixtures in `path` (no network), with injected latency,
+    errors, timeouts and rate limiting (kwargs: see FaultInjector). Requests without fixture get 404.
+    The counts of all outcomes are in stats.
+    '''
+    def __init__(self, path, **kwargs):
+        super().__init__()
+        self.path = path
+        self.injector = FaultInjector(**kwargs)
+        self.stats = self.injector.stats
+
+    def send(self, request, stream = False, timeout = None, verify = True, cert = None, proxies = None):
+        status, headers, body = self.injector.respond(self.path, request.url)
+        if status == 'timeout':
+            raise requests.Timeout(f'Injected timeout: {request.url}', request = request)
+        return make_response(request, status, headers, body)
+
+    def close(self):
+        pass
+
+
+class ReplayServer:
+    '''
+    Local stand-in for the DIP API: an HTTP server (in a background thread), which answers from the fixtures in `path`
+    like ReplayAdapter (kwargs: see FaultInjector). Timeouts close the connection without answer.
+
+    with ReplayServer('fixtures', latency = 0.05, rate_limit = 10) as server, use_transport(base_url = server.url):
+        textdata = get_textdata(concurrent = True)
+    '''
+    def __init__(self, path, host = '127.0.0.1', port = 0, **kwargs):
+        injector = FaultInjector(**kwargs)
+        self.stats = injector.stats
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, headers, body = injector.respond(path, self.path)
+                if status == 'timeout':
+                    self.close_connection = True
+                    return
+                data = body.encode('utf-8')
+                self.send_response(status)
+                for k, v in {'Content-Type': 'application/json', **headers}.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_address[1]}/api/v1/'
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+@contextmanager
+def use_transport(adapter = None, base_url = None):
+    '''
+    Sends all requests of dip_client (and so of load_data and people) within the with block
+    over the given adapter (e.g. RecordingAdapter or ReplayAdapter) and/or to another base url (e.g. ReplayServer.url).
+
+    Params:
+     requests.adapters.BaseAdapter: adapter (optional)
+     str: base_url (optional, instead of dip_client.DIP_URL)
+
+    Returns:
+     adapter
+    '''
+    global _active
+    previous, _active = _active, {'adapter': adapter, 'base_url': base_url}
+    try:
+        yield adapter
+    finally:
+        _active = previous
+
+
+def get_adapter():
+    '''
+    Returns the adapter of the active transport or None.
+    '''
+    return _active['adapter'] if _active is not None else None
+
+
+def get_base_url(default):
+    '''
+    Returns the base url of the active transport or default.
+    '''
+    return (_active or {}).get('base_url') or default